@@ -1,138 +1,331 @@
 import zmq
-import json
-import sys
 import time
+import queue
+import argparse
+import threading
+
+import codec
+from particiones import MapaParticiones, ClienteParticionado
+import registro
+import metricas
+import control
+import trazas
+from metricas import Metricas
+from control import ServidorControl
+from perfilador import Perfilador
+
+log = registro.obtener("actor")
+log_solicitudes = registro.solicitudes("actor")
+
+LATIDO_S = 1.0
+CONFIRMACIONES = "inproc://trabajos_confirmaciones"
 
 class Actor:
-    def __init__(self, tipo_actor, gc_ip, gc_pub_port, ga_req_port):
+    def __init__(self, tipo_actor, gc_ip, gc_trabajos_port, ga_req_port, formato=codec.FORMATO_JSON,
+                 mapa=None, particion=None, capacidad=1, puerto_control=None, dir_perfiles="perfiles",
+                 trazador=None):
         """
         Actor que procesa operaciones del sistema
         
         Args:
             tipo_actor: "devolucion" o "renovacion"
             gc_ip: IP del Gestor de Carga (formato: tcp://10.43.103.177)
-            gc_pub_port: puerto PUB del Gestor de Carga
+            gc_trabajos_port: puerto ROUTER de la cola de trabajos del Gestor de Carga
             ga_req_port: puerto REP del Gestor de Almacenamiento
+            formato: formato preferido con el GA (se negocia) y con el GC
+            mapa: MapaParticiones; cada operación va al GA dueño del libro (None = un solo GA)
+            particion: atender solo los trabajos de esta partición
+            capacidad: trabajos que el GC le entrega sin esperar su confirmación; se atienden
+                       en paralelo, cada uno en su hilo con sus propias conexiones al GA
+            puerto_control: puerto REP de control con el comando stats (None = sin control)
+            dir_perfiles: directorio de los perfiles que se piden por el socket de control
+            trazador: Trazador; continúa las trazas que llegan en los trabajos
         """
         self.tipo = tipo_actor
         self.context = zmq.Context()
         
+        # Latencias por operación; se consultan por el socket de control
+        self.metricas = Metricas(f"actor_{tipo_actor}" + (f"_{particion}" if particion else ""))
+        self.perfilador = Perfilador(self.metricas.proceso, dir_perfiles)
+        self.control = ServidorControl(self.context, puerto_control, self.metricas, self.perfilador) if puerto_control else None
+        self.trazas = trazador or trazas.INACTIVO
+        self.formato = formato
+        
         if tipo_actor in ["devolucion", "renovacion"]:
-            # Patrón PUB-SUB para operaciones asíncronas
-            self.socket_sub = self.context.socket(zmq.SUB)
-            self.socket_sub.connect(f"{gc_ip}:{gc_pub_port}")
-            self.socket_sub.setsockopt(zmq.SUBSCRIBE, tipo_actor.encode())
-            print(f" Actor {tipo_actor.upper()} suscrito al canal '{tipo_actor}'")
-            print(f" GC PUB: {gc_ip}:{gc_pub_port}")
-        
-        # Socket para comunicarse con GA
-        self.socket_ga = self.context.socket(zmq.REQ)
-        self.socket_ga.connect(f"{gc_ip}:{ga_req_port}")
-        
-        print(f" Conectado al GA en {gc_ip}:{ga_req_port}\n")
+            # DEALER en la cola de trabajos del GC: los actores de un canal compiten por
+            # los trabajos y cada uno confirma los suyos después de que responde el GA
+            self.socket_gc = self.context.socket(zmq.DEALER)
+            self.socket_gc.setsockopt(zmq.LINGER, 0)
+            self.socket_gc.connect(f"{gc_ip}:{gc_trabajos_port}")
+            # Con particiones el GC encola en "tipo.particion"; "tipo" atiende todas
+            self.canal = f"{tipo_actor}.{particion}" if particion else tipo_actor
+            self.capacidad = capacidad
+            self.registrarse()
+            log.info(f" Actor {tipo_actor.upper()} registrado en el canal '{self.canal}' (capacidad {capacidad})")
+            log.info(f" GC cola de trabajos: {gc_ip}:{gc_trabajos_port}")
+        
+        # Los trabajos recibidos esperan acá a un hilo libre
+        self.pendientes = queue.Queue()
+        
+        # Sockets REQ con el GA (o uno por partición, según el mapa): un REQ espera su
+        # respuesta antes de la próxima solicitud, así que cada hilo tiene los suyos
+        self.mapa = mapa
+        self.ga_endpoint = f"{gc_ip}:{ga_req_port}"
+        self.local = threading.local()
+        if mapa:
+            log.info(f" Catálogo en {len(mapa.particiones)} particiones (mapa versión {mapa.version})")
+        else:
+            log.info(f" Conectado al GA en {gc_ip}:{ga_req_port}")
+    
+    def conexiones(self):
+        """Conexiones del hilo actual con el GA; se crean con su primer trabajo"""
+        local = self.local
+        if not hasattr(local, "formato_ga"):
+            local.formato_ga = None  # se negocia con la primera solicitud
+            local.cliente_particiones = None
+            local.socket_ga = None
+            if self.mapa:
+                local.cliente_particiones = ClienteParticionado(self.context, self.mapa, self.formato)
+            else:
+                local.socket_ga = self.context.socket(zmq.REQ)
+                local.socket_ga.connect(self.ga_endpoint)
+        return local
+    
+    def registrarse(self):
+        """
+        Alta en la cola del GC; se repite cada LATIDO_S como latido, así un GC
+        reiniciado vuelve a conocer al actor
+        """
+        self.socket_gc.send_multipart([b"", codec.codificar({
+            "operacion": codec.REGISTRO_ACTOR,
+            "canal": self.canal,
+            "capacidad": self.capacidad,
+            "formatos": list(codec.FORMATOS),
+            "latido_s": LATIDO_S
+        })])
+        self.ultimo_latido = time.monotonic()
+    
+    def confirmacion(self, respuesta):
+        """
+        Confirmación para el GC de que el GA respondió (aceptada o rechazada): el trabajo
+        sale de la cola. Si el actor cae antes, el GC lo entrega de nuevo
+        """
+        return codec.codificar({"resultado": metricas.resultado(respuesta)})
     
-    def procesar_devolucion_async(self):
-        """Procesa devoluciones (modo asíncrono vía PUB-SUB)"""
-        print(" Esperando devoluciones...\n")
+    def solicitar_ga(self, solicitud, span=trazas.SPAN_INACTIVO):
+        """Envía una solicitud al GA y devuelve su respuesta (registra la ida y vuelta)"""
+        local = self.conexiones()
+        inicio = time.perf_counter()
+        metricas.sellar(solicitud)
+        
+        with span.hijo(f"ga:{solicitud['operacion']}") as llamada:
+            llamada.propagar(solicitud)
+            if local.cliente_particiones:
+                respuesta = local.cliente_particiones.solicitar(solicitud)
+            else:
+                if local.formato_ga is None:
+                    local.formato_ga = codec.negociar(local.socket_ga, self.formato)
+                
+                local.socket_ga.send(codec.codificar(solicitud, local.formato_ga))
+                respuesta, _ = codec.decodificar(local.socket_ga.recv())
+            llamada.resultado = metricas.resultado(respuesta)
+        
+        self.metricas.registrar(f"ga:{solicitud['operacion']}", metricas.resultado(respuesta),
+                                time.perf_counter() - inicio)
+        return respuesta
+    
+    def procesar_trabajos(self, procesar, nombre):
+        """
+        Recibe los trabajos de la cola del GC y los reparte entre `capacidad` hilos, que
+        los atienden en paralelo; sus confirmaciones vuelven al GC por este hilo, el único
+        que usa el socket DEALER (y el que late mientras los hilos esperan al GA)
+        
+        Args:
+            procesar: procesar_devolucion o procesar_renovacion
+            nombre: nombre de las operaciones en el registro ("devoluciones" o "renovaciones")
+        """
+        log.info(f" Esperando {nombre}...")
+        
+        confirmaciones = self.context.socket(zmq.PULL)
+        confirmaciones.bind(CONFIRMACIONES)
+        for numero in range(self.capacidad):
+            threading.Thread(target=self.atender_trabajos, args=(procesar,),
+                             name=f"{self.tipo}-{numero + 1}", daemon=True).start()
+        
+        poller = zmq.Poller()
+        poller.register(self.socket_gc, zmq.POLLIN)
+        poller.register(confirmaciones, zmq.POLLIN)
         
         while True:
             try:
-                # Recibir del canal: "devolucion usuario,libro"
-                mensaje = self.socket_sub.recv_string()
-                topico, contenido = mensaje.split(" ", 1)
-                usuario, libro = contenido.split(",", 1)
-                
-                print(f" DEVOLUCIÓN | Usuario: {usuario} | Libro: {libro}")
-                
-                # Enviar a GA para actualizar BD
-                solicitud = {
-                    "operacion": "devolucion",
-                    "codigo": libro.strip(),
-                    "usuario": usuario.strip()
-                }
+                if time.monotonic() - self.ultimo_latido >= LATIDO_S:
+                    self.registrarse()
+                eventos = dict(poller.poll(LATIDO_S * 1000))
                 
-                self.socket_ga.send_string(json.dumps(solicitud))
-                respuesta_json = self.socket_ga.recv_string()
-                respuesta = json.loads(respuesta_json)
+                # Confirmaciones de los hilos: se reenvían al GC con el id de su trabajo
+                if confirmaciones in eventos:
+                    while True:
+                        try:
+                            self.socket_gc.send_multipart(confirmaciones.recv_multipart(zmq.NOBLOCK))
+                        except zmq.error.Again:
+                            break
                 
-                if respuesta["exito"]:
-                    print(f" {respuesta['mensaje']}\n")
-                else:
-                    print(f" {respuesta['mensaje']}\n")
-                
-                time.sleep(0.1)
+                # Trabajos de la cola: [id, {operacion, usuario, libro, id_operacion}], con su hora de llegada
+                if self.socket_gc in eventos:
+                    while True:
+                        try:
+                            identificador, mensaje = self.socket_gc.recv_multipart(zmq.NOBLOCK)
+                        except zmq.error.Again:
+                            break
+                        self.pendientes.put((identificador, mensaje, time.time()))
                 
             except KeyboardInterrupt:
-                print("\n Deteniendo Actor de Devoluciones...")
+                log.info(f" Deteniendo Actor de {nombre.capitalize()}...")
                 break
             except Exception as e:
-                print(f" Error procesando devolución: {e}\n")
+                log.exception(f" Error recibiendo {nombre}: {e}")
+                self.metricas.incrementar("errores")
     
-    def procesar_renovacion_async(self):
-        """Procesa renovaciones (modo asíncrono vía PUB-SUB)"""
-        print(" Esperando renovaciones...\n")
+    def atender_trabajos(self, procesar):
+        """Hilo de trabajo: atiende uno a la vez los trabajos de la cola"""
+        confirmaciones = self.context.socket(zmq.PUSH)
+        confirmaciones.connect(CONFIRMACIONES)
         
         while True:
+            identificador, mensaje, recibido = self.pendientes.get()
             try:
-                # Recibir del canal: "renovacion usuario,libro"
-                mensaje = self.socket_sub.recv_string()
-                topico, contenido = mensaje.split(" ", 1)
-                usuario, libro = contenido.split(",", 1)
-                
-                print(f" RENOVACIÓN | Usuario: {usuario} | Libro: {libro}")
-                
-                # Enviar a GA para actualizar BD
-                solicitud = {
-                    "operacion": "renovacion",
-                    "codigo": libro.strip(),
-                    "usuario": usuario.strip()
-                }
-                
-                self.socket_ga.send_string(json.dumps(solicitud))
-                respuesta_json = self.socket_ga.recv_string()
-                respuesta = json.loads(respuesta_json)
-                
-                if respuesta["exito"]:
-                    print(f" {respuesta['mensaje']} - Nueva fecha: {respuesta.get('nueva_fecha', 'N/A')}\n")
-                else:
-                    print(f" {respuesta['mensaje']}\n")
-                
-                time.sleep(0.1)
-                
-            except KeyboardInterrupt:
-                print("\n Deteniendo Actor de Renovaciones...")
-                break
+                if self.perfilador.activo:
+                    self.perfilador.revisar()
+                inicio = time.perf_counter()
+                trabajo, _ = codec.decodificar(mensaje)
+                respuesta = procesar(trabajo)
             except Exception as e:
-                print(f" Error procesando renovación: {e}\n")
+                # Sin confirmación: el GC lo entrega de nuevo cuando vence
+                log.exception(f" Error procesando {self.tipo}: {e}")
+                self.metricas.incrementar("errores")
+                continue
+            
+            confirmaciones.send_multipart([identificador, self.confirmacion(respuesta)])
+            self.metricas.registrar(self.tipo, metricas.resultado(respuesta),
+                                    time.perf_counter() - inicio, metricas.espera(trabajo, recibido))
+    
+    def procesar_devolucion(self, trabajo):
+        """
+        Aplica una devolución en el GA
+        
+        Args:
+            trabajo: dict con usuario, libro e id_operacion (y el contexto de traza, si viene)
+        
+        Returns:
+            la respuesta del GA
+        """
+        usuario, libro = trabajo["usuario"], trabajo["libro"]
+        
+        with self.trazas.span(self.tipo, trabajo, codigo=libro.strip()) as span:
+            log_solicitudes.debug(" DEVOLUCIÓN | Usuario: %s | Libro: %s", usuario, libro)
+            
+            # Enviar a GA para actualizar BD
+            # El GA descarta un id_operacion que ya aplicó (la cola puede entregar dos veces)
+            solicitud = {
+                "operacion": "devolucion",
+                "codigo": libro.strip(),
+                "usuario": usuario.strip(),
+                "id_operacion": trabajo.get("id_operacion")
+            }
+            
+            respuesta = self.solicitar_ga(solicitud, span)
+            
+            if respuesta["exito"]:
+                log_solicitudes.debug(" %s", respuesta["mensaje"])
+            else:
+                log_solicitudes.debug(" %s", respuesta["mensaje"])
+            
+            span.resultado = metricas.resultado(respuesta)
+        return respuesta
+    
+    def procesar_renovacion(self, trabajo):
+        """
+        Aplica una renovación en el GA
+        
+        Args:
+            trabajo: dict con usuario, libro e id_operacion (y el contexto de traza, si viene)
+        
+        Returns:
+            la respuesta del GA
+        """
+        usuario, libro = trabajo["usuario"], trabajo["libro"]
+        
+        with self.trazas.span(self.tipo, trabajo, codigo=libro.strip()) as span:
+            log_solicitudes.debug(" RENOVACIÓN | Usuario: %s | Libro: %s", usuario, libro)
+            
+            # Enviar a GA para actualizar BD
+            # El GA descarta un id_operacion que ya aplicó (la cola puede entregar dos veces)
+            solicitud = {
+                "operacion": "renovacion",
+                "codigo": libro.strip(),
+                "usuario": usuario.strip(),
+                "id_operacion": trabajo.get("id_operacion")
+            }
+            
+            respuesta = self.solicitar_ga(solicitud, span)
+            
+            if respuesta["exito"]:
+                log_solicitudes.debug(" %s - Nueva fecha: %s", respuesta["mensaje"], respuesta.get("nueva_fecha", "N/A"))
+            else:
+                log_solicitudes.debug(" %s", respuesta["mensaje"])
+            
+            span.resultado = metricas.resultado(respuesta)
+        return respuesta
     
     def ejecutar(self):
         """Inicia el procesamiento según el tipo de actor"""
         if self.tipo == "devolucion":
-            self.procesar_devolucion_async()
+            self.procesar_trabajos(self.procesar_devolucion, "devoluciones")
         elif self.tipo == "renovacion":
-            self.procesar_renovacion_async()
+            self.procesar_trabajos(self.procesar_renovacion, "renovaciones")
         else:
-            print(f" Tipo de actor desconocido: {self.tipo}")
+            log.error(f" Tipo de actor desconocido: {self.tipo}")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 5:
-        print("Uso: python actor.py <tipo> <gc_ip> <gc_pub_port> <ga_req_port>")
-        print("\nEjemplos:")
-        print("  Sede 1: python actor.py devolucion tcp://10.43.103.177 5556 5557")
-        print("  Sede 2: python actor.py devolucion tcp://10.43.103.132 5566 5558")
-        print("\nTipos: devolucion, renovacion")
-        sys.exit(1)
-    
-    tipo_actor = sys.argv[1].lower()
-    GC_IP = sys.argv[2]
-    GC_PUB_PORT = sys.argv[3]
-    GA_REQ_PORT = sys.argv[4]
+    parser = argparse.ArgumentParser(
+        description="Actor de devoluciones o renovaciones",
+        epilog="Ejemplos:\n"
+               "  Sede 1: python actor.py devolucion tcp://10.43.103.177 5556 5557\n"
+               "  Sede 2: python actor.py devolucion tcp://10.43.103.132 5566 5558",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("tipo", type=str.lower, choices=["devolucion", "renovacion"], help="tipo de actor")
+    parser.add_argument("gc_ip", help="IP del Gestor de Carga (formato: tcp://10.43.103.177)")
+    parser.add_argument("gc_trabajos_port", help="puerto de la cola de trabajos del Gestor de Carga")
+    parser.add_argument("ga_req_port", help="puerto REP del Gestor de Almacenamiento")
+    parser.add_argument("--formato", choices=codec.FORMATOS, default=codec.FORMATO_JSON,
+                        help="formato preferido para hablar con el GA (se negocia)")
+    parser.add_argument("--mapa", default=None,
+                        help="archivo JSON del mapa de particiones (cada operación va al GA dueño del libro)")
+    parser.add_argument("--particion", default=None,
+                        help="atender solo las operaciones de esta partición")
+    parser.add_argument("--capacidad", type=int, default=1,
+                        help="trabajos que el GC entrega a este actor sin esperar su confirmación "
+                             "(se atienden en paralelo, un hilo por trabajo)")
+    registro.agregar_argumentos(parser)
+    control.agregar_argumentos(parser)
+    trazas.agregar_argumentos(parser)
+    args = parser.parse_args()
+    proceso = f"actor_{args.tipo}" + (f"_{args.particion}" if args.particion else "")
+    registro.configurar_desde_args(proceso, args)
     
     actor = Actor(
-        tipo_actor=tipo_actor,
-        gc_ip=GC_IP,
-        gc_pub_port=GC_PUB_PORT,
-        ga_req_port=GA_REQ_PORT
+        tipo_actor=args.tipo,
+        gc_ip=args.gc_ip,
+        gc_trabajos_port=args.gc_trabajos_port,
+        ga_req_port=args.ga_req_port,
+        formato=args.formato,
+        mapa=MapaParticiones.cargar(args.mapa) if args.mapa else None,
+        particion=args.particion,
+        capacidad=args.capacidad,
+        puerto_control=args.puerto_control,
+        dir_perfiles=args.perfiles_dir,
+        trazador=trazas.desde_args(proceso, args)
     )
     
     actor.ejecutar()
\ No newline at end of file
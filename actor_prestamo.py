@@ -1,106 +1,349 @@
 import zmq
-import json
-import sys
 import time
+import queue
+import argparse
+import threading
+
+import codec
+from particiones import MapaParticiones, ClienteParticionado
+import registro
+import metricas
+import control
+import trazas
+from metricas import Metricas
+from control import ServidorControl
+from perfilador import Perfilador
+
+log = registro.obtener("actor_prestamo")
+log_solicitudes = registro.solicitudes("actor_prestamo")
+
+LATIDO_S = 1.0
+RESPUESTAS = "inproc://prestamos_respuestas"
 
 class ActorPrestamo:
-    def __init__(self, gc_ip, gc_prestamo_port, ga_req_port):
+    def __init__(self, gc_ip, gc_prestamo_port, ga_req_port, formato=codec.FORMATO_JSON,
+                 replica_endpoint=None, max_antiguedad_s=5.0, timeout_replica_ms=300, mapa=None,
+                 capacidad=1, puerto_control=None, dir_perfiles="perfiles", trazador=None):
         """
         Actor que procesa operaciones de PRÉSTAMO de forma SÍNCRONA
         
         Args:
             gc_ip: IP del Gestor de Carga (formato: tcp://10.43.103.177)
-            gc_prestamo_port: puerto donde GC envía solicitudes de préstamo
+            gc_prestamo_port: puerto ROUTER del GC donde se registran los Actores Préstamo
             ga_req_port: puerto del Gestor de Almacenamiento
+            formato: formato preferido con el GA (se negocia; las respuestas al GC
+                     usan el formato de cada solicitud)
+            replica_endpoint: endpoint de lecturas de la réplica para pre-chequear disponibilidad
+                              (None = todo va al GA)
+            max_antiguedad_s: antigüedad máxima de la réplica para confiar en un rechazo
+            timeout_replica_ms: espera máxima por la respuesta de la réplica
+            mapa: MapaParticiones; cada préstamo va al GA dueño del libro (None = un solo GA)
+            capacidad: préstamos que el GC puede enviarle sin esperar respuesta; se atienden
+                       en paralelo, cada uno en su hilo con sus propias conexiones al GA y la réplica
+            puerto_control: puerto REP de control con el comando stats (None = sin control)
+            dir_perfiles: directorio de los perfiles que se piden por el socket de control
+            trazador: Trazador; continúa las trazas que llegan en las solicitudes del GC
         """
         self.context = zmq.Context()
         
-        # Socket REP: recibe solicitudes de préstamo del GC
-        self.socket_rep = self.context.socket(zmq.REP)
-        self.socket_rep.connect(f"{gc_ip}:{gc_prestamo_port}")
+        # Latencias por operación y contadores del pre-chequeo; se consultan por el socket de control
+        self.metricas = Metricas("actor_prestamo")
+        self.perfilador = Perfilador(self.metricas.proceso, dir_perfiles)
+        self.control = ServidorControl(self.context, puerto_control, self.metricas, self.perfilador) if puerto_control else None
+        self.trazas = trazador or trazas.INACTIVO
+        self.formato = formato
+        
+        # Pre-chequeo opcional en la réplica: los rechazos no llegan al GA
+        self.replica_endpoint = replica_endpoint
+        self.max_antiguedad = max_antiguedad_s
+        self.timeout_replica = timeout_replica_ms
+        
+        # Socket DEALER: se registra en el pool del GC y recibe préstamos [id, solicitud]
+        self.capacidad = capacidad
+        self.socket_gc = self.context.socket(zmq.DEALER)
+        self.socket_gc.setsockopt(zmq.LINGER, 0)
+        self.socket_gc.connect(f"{gc_ip}:{gc_prestamo_port}")
+        self.ultimo_latido = 0.0
+        
+        # Los préstamos recibidos esperan acá a un hilo libre
+        self.pendientes = queue.Queue()
+        
+        # Sockets REQ con el GA (o uno por partición, según el mapa) y la réplica: un REQ
+        # espera su respuesta antes de la próxima solicitud, así que cada hilo tiene los suyos
+        self.mapa = mapa
+        self.ga_endpoint = f"{gc_ip}:{ga_req_port}"
+        self.local = threading.local()
+        
+        log.info(f" Actor PRÉSTAMO iniciado")
+        log.info(f" Conectado al GC en {gc_ip}:{gc_prestamo_port} (capacidad {capacidad})")
+        if mapa:
+            log.info(f" Catálogo en {len(mapa.particiones)} particiones (mapa versión {mapa.version})")
+        else:
+            log.info(f" Conectado al GA en {gc_ip}:{ga_req_port}")
+        if replica_endpoint:
+            log.info(f" Pre-chequeo en réplica {replica_endpoint} (antigüedad máxima {max_antiguedad_s}s)")
+        log.info(f" Formato preferido: {formato}")
+    
+    def conexiones(self):
+        """Conexiones del hilo actual con el GA y la réplica; se crean con su primer préstamo"""
+        local = self.local
+        if not hasattr(local, "formato_ga"):
+            local.formato_ga = None  # se negocia con la primera solicitud
+            local.socket_replica = None
+            local.formato_replica = None
+            local.cliente_particiones = None
+            local.socket_ga = None
+            if self.mapa:
+                local.cliente_particiones = ClienteParticionado(self.context, self.mapa, self.formato)
+            else:
+                local.socket_ga = self.context.socket(zmq.REQ)
+                local.socket_ga.connect(self.ga_endpoint)
+        return local
+    
+    def solicitar_ga(self, solicitud, span=trazas.SPAN_INACTIVO):
+        """Envía una solicitud al GA y devuelve su respuesta (registra la ida y vuelta)"""
+        local = self.conexiones()
+        inicio = time.perf_counter()
+        metricas.sellar(solicitud)
+        
+        with span.hijo(f"ga:{solicitud['operacion']}") as llamada:
+            llamada.propagar(solicitud)
+            if local.cliente_particiones:
+                respuesta = local.cliente_particiones.solicitar(solicitud)
+            else:
+                if local.formato_ga is None:
+                    local.formato_ga = codec.negociar(local.socket_ga, self.formato)
+                
+                local.socket_ga.send(codec.codificar(solicitud, local.formato_ga))
+                respuesta, _ = codec.decodificar(local.socket_ga.recv())
+            llamada.resultado = metricas.resultado(respuesta)
+        
+        self.metricas.registrar(f"ga:{solicitud['operacion']}", metricas.resultado(respuesta),
+                                time.perf_counter() - inicio)
+        return respuesta
+    
+    def consultar_replica(self, codigo, span=trazas.SPAN_INACTIVO):
+        """
+        Pre-chequeo de disponibilidad en la réplica
+        
+        Returns:
+            la respuesta, o None si no hay réplica, no respondió a tiempo o sus datos
+            son más viejos que max_antiguedad_s
+        """
+        if not self.replica_endpoint:
+            return None
+        
+        local = self.conexiones()
+        if local.socket_replica is None:
+            local.socket_replica = self.context.socket(zmq.REQ)
+            local.socket_replica.setsockopt(zmq.LINGER, 0)
+            local.socket_replica.setsockopt(zmq.RCVTIMEO, self.timeout_replica)
+            local.socket_replica.connect(self.replica_endpoint)
+            local.formato_replica = None
         
-        # Socket REQ: comunica con GA
-        self.socket_ga = self.context.socket(zmq.REQ)
-        self.socket_ga.connect(f"{gc_ip}:{ga_req_port}")
+        inicio = time.perf_counter()
+        with span.hijo("replica:verificar_disponibilidad") as llamada:
+            try:
+                if local.formato_replica is None:
+                    local.formato_replica = codec.negociar(local.socket_replica, self.formato)
+                
+                consulta = {"operacion": "verificar_disponibilidad", "codigo": codigo}
+                local.socket_replica.send(codec.codificar(
+                    llamada.propagar(metricas.sellar(consulta)), local.formato_replica))
+                respuesta, _ = codec.decodificar(local.socket_replica.recv())
+                llamada.resultado = metricas.resultado(respuesta)
+            except zmq.error.Again:
+                # Sin respuesta: el REQ queda bloqueado, se descarta y se reconecta en la próxima
+                local.socket_replica.close()
+                local.socket_replica = None
+                llamada.resultado = "timeout"
+                self.metricas.registrar("replica:verificar_disponibilidad", "timeout", time.perf_counter() - inicio)
+                self.metricas.incrementar("replica_no_disponible")
+                return None
+        
+        self.metricas.registrar("replica:verificar_disponibilidad", metricas.resultado(respuesta),
+                                time.perf_counter() - inicio)
         
-        print(f" Actor PRÉSTAMO iniciado")
-        print(f" Conectado al GC en {gc_ip}:{gc_prestamo_port}")
-        print(f" Conectado al GA en {gc_ip}:{ga_req_port}\n")
+        antiguedad = respuesta.get("antiguedad_s")
+        if antiguedad is None or antiguedad > self.max_antiguedad:
+            return None
+        return respuesta
+    
+    def registrarse(self):
+        """
+        Alta en el pool del GC; se repite cada LATIDO_S como latido, así un GC
+        reiniciado vuelve a conocer al actor
+        """
+        self.socket_gc.send_multipart([b"", codec.codificar({
+            "operacion": codec.REGISTRO_ACTOR,
+            "capacidad": self.capacidad,
+            "formatos": list(codec.FORMATOS),
+            "latido_s": LATIDO_S
+        })])
+        self.ultimo_latido = time.monotonic()
     
     def procesar_prestamos(self):
-        """Procesa solicitudes de préstamo de forma síncrona"""
-        print(" Esperando solicitudes de préstamo...\n")
+        """
+        Recibe los préstamos del GC y los reparte entre `capacidad` hilos, que los
+        atienden en paralelo; sus respuestas vuelven al GC por este hilo, el único
+        que usa el socket DEALER
+        """
+        log.info(" Esperando solicitudes de préstamo...")
+        
+        respuestas = self.context.socket(zmq.PULL)
+        respuestas.bind(RESPUESTAS)
+        for numero in range(self.capacidad):
+            threading.Thread(target=self.atender_prestamos, name=f"prestamo-{numero + 1}", daemon=True).start()
+        
+        poller = zmq.Poller()
+        poller.register(self.socket_gc, zmq.POLLIN)
+        poller.register(respuestas, zmq.POLLIN)
         
         while True:
             try:
-                # 1. Recibir solicitud del GC
-                mensaje = self.socket_rep.recv_string()
-                solicitud = json.loads(mensaje)
-                
-                print(f" PRÉSTAMO SÍNCRONO | Usuario: {solicitud['usuario']} | Libro: {solicitud['codigo']}")
-                
-                # 2. Verificar disponibilidad en GA
-                verificacion = {
-                    "operacion": "verificar_disponibilidad",
-                    "codigo": solicitud["codigo"]
-                }
+                if time.monotonic() - self.ultimo_latido >= LATIDO_S:
+                    self.registrarse()
+                eventos = dict(poller.poll(LATIDO_S * 1000))
                 
-                self.socket_ga.send_string(json.dumps(verificacion))
-                respuesta_verificacion = json.loads(self.socket_ga.recv_string())
+                # Respuestas de los hilos: se reenvían al GC con el id de su solicitud
+                if respuestas in eventos:
+                    while True:
+                        try:
+                            self.socket_gc.send_multipart(respuestas.recv_multipart(zmq.NOBLOCK))
+                        except zmq.error.Again:
+                            break
                 
-                if not respuesta_verificacion.get("disponible", False):
-                    # Libro no disponible
-                    print(f" {respuesta_verificacion['mensaje']}\n")
-                    self.socket_rep.send_string(json.dumps({
-                        "exito": False,
-                        "mensaje": respuesta_verificacion["mensaje"]
-                    }))
-                    continue
+                # Préstamos del GC: a la cola, con su hora de llegada
+                if self.socket_gc in eventos:
+                    while True:
+                        try:
+                            identificador, mensaje = self.socket_gc.recv_multipart(zmq.NOBLOCK)
+                        except zmq.error.Again:
+                            break
+                        self.pendientes.put((identificador, mensaje, time.time()))
                 
-                # 3. Realizar préstamo en GA
-                prestamo_solicitud = {
-                    "operacion": "prestamo",
-                    "codigo": solicitud["codigo"],
-                    "usuario": solicitud["usuario"]
-                }
+            except KeyboardInterrupt:
+                log.info(" Deteniendo Actor de Préstamos...")
+                break
+            except Exception as e:
+                log.exception(f" Error recibiendo préstamos: {e}")
+                self.metricas.incrementar("errores")
+    
+    def atender_prestamos(self):
+        """Hilo de préstamo: atiende uno a la vez los préstamos de la cola"""
+        respuestas = self.context.socket(zmq.PUSH)
+        respuestas.connect(RESPUESTAS)
+        
+        while True:
+            identificador, mensaje, recibido = self.pendientes.get()
+            respuestas.send_multipart([identificador, self.procesar_prestamo(mensaje, recibido)])
+    
+    def procesar_prestamo(self, mensaje, recibido):
+        """
+        Procesa un préstamo de forma síncrona
+        
+        Args:
+            mensaje: solicitud del GC, codificada
+            recibido: hora en que llegó al actor
+        
+        Returns:
+            la respuesta codificada en el formato de la solicitud
+        """
+        formato = codec.FORMATO_JSON
+        try:
+            if self.perfilador.activo:
+                self.perfilador.revisar()
+            inicio = time.perf_counter()
+            solicitud, formato = codec.decodificar(mensaje)
+            
+            with self.trazas.span("prestamo", solicitud, codigo=solicitud["codigo"]) as span:
+                log_solicitudes.debug(" PRÉSTAMO SÍNCRONO | Usuario: %s | Libro: %s", solicitud["usuario"], solicitud["codigo"])
                 
-                self.socket_ga.send_string(json.dumps(prestamo_solicitud))
-                respuesta_prestamo = json.loads(self.socket_ga.recv_string())
+                # 1. Pre-chequeo en la réplica: si no hay ejemplares se responde sin pasar por el GA
+                pre_chequeo = self.consultar_replica(solicitud["codigo"], span)
                 
-                # 4. Responder al GC
-                self.socket_rep.send_string(json.dumps(respuesta_prestamo))
+                if pre_chequeo and not pre_chequeo.get("disponible"):
+                    self.metricas.incrementar("rechazos_replica")
+                    respuesta_prestamo = {"exito": False, "mensaje": pre_chequeo["mensaje"]}
+                    log_solicitudes.debug(" Rechazado por la réplica (antigüedad %ss)", pre_chequeo["antiguedad_s"])
+                else:
+                    # 2. Verificar disponibilidad y prestar en GA (una sola ida y vuelta).
+                    #    Con id_operacion el GA no presta dos veces la misma solicitud
+                    prestamo_solicitud = {
+                        "operacion": "prestamo_condicional",
+                        "codigo": solicitud["codigo"],
+                        "usuario": solicitud["usuario"],
+                        "id_operacion": solicitud.get("id_operacion")
+                    }
+                    
+                    respuesta_prestamo = self.solicitar_ga(prestamo_solicitud, span)
                 
                 if respuesta_prestamo.get("exito", False):
-                    print(f" {respuesta_prestamo['mensaje']} - Fecha devolución: {respuesta_prestamo.get('fecha_devolucion', 'N/A')}\n")
+                    log_solicitudes.debug(" %s - Fecha devolución: %s", respuesta_prestamo["mensaje"],
+                                          respuesta_prestamo.get("fecha_devolucion", "N/A"))
                 else:
-                    print(f" {respuesta_prestamo['mensaje']}\n")
-                
-                time.sleep(0.1)
+                    log_solicitudes.debug(" %s", respuesta_prestamo["mensaje"])
                 
-            except KeyboardInterrupt:
-                print("\n Deteniendo Actor de Préstamos...")
-                break
-            except Exception as e:
-                print(f" Error procesando préstamo: {e}")
-                try:
-                    self.socket_rep.send_string(json.dumps({
-                        "exito": False,
-                        "mensaje": f"Error del sistema: {str(e)}"
-                    }))
-                except:
-                    pass
+                span.resultado = metricas.resultado(respuesta_prestamo)
+            
+            self.metricas.registrar("prestamo", metricas.resultado(respuesta_prestamo),
+                                    time.perf_counter() - inicio, metricas.espera(solicitud, recibido))
+            
+            # 3. Responder al GC (el hilo principal la reenvía con el id de la solicitud)
+            return codec.codificar(respuesta_prestamo, formato)
+            
+        except Exception as e:
+            log.exception(f" Error procesando préstamo: {e}")
+            self.metricas.incrementar("errores")
+            return codec.codificar({
+                "exito": False,
+                "mensaje": f"Error del sistema: {str(e)}"
+            }, formato)
 
 if __name__ == "__main__":
-    if len(sys.argv) < 4:
-        print("Uso: python actor_prestamo.py <gc_ip> <gc_prestamo_port> <ga_req_port>")
-        print("\nEjemplos:")
-        print("  Sede 1: python actor_prestamo.py tcp://10.43.103.177 5570 5557")
-        print("  Sede 2: python actor_prestamo.py tcp://10.43.103.132 5571 5558")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Actor de préstamo",
+        epilog="Ejemplos:\n"
+               "  Sede 1: python actor_prestamo.py tcp://10.43.103.177 5570 5557\n"
+               "  Sede 2: python actor_prestamo.py tcp://10.43.103.132 5571 5558",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("gc_ip", help="IP del Gestor de Carga (formato: tcp://10.43.103.177)")
+    parser.add_argument("gc_prestamo_port", help="puerto del GC donde se registran los Actores Préstamo")
+    parser.add_argument("ga_req_port", help="puerto del Gestor de Almacenamiento")
+    parser.add_argument("--formato", choices=codec.FORMATOS, default=codec.FORMATO_JSON,
+                        help="formato preferido para hablar con el GA (se negocia)")
+    parser.add_argument("--replica", default=None,
+                        help="endpoint de lecturas de la réplica para pre-chequear disponibilidad "
+                             "(ej: tcp://10.43.103.132:5562)")
+    parser.add_argument("--max-antiguedad-s", type=float, default=5.0,
+                        help="antigüedad máxima de la réplica para rechazar sin consultar al GA")
+    parser.add_argument("--timeout-replica-ms", type=int, default=300,
+                        help="espera máxima por la respuesta de la réplica")
+    parser.add_argument("--mapa", default=None,
+                        help="archivo JSON del mapa de particiones (cada préstamo va al GA dueño del libro)")
+    parser.add_argument("--capacidad", type=int, default=1,
+                        help="préstamos que el GC puede enviarle sin esperar respuesta (se atienden en paralelo)")
+    registro.agregar_argumentos(parser)
+    control.agregar_argumentos(parser)
+    trazas.agregar_argumentos(parser)
+    args = parser.parse_args()
+    registro.configurar_desde_args("actor_prestamo", args)
     
-    GC_IP = sys.argv[1]
-    GC_PRESTAMO_PORT = sys.argv[2]
-    GA_REQ_PORT = sys.argv[3]
+    if args.mapa and args.replica:
+        # La réplica de una sola partición no conoce el resto del catálogo
+        parser.error("--replica no se puede combinar con --mapa")
     
-    actor = ActorPrestamo(GC_IP, GC_PRESTAMO_PORT, GA_REQ_PORT)
+    actor = ActorPrestamo(
+        args.gc_ip, args.gc_prestamo_port, args.ga_req_port,
+        formato=args.formato,
+        replica_endpoint=args.replica,
+        max_antiguedad_s=args.max_antiguedad_s,
+        timeout_replica_ms=args.timeout_replica_ms,
+        mapa=MapaParticiones.cargar(args.mapa) if args.mapa else None,
+        capacidad=args.capacidad,
+        puerto_control=args.puerto_control,
+        dir_perfiles=args.perfiles_dir,
+        trazador=trazas.desde_args("actor_prestamo", args)
+    )
     actor.procesar_prestamos()
\ No newline at end of file
@@ -0,0 +1,154 @@
+"""
+Control de admision del Gestor de Carga
+
+Dos limites, ambos opcionales:
+    en curso: maximo de solicitudes de una operacion que el GC tiene aceptadas y
+              sin responder (los prestamos que esperan a un Actor Prestamo).
+    tasa: un cubo de tokens por cliente (cada PS conectado): `tasa` solicitudes
+          por segundo con rafagas de hasta `rafaga`.
+
+Una solicitud que excede un limite se responde al momento con
+{"exito": false, "ocupado": true, "reintentar_ms": N}, en lugar de esperar en
+las colas hasta que el cliente se canse: la latencia de las que si se aceptan
+no crece con la sobrecarga.
+"""
+import random
+import time
+from collections import OrderedDict
+
+MOTIVO_EN_CURSO = "en_curso"
+MOTIVO_TASA = "tasa"
+
+
+class CuboTokens:
+    def __init__(self, tasa, rafaga):
+        """
+        Args:
+            tasa: tokens que se reponen por segundo
+            rafaga: tokens maximos acumulados (el cubo empieza lleno)
+        """
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.tokens = float(rafaga)
+        self.ultimo = time.monotonic()
+
+    def tomar(self, ahora):
+        """
+        Toma un token si hay
+
+        Returns:
+            0 si lo tomo, o los segundos que faltan para el proximo token
+        """
+        self.tokens = min(self.rafaga, self.tokens + (ahora - self.ultimo) * self.tasa)
+        self.ultimo = ahora
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.tasa
+
+
+class ControlAdmision:
+    def __init__(self, max_en_curso=None, tasa_cliente=0, rafaga_cliente=None, reintentar_ms=100,
+                 max_clientes=10000, metricas=None):
+        """
+        Args:
+            max_en_curso: operacion -> maximo de solicitudes aceptadas sin responder
+            tasa_cliente: solicitudes por segundo por cliente (0 = sin limite)
+            rafaga_cliente: solicitudes seguidas que acepta un cliente sin esperar
+                            (None = un segundo de tasa)
+            reintentar_ms: espera sugerida cuando se excede un limite de en curso
+                           (se le suma hasta un 50% al azar, para no sincronizar reintentos)
+            max_clientes: cubos que se guardan; se descartan los de los clientes
+                          que hace mas que no envian
+            metricas: Metricas donde contar las solicitudes descartadas
+        """
+        self.max_en_curso = dict(max_en_curso or {})
+        self.en_curso = {operacion: 0 for operacion in self.max_en_curso}
+        self.tasa_cliente = tasa_cliente
+        self.rafaga_cliente = rafaga_cliente or max(tasa_cliente, 1)
+        self.reintentar_ms = reintentar_ms
+        self.max_clientes = max_clientes
+        self.metricas = metricas
+        self.descartadas = {}
+
+        # cliente -> CuboTokens, del menos al mas reciente
+        self._cubos = OrderedDict()
+
+    @property
+    def activo(self):
+        return bool(self.max_en_curso) or self.tasa_cliente > 0
+
+    def admitir(self, cliente, operacion):
+        """
+        Decide si se acepta una solicitud; si se acepta, cuenta como en curso hasta terminar()
+
+        Args:
+            cliente: identidad del cliente (la del ROUTER)
+            operacion: tipo de la solicitud
+
+        Returns:
+            None si se acepta, o la respuesta "ocupado" para el cliente
+        """
+        # El limite de en curso va primero: una solicitud que se descarta por el no
+        # gasta un token del cliente
+        limite = self.max_en_curso.get(operacion)
+        if limite is not None and self.en_curso[operacion] >= limite:
+            return self._descartar(operacion, MOTIVO_EN_CURSO,
+                                   self.reintentar_ms * random.uniform(1.0, 1.5))
+
+        if self.tasa_cliente > 0:
+            espera = self._cubo(cliente).tomar(time.monotonic())
+            if espera:
+                return self._descartar(operacion, MOTIVO_TASA, espera * 1000)
+
+        if limite is not None:
+            self.en_curso[operacion] += 1
+        return None
+
+    def terminar(self, operacion):
+        """La solicitud admitida ya se respondio"""
+        if operacion in self.en_curso:
+            self.en_curso[operacion] -= 1
+
+    def _cubo(self, cliente):
+        cubo = self._cubos.get(cliente)
+        if cubo is None:
+            cubo = self._cubos[cliente] = CuboTokens(self.tasa_cliente, self.rafaga_cliente)
+            if len(self._cubos) > self.max_clientes:
+                self._cubos.popitem(last=False)
+        else:
+            self._cubos.move_to_end(cliente)
+        return cubo
+
+    def _descartar(self, operacion, motivo, reintentar_ms):
+        clave = f"{operacion}:{motivo}"
+        self.descartadas[clave] = self.descartadas.get(clave, 0) + 1
+        if self.metricas:
+            self.metricas.incrementar(f"descartadas:{clave}")
+
+        reintentar_ms = max(int(reintentar_ms), 1)
+        return {
+            "exito": False,
+            "ocupado": True,
+            "reintentar_ms": reintentar_ms,
+            "mensaje": f"Gestor de Carga ocupado. Reintente en {reintentar_ms} ms."
+        }
+
+    def estado(self):
+        return {
+            "max_en_curso": self.max_en_curso,
+            "en_curso": dict(self.en_curso),
+            "tasa_cliente": self.tasa_cliente,
+            "rafaga_cliente": self.rafaga_cliente,
+            "clientes": len(self._cubos),
+            "descartadas": dict(self.descartadas)
+        }
+
+
+def limite_en_curso(texto):
+    """Argumento "operacion=N" de --max-en-curso -> (operacion, N)"""
+    operacion, _, limite = texto.partition("=")
+    try:
+        return operacion.strip().lower(), int(limite)
+    except ValueError:
+        raise ValueError(f"se esperaba operacion=N: {texto}")
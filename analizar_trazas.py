@@ -0,0 +1,203 @@
+"""
+Analisis de las trazas escritas por los procesos (--trazas-archivo)
+
+Junta los spans de todos los archivos, reconstruye cada solicitud como un arbol
+(PS -> GC -> actor -> GA -> replica) y muestra:
+    - las solicitudes mas lentas con su arbol y su camino critico: la cadena de
+      spans sincronicos que determina la duracion de la solicitud, con el tiempo
+      propio de cada uno (su duracion menos la del siguiente en la cadena). El
+      tiempo propio de un span de llamada ("ga:devolucion", "actor:prestamo")
+      es la red y la cola del otro lado.
+    - percentiles por salto (proceso/span) de la duracion y del tiempo propio.
+
+Los spans que empiezan despues de que termino su padre (la devolucion que el GC
+encola, la aplicacion en la replica) son asincronicos: aparecen en el arbol
+pero no en el camino critico.
+"""
+import argparse
+import glob
+import json
+import re
+import sys
+from collections import defaultdict
+
+from metricas import Histograma
+
+COLUMNAS = ("n", "p50_ms", "p90_ms", "p99_ms", "max_ms")
+
+
+def leer_spans(archivos):
+    """Spans de los archivos JSON lines, agrupados por traza"""
+    trazas = defaultdict(list)
+    for archivo in archivos:
+        with open(archivo, encoding="utf-8") as f:
+            for numero, linea in enumerate(f, 1):
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    span = json.loads(linea)
+                except json.JSONDecodeError:
+                    print(f" {archivo}:{numero}: linea invalida, se omite", file=sys.stderr)
+                    continue
+                span["fin"] = span["inicio"] + span["duracion_ms"] / 1000
+                trazas[span["traza"]].append(span)
+    return trazas
+
+
+def _salto(span):
+    """Nombre del salto sin el numero de sede/particion del proceso (ga_sede1_p2 -> ga)"""
+    proceso = re.sub(r"_sede\d+(_\w+)?$", "", span["proceso"], flags=re.IGNORECASE)
+    return f"{proceso}/{span['nombre']}"
+
+
+class Traza:
+    def __init__(self, identificador, spans):
+        self.id = identificador
+        self.spans = spans
+        self.hijos = defaultdict(list)
+        ids = {span["span"] for span in spans}
+        self.raices = []
+        for span in spans:
+            if span.get("padre") in ids:
+                self.hijos[span["padre"]].append(span)
+            else:
+                # Sin padre, o su padre esta en un archivo que no se leyo
+                self.raices.append(span)
+        for hijos in self.hijos.values():
+            hijos.sort(key=lambda span: span["inicio"])
+        self.raices.sort(key=lambda span: span["inicio"])
+        self.raiz = self.raices[0]
+
+    @property
+    def duracion_ms(self):
+        return self.raiz["duracion_ms"]
+
+    def sincronicos(self, span):
+        """Hijos que empiezan antes de que termine el span"""
+        return [hijo for hijo in self.hijos[span["span"]] if hijo["inicio"] < span["fin"]]
+
+    def camino_critico(self):
+        """
+        Returns:
+            lista de (span, tiempo propio en ms) desde la raiz; los tiempos suman
+            la duracion de la raiz
+        """
+        camino = []
+        span = self.raiz
+        while True:
+            hijos = self.sincronicos(span)
+            if not hijos:
+                camino.append((span, span["duracion_ms"]))
+                return camino
+            siguiente = max(hijos, key=lambda hijo: hijo["fin"])
+            camino.append((span, max(span["duracion_ms"] - siguiente["duracion_ms"], 0.0)))
+            span = siguiente
+
+    def tiempo_propio(self, span):
+        """Duracion del span menos la de sus hijos sincronicos (sin solaparlos)"""
+        ocupado = 0.0
+        cursor = span["inicio"]
+        for hijo in self.sincronicos(span):
+            inicio = max(hijo["inicio"], cursor)
+            fin = min(hijo["fin"], span["fin"])
+            if fin > inicio:
+                ocupado += fin - inicio
+                cursor = fin
+        return max(span["duracion_ms"] - ocupado * 1000, 0.0)
+
+    def mostrar(self):
+        print(f"\n Traza {self.id}: {_salto(self.raiz)} {self.duracion_ms:.3f} ms"
+              + (f" ({len(self.raices)} raices: faltan archivos de algun proceso)" if len(self.raices) > 1 else ""))
+        origen = self.raiz["inicio"]
+        for raiz in self.raices:
+            self._mostrar_span(raiz, origen, 0, None)
+
+        print("   Camino critico:")
+        for span, propio in self.camino_critico():
+            porcentaje = propio / self.duracion_ms * 100 if self.duracion_ms else 0
+            print(f"     {_salto(span):40} {propio:10.3f} ms  {porcentaje:5.1f}%")
+
+    def _mostrar_span(self, span, origen, nivel, padre):
+        asincronico = padre is not None and span["inicio"] >= padre["fin"]
+        resultado = f" [{span['resultado']}]" if span.get("resultado") else ""
+        print(f"   +{(span['inicio'] - origen) * 1000:9.3f} ms {span['duracion_ms']:10.3f} ms  "
+              f"{'  ' * nivel}{span['proceso']}/{span['nombre']}{resultado}"
+              + (" (asinc)" if asincronico else ""))
+        for hijo in self.hijos[span["span"]]:
+            self._mostrar_span(hijo, origen, nivel + 1, span)
+
+
+def _fila(nombre, histograma):
+    resumen = histograma.resumen()
+    return [nombre] + [str(resumen.get(columna, "-")) for columna in COLUMNAS]
+
+
+def _tabla(encabezado, filas):
+    anchos = [max(len(fila[i]) for fila in filas + [encabezado]) for i in range(len(encabezado))]
+    for fila in [encabezado] + filas:
+        print(("   " + "  ".join(texto.ljust(ancho) for texto, ancho in zip(fila, anchos))).rstrip())
+
+
+def mostrar_percentiles(trazas):
+    """Percentiles por salto de la duracion y del tiempo propio, y de la duracion total por operacion"""
+    totales = defaultdict(Histograma)
+    duraciones = defaultdict(Histograma)
+    propios = defaultdict(Histograma)
+
+    for traza in trazas:
+        totales[_salto(traza.raiz)].registrar(traza.duracion_ms / 1000)
+        for span in traza.spans:
+            duraciones[_salto(span)].registrar(span["duracion_ms"] / 1000)
+            propios[_salto(span)].registrar(traza.tiempo_propio(span) / 1000)
+
+    print("\n Duracion de extremo a extremo por operacion de entrada:")
+    _tabla(["operacion"] + list(COLUMNAS), [_fila(nombre, totales[nombre]) for nombre in sorted(totales)])
+
+    print("\n Duracion por salto:")
+    _tabla(["salto"] + list(COLUMNAS), [_fila(nombre, duraciones[nombre]) for nombre in sorted(duraciones)])
+
+    print("\n Tiempo propio por salto (sin sus llamadas sincronicas):")
+    _tabla(["salto"] + list(COLUMNAS), [_fila(nombre, propios[nombre]) for nombre in sorted(propios)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Analiza las trazas de solicitudes escritas por los procesos",
+        epilog="Ejemplos:\n"
+               "  python analizar_trazas.py 'trazas/*.jsonl'\n"
+               "  python analizar_trazas.py trazas/*.jsonl --operacion prestamo --lentas 3\n"
+               "  python analizar_trazas.py trazas/*.jsonl --traza 9f2c4e1a0b7d3c55",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("archivos", nargs="+", help="archivos de trazas (se aceptan patrones)")
+    parser.add_argument("--traza", default=None, help="mostrar solo esta traza")
+    parser.add_argument("--operacion", default=None, help="solo las solicitudes con esta operacion de entrada")
+    parser.add_argument("--lentas", type=int, default=5, help="solicitudes mas lentas a detallar")
+    args = parser.parse_args()
+
+    archivos = sorted({archivo for patron in args.archivos for archivo in (glob.glob(patron) or [patron])})
+    try:
+        spans = leer_spans(archivos)
+    except OSError as e:
+        print(f" Error leyendo trazas: {e}")
+        sys.exit(1)
+
+    if args.traza:
+        if args.traza not in spans:
+            print(f" No hay spans de la traza {args.traza}")
+            sys.exit(1)
+        Traza(args.traza, spans[args.traza]).mostrar()
+        sys.exit(0)
+
+    trazas = [Traza(identificador, lista) for identificador, lista in spans.items()]
+    if args.operacion:
+        trazas = [traza for traza in trazas if traza.raiz["nombre"] == args.operacion]
+    if not trazas:
+        print(" No hay trazas")
+        sys.exit(1)
+
+    print(f" {len(trazas)} solicitudes trazadas en {len(archivos)} archivos")
+    for traza in sorted(trazas, key=lambda traza: traza.duracion_ms, reverse=True)[:args.lentas]:
+        traza.mostrar()
+    mostrar_percentiles(trazas)
@@ -0,0 +1,241 @@
+"""
+Anti-entropia entre la BD primaria y la replica con un arbol Merkle
+
+Las tablas libros y prestamos se reparten en buckets por rango de codigo (ISBN).
+Los limites de los buckets los define la primaria a partir de su catalogo; la
+replica usa los mismos (se comparan por su digest). El hash de un bucket es la
+suma de los hashes de sus filas, asi que no depende del orden ni de los id de
+prestamos. Los buckets son las hojas de un arbol de grado FANOUT: comparando
+las raices y bajando solo por los nodos distintos, el trafico es proporcional a
+los rangos que cambiaron y no al tamano del catalogo.
+"""
+import bisect
+import hashlib
+import threading
+
+TAM_BUCKET = 256
+FANOUT = 16
+_MODULO = 1 << 128
+
+_LIBROS = "SELECT codigo, titulo, autor, ejemplares_totales, ejemplares_disponibles FROM libros"
+_PRESTAMOS = "SELECT codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones FROM prestamos"
+
+
+def calcular_limites(conn, tam_bucket=TAM_BUCKET):
+    """Limite inferior de cada bucket: uno cada tam_bucket libros en orden de codigo"""
+    limites = [""]
+    for numero, (codigo,) in enumerate(conn.execute("SELECT codigo FROM libros ORDER BY codigo")):
+        if numero and numero % tam_bucket == 0:
+            limites.append(codigo)
+    return limites
+
+
+def digest_limites(limites):
+    return hashlib.sha256("\n".join(limites).encode("utf-8")).hexdigest()[:32]
+
+
+def _hash_fila(tabla, fila):
+    return int.from_bytes(hashlib.blake2b((tabla + repr(tuple(fila))).encode("utf-8"), digest_size=16).digest(), "big")
+
+
+def _hoja(suma, cantidad):
+    return hashlib.sha256(f"{cantidad}:{suma % _MODULO}".encode("ascii")).hexdigest()[:32]
+
+
+def _rango(limites, indice):
+    """Condicion SQL y parametros del rango de codigos de un bucket"""
+    if indice + 1 < len(limites):
+        return "codigo >= ? AND codigo < ?", (limites[indice], limites[indice + 1])
+    return "codigo >= ?", (limites[indice],)
+
+
+def hash_buckets(conn, limites):
+    """Hash de todos los buckets con una sola pasada por cada tabla"""
+    sumas = [0] * len(limites)
+    cantidades = [0] * len(limites)
+
+    for tabla, consulta in (("L", _LIBROS), ("P", _PRESTAMOS)):
+        for fila in conn.execute(consulta):
+            indice = bisect.bisect_right(limites, fila[0]) - 1
+            sumas[indice] += _hash_fila(tabla, fila)
+            cantidades[indice] += 1
+
+    return [_hoja(suma, cantidad) for suma, cantidad in zip(sumas, cantidades)]
+
+
+def hash_bucket(conn, limites, indice):
+    """Hash de un bucket leyendo solo su rango (usa los indices por codigo)"""
+    condicion, parametros = _rango(limites, indice)
+    suma = 0
+    cantidad = 0
+
+    for tabla, consulta in (("L", _LIBROS), ("P", _PRESTAMOS)):
+        for fila in conn.execute(f"{consulta} WHERE {condicion}", parametros):
+            suma += _hash_fila(tabla, fila)
+            cantidad += 1
+
+    return _hoja(suma, cantidad)
+
+
+def leer_bucket(conn, limites, indice):
+    """Filas de libros y prestamos de un bucket, para repararlo en la replica"""
+    condicion, parametros = _rango(limites, indice)
+    libros = [list(fila) for fila in conn.execute(f"{_LIBROS} WHERE {condicion}", parametros)]
+    prestamos = [list(fila) for fila in conn.execute(f"{_PRESTAMOS} WHERE {condicion}", parametros)]
+    return libros, prestamos
+
+
+def reparar_bucket(cursor, limites, indice, libros, prestamos):
+    """Reemplaza el contenido de un bucket, en la transaccion abierta, por las filas de la primaria"""
+    condicion, parametros = _rango(limites, indice)
+
+    cursor.execute(f"DELETE FROM prestamos WHERE {condicion}", parametros)
+    cursor.execute(f"DELETE FROM libros WHERE {condicion}", parametros)
+    cursor.executemany(
+        "INSERT INTO libros (codigo, titulo, autor, ejemplares_totales, ejemplares_disponibles) VALUES (?, ?, ?, ?, ?)",
+        libros
+    )
+    cursor.executemany(
+        "INSERT INTO prestamos (codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones) VALUES (?, ?, ?, ?, ?)",
+        prestamos
+    )
+
+
+class ArbolMerkle:
+    def __init__(self, hojas, fanout=FANOUT):
+        """
+        Arbol de hashes sobre las hojas (buckets)
+
+        niveles[0] son las hojas y niveles[-1] contiene solo la raiz. Los hijos
+        del nodo i de un nivel son los nodos i*fanout .. i*fanout+fanout-1 del nivel inferior.
+        """
+        self.fanout = fanout
+        self.niveles = [list(hojas)]
+        while len(self.niveles[-1]) > 1:
+            inferior = self.niveles[-1]
+            self.niveles.append([self._combinar(inferior[i:i + fanout])
+                                 for i in range(0, len(inferior), fanout)])
+
+    @staticmethod
+    def _combinar(hashes):
+        return hashlib.sha256("".join(hashes).encode("ascii")).hexdigest()[:32]
+
+    @property
+    def raiz(self):
+        return self.niveles[-1][0]
+
+    @property
+    def altura(self):
+        return len(self.niveles)
+
+    def hijos(self, nivel, indice):
+        inicio = indice * self.fanout
+        return range(inicio, min(inicio + self.fanout, len(self.niveles[nivel - 1])))
+
+    def actualizar_hoja(self, indice, valor):
+        """Cambia una hoja y recalcula solo sus ancestros"""
+        self.niveles[0][indice] = valor
+        for nivel in range(1, self.altura):
+            indice //= self.fanout
+            inferior = self.niveles[nivel - 1]
+            inicio = indice * self.fanout
+            self.niveles[nivel][indice] = self._combinar(inferior[inicio:inicio + self.fanout])
+
+
+class IndiceMerkle:
+    def __init__(self, tam_bucket=TAM_BUCKET, fanout=FANOUT, max_pendientes=100000):
+        """
+        Arbol Merkle de una BD que se mantiene al dia de forma incremental
+
+        El proceso dueno de la BD informa los codigos que modifico con invalidar()
+        y actualizar() recalcula solo esos buckets. Si se acumulan demasiados
+        codigos, o aun no hay arbol, se reconstruye completo.
+
+        Args:
+            tam_bucket: libros por bucket al calcular los limites
+            fanout: hijos por nodo del arbol
+            max_pendientes: codigos invalidados a partir de los cuales conviene reconstruir
+        """
+        self.tam_bucket = tam_bucket
+        self.fanout = fanout
+        self.max_pendientes = max_pendientes
+
+        self.limites = None
+        self.digest = None
+        self.arbol = None
+        self.version = 0
+
+        self._pendientes = set()
+        self._reconstruir = True
+        self._lock = threading.Lock()
+        self._lock_arbol = threading.Lock()
+
+    def invalidar(self, codigos):
+        """Marca como modificados los buckets de estos codigos"""
+        with self._lock:
+            if self._reconstruir:
+                return
+            self._pendientes.update(codigos)
+            if len(self._pendientes) > self.max_pendientes:
+                self._pendientes = set()
+                self._reconstruir = True
+
+    def reiniciar(self):
+        """La BD cambio por completo (por ejemplo al cargar un snapshot)"""
+        with self._lock:
+            self._pendientes = set()
+            self._reconstruir = True
+
+    def actualizar(self, conn, limites=None):
+        """
+        Pone el arbol al dia con la BD
+
+        Args:
+            conn: conexion a la BD (conviene dentro de una transaccion de lectura)
+            limites: limites impuestos por la primaria (None = calcularlos)
+
+        Returns:
+            cantidad de buckets recalculados
+        """
+        with self._lock_arbol:
+            with self._lock:
+                completo = self._reconstruir or (limites is not None and limites != self.limites)
+                pendientes, self._pendientes = self._pendientes, set()
+                self._reconstruir = False
+
+            if completo:
+                self.limites = limites or calcular_limites(conn, self.tam_bucket)
+                self.digest = digest_limites(self.limites)
+                self.arbol = ArbolMerkle(hash_buckets(conn, self.limites), self.fanout)
+                recalculados = len(self.limites)
+            else:
+                buckets = {self.bucket(codigo) for codigo in pendientes}
+                for indice in buckets:
+                    self.arbol.actualizar_hoja(indice, hash_bucket(conn, self.limites, indice))
+                recalculados = len(buckets)
+
+            self.version += 1
+            return recalculados
+
+    def bucket(self, codigo):
+        return bisect.bisect_right(self.limites, codigo) - 1
+
+    def resumen(self):
+        return {
+            "version": self.version,
+            "raiz": self.arbol.raiz,
+            "altura": self.arbol.altura,
+            "fanout": self.fanout,
+            "buckets": len(self.limites),
+            "digest_limites": self.digest
+        }
+
+    def nodos(self, version, nivel, indices):
+        """Hashes de nodos del arbol de una version; None si el arbol ya cambio"""
+        with self._lock_arbol:
+            if version != self.version or not 0 <= nivel < self.arbol.altura:
+                return None
+            nodos = self.arbol.niveles[nivel]
+            if any(not 0 <= i < len(nodos) for i in indices):
+                return None
+            return [nodos[i] for i in indices]
@@ -0,0 +1,96 @@
+"""
+Microbenchmark del codec: costo de codificar/decodificar y bytes en el cable
+por tipo de mensaje, formato original (JSON o texto) contra binario
+"""
+import argparse
+import json
+import timeit
+
+import codec
+
+# Mensajes representativos de cada salto del sistema
+MENSAJES = {
+    "PS->GC solicitud": {"tipo": "prestamo", "usuario": "user12", "libro": "ISBN0617"},
+    "GC->PS respuesta": {"exito": True, "mensaje": "Prestamo otorgado de 'Libro 617'", "fecha_devolucion": "2025-06-01"},
+    "GC->Actor prestamo": {"operacion": "prestamo", "codigo": "ISBN0617", "usuario": "user12"},
+    "GC PUB devolucion": {"usuario": "user12", "libro": "ISBN0617"},
+    "Actor->GA solicitud": {"operacion": "prestamo_condicional", "codigo": "ISBN0617", "usuario": "user12"},
+    "GA->Actor respuesta": {"exito": True, "mensaje": "Prestamo otorgado de 'Libro 617'", "fecha_devolucion": "2025-06-01"},
+    "GA verificar respuesta": {
+        "disponible": True,
+        "mensaje": "Hay 3 ejemplar(es) disponible(s)",
+        "libro": {"codigo": "ISBN0617", "titulo": "Libro 617", "autor": "Autor 17",
+                  "ejemplares_totales": 3, "ejemplares_disponibles": 3}
+    },
+    "GA->Replica prestamo": {"tipo": "prestamo", "codigo": "ISBN0617", "usuario": "user12",
+                             "fecha_prestamo": "2025-05-18", "fecha_devolucion": "2025-06-01"},
+    "GA->Replica renovacion": {"tipo": "renovacion", "codigo": "ISBN0617", "usuario": "user12",
+                               "nueva_fecha": "2025-06-08", "renovaciones": 1},
+}
+
+# Saltos que en el formato original no usan JSON sino texto plano
+TEXTO_ORIGINAL = {
+    "PS->GC solicitud": (
+        lambda m: f"{m['tipo']},{m['usuario']},{m['libro']}".encode("utf-8"),
+        lambda d: d.decode("utf-8").split(",")
+    ),
+    "GC PUB devolucion": (
+        lambda m: f"devolucion {m['usuario']},{m['libro']}".encode("utf-8"),
+        lambda d: d.split(b" ", 1)[1].decode("utf-8").split(",", 1)
+    ),
+}
+
+
+def medir(funcion, repeticiones):
+    """Microsegundos por llamada"""
+    return timeit.timeit(funcion, number=repeticiones) / repeticiones * 1e6
+
+
+def medir_original(nombre, mensaje, repeticiones):
+    if nombre in TEXTO_ORIGINAL:
+        codificar, decodificar = TEXTO_ORIGINAL[nombre]
+    else:
+        codificar = lambda m: json.dumps(m).encode("utf-8")
+        decodificar = json.loads
+    datos = codificar(mensaje)
+    return (len(datos),
+            medir(lambda: codificar(mensaje), repeticiones),
+            medir(lambda: decodificar(datos), repeticiones))
+
+
+# Las publicaciones llevan el topico delante del mensaje en ambos formatos
+TOPICO = {"GC PUB devolucion": b"devolucion "}
+
+
+def medir_binario(nombre, mensaje, repeticiones):
+    datos = codec.codificar(mensaje, codec.FORMATO_BINARIO)
+    assert codec.decodificar(datos) == (mensaje, codec.FORMATO_BINARIO)
+    return (len(datos) + len(TOPICO.get(nombre, b"")),
+            medir(lambda: codec.codificar(mensaje, codec.FORMATO_BINARIO), repeticiones),
+            medir(lambda: codec.decodificar(datos), repeticiones))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark del codec de mensajes")
+    parser.add_argument("--repeticiones", type=int, default=100000, help="iteraciones por medicion")
+    args = parser.parse_args()
+
+    print("=" * 96)
+    print(f" BENCHMARK DEL CODEC (version binaria {codec.VERSION}, {args.repeticiones} repeticiones)")
+    print("=" * 96)
+    print(f"{'mensaje':<24} | {'original: bytes  cod(us)  dec(us)':>34} | {'binario: bytes  cod(us)  dec(us)':>33}")
+    print("-" * 96)
+
+    total_original = 0
+    total_binario = 0
+    for nombre, mensaje in MENSAJES.items():
+        b_o, c_o, d_o = medir_original(nombre, mensaje, args.repeticiones)
+        b_b, c_b, d_b = medir_binario(nombre, mensaje, args.repeticiones)
+        total_original += b_o
+        total_binario += b_b
+        print(f"{nombre:<24} | {b_o:>15} {c_o:>8.2f} {d_o:>8.2f} | {b_b:>14} {c_b:>8.2f} {d_b:>8.2f}")
+
+    print("-" * 96)
+    print(f" Bytes totales: original {total_original}, binario {total_binario} "
+          f"({100 * total_binario / total_original:.0f}% del original)")
+    print("=" * 96)
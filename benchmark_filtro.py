@@ -0,0 +1,96 @@
+"""
+Mide la memoria y el tiempo de consulta de las estructuras con las que el GC
+puede saber si un codigo existe en el catalogo: un set de Python, una lista
+ordenada (busqueda binaria) y el filtro de Bloom de filtro_libros
+"""
+import argparse
+import bisect
+import gc
+import random
+import time
+import tracemalloc
+
+from filtro_libros import FiltroBloom
+
+
+def codigos(libros):
+    return (f"ISBN{i:07d}" for i in range(1, libros + 1))
+
+
+def construir(nombre, libros):
+    """
+    Returns:
+        (funcion codigo -> bool, bytes a enviar por la red, memoria en bytes, segundos de construccion)
+    """
+    gc.collect()
+    tracemalloc.start()
+    inicio = time.perf_counter()
+
+    if nombre == "set":
+        estructura = set(codigos(libros))
+        contiene = estructura.__contains__
+        transferencia = sum(len(c) + 1 for c in estructura)
+    elif nombre == "ordenada":
+        estructura = sorted(codigos(libros))
+
+        def contiene(codigo):
+            i = bisect.bisect_left(estructura, codigo)
+            return i < len(estructura) and estructura[i] == codigo
+        transferencia = sum(len(c) + 1 for c in estructura)
+    else:
+        estructura = FiltroBloom.para(libros, float(nombre.split(" ")[1].rstrip("%")) / 100)
+        for codigo in codigos(libros):
+            estructura.agregar(codigo)
+        contiene = estructura.__contains__
+        transferencia = len(estructura.datos)
+
+    segundos = time.perf_counter() - inicio
+    memoria = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return contiene, transferencia, memoria, segundos
+
+
+def medir(contiene, libros, busquedas):
+    """
+    Returns:
+        (microsegundos por consulta, tasa de falsos positivos medida con codigos inexistentes)
+    """
+    existentes = [f"ISBN{random.randint(1, libros):07d}" for _ in range(busquedas)]
+    inexistentes = [f"ISBN{libros + i:07d}X" for i in range(1, busquedas + 1)]
+
+    inicio = time.perf_counter()
+    for codigo in existentes:
+        assert contiene(codigo)
+    microsegundos = (time.perf_counter() - inicio) / busquedas * 1e6
+
+    falsos = sum(1 for codigo in inexistentes if contiene(codigo))
+    return microsegundos, falsos / busquedas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del filtro de existencia de libros del GC")
+    parser.add_argument("--tamanos", default="100000,1000000,5000000",
+                        help="cantidades de libros a medir, separadas por coma")
+    parser.add_argument("--busquedas", type=int, default=100000, help="consultas por estructura")
+    args = parser.parse_args()
+
+    tamanos = sorted(int(t) for t in args.tamanos.split(","))
+    estructuras = ["set", "ordenada", "bloom 1%", "bloom 0.1%"]
+
+    print("=" * 84)
+    print(" BENCHMARK DEL FILTRO DE LIBROS")
+    print("=" * 84)
+    print(f"{'libros':>10} | {'estructura':>10} | {'memoria MB':>10} | {'red MB':>8} | "
+          f"{'armado s':>8} | {'us/consulta':>11} | {'falsos %':>8}")
+    print("-" * 84)
+
+    for tamano in tamanos:
+        for nombre in estructuras:
+            contiene, transferencia, memoria, segundos = construir(nombre, tamano)
+            microsegundos, falsos = medir(contiene, tamano, args.busquedas)
+            print(f"{tamano:>10} | {nombre:>10} | {memoria / 1e6:>10.1f} | {transferencia / 1e6:>8.1f} | "
+                  f"{segundos:>8.2f} | {microsegundos:>11.2f} | {falsos * 100:>8.3f}")
+            del contiene
+        print("-" * 84)
+
+    print("=" * 84)
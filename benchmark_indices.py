@@ -0,0 +1,126 @@
+"""
+Mide el tiempo de busqueda de prestamos por (codigo, usuario) a medida que crece
+la tabla prestamos, con los indices de esquema_bd y sin ellos (NOT INDEXED)
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from esquema_bd import migrar
+
+CONSULTA = "SELECT renovaciones, fecha_devolucion FROM prestamos {indice} WHERE codigo = ? AND usuario = ?"
+
+
+def crear_bd(db_file, libros):
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute('''
+        CREATE TABLE libros (
+            codigo TEXT PRIMARY KEY,
+            titulo TEXT NOT NULL,
+            autor TEXT NOT NULL,
+            ejemplares_totales INTEGER NOT NULL,
+            ejemplares_disponibles INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE prestamos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codigo TEXT NOT NULL,
+            usuario TEXT NOT NULL,
+            fecha_prestamo TEXT NOT NULL,
+            fecha_devolucion TEXT NOT NULL,
+            renovaciones INTEGER DEFAULT 0,
+            FOREIGN KEY (codigo) REFERENCES libros(codigo)
+        )
+    ''')
+    conn.executemany(
+        "INSERT INTO libros VALUES (?, ?, ?, ?, ?)",
+        ((f"ISBN{i:07d}", f"Libro {i}", f"Autor {i % 100}", 5, 5) for i in range(1, libros + 1))
+    )
+    conn.commit()
+    migrar(conn)
+    return conn
+
+
+def agregar_prestamos(conn, desde, hasta, libros):
+    """Inserta los prestamos [desde, hasta) en bloques"""
+    bloque = 100000
+    for inicio in range(desde, hasta, bloque):
+        fin = min(inicio + bloque, hasta)
+        conn.executemany(
+            "INSERT INTO prestamos (codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones) "
+            "VALUES (?, ?, '2025-01-01', '2025-01-15', 0)",
+            ((f"ISBN{(i % libros) + 1:07d}", f"user{i}") for i in range(inicio, fin))
+        )
+        conn.commit()
+
+
+def medir(conn, total, libros, busquedas, indice=""):
+    """Tiempo promedio (ms) de busquedas de prestamos existentes"""
+    consulta = CONSULTA.format(indice=indice)
+    tiempos = []
+    for _ in range(busquedas):
+        i = random.randrange(total)
+        parametros = (f"ISBN{(i % libros) + 1:07d}", f"user{i}")
+        inicio = time.perf_counter()
+        fila = conn.execute(consulta, parametros).fetchone()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        assert fila is not None
+    return statistics.mean(tiempos), statistics.median(tiempos)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de busquedas en la tabla prestamos")
+    parser.add_argument("--tamanos", default="200,10000,100000,1000000,10000000",
+                        help="cantidades de prestamos a medir, separadas por coma")
+    parser.add_argument("--libros", type=int, default=100000, help="libros en el catalogo")
+    parser.add_argument("--busquedas", type=int, default=2000, help="busquedas por tamano con indice")
+    parser.add_argument("--busquedas-sin-indice", type=int, default=5,
+                        help="busquedas por tamano sin indice (0 para omitir)")
+    parser.add_argument("--db", default=None, help="archivo de trabajo (por defecto uno temporal)")
+    args = parser.parse_args()
+
+    tamanos = sorted(int(t) for t in args.tamanos.split(","))
+    db_file = args.db or os.path.join(tempfile.mkdtemp(), "benchmark_indices.db")
+
+    print("=" * 70)
+    print(" BENCHMARK DE INDICES EN PRESTAMOS")
+    print("=" * 70)
+    print(f" BD de trabajo: {db_file}")
+    print(f" Libros: {args.libros}\n")
+    print(f"{'prestamos':>12} | {'con indice (ms)':>22} | {'sin indice (ms)':>22}")
+    print(f"{'':>12} | {'promedio':>10} {'mediana':>11} | {'promedio':>10} {'mediana':>11}")
+    print("-" * 70)
+
+    conn = crear_bd(db_file, args.libros)
+    total = 0
+    try:
+        for tamano in tamanos:
+            agregar_prestamos(conn, total, tamano, args.libros)
+            total = tamano
+
+            prom, med = medir(conn, total, args.libros, args.busquedas)
+            linea = f"{total:>12} | {prom:>10.4f} {med:>11.4f} |"
+
+            if args.busquedas_sin_indice:
+                prom_si, med_si = medir(conn, total, args.libros, args.busquedas_sin_indice, "NOT INDEXED")
+                linea += f" {prom_si:>10.4f} {med_si:>11.4f}"
+            else:
+                linea += f" {'-':>10} {'-':>11}"
+
+            print(linea)
+    finally:
+        conn.close()
+        if not args.db:
+            for sufijo in ("", "-wal", "-shm"):
+                if os.path.exists(db_file + sufijo):
+                    os.remove(db_file + sufijo)
+            os.rmdir(os.path.dirname(db_file))
+
+    print("=" * 70)
@@ -0,0 +1,148 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+class CacheDisponibilidad:
+    def __init__(self, capacidad=200000):
+        """
+        Cache LRU en memoria de la tabla libros (titulo y disponibilidad)
+
+        Se llena al iniciar el GA y se mantiene al dia con los cambios que el
+        propio GA confirma (write-through). Si el catalogo completo cabe en la
+        capacidad, un fallo significa que el libro no existe y no se consulta disco.
+
+        Cada libro guarda la version (secuencia del log de replicacion) de su
+        estado: una escritura confirmada no pisa un estado mas nuevo, y una
+        lectura de disco solo se agrega si ninguna escritura confirmo despues de
+        hacerla. Asi escrituras y lecturas no necesitan un lock comun.
+
+        Args:
+            capacidad: cantidad maxima de libros en memoria
+        """
+        self.capacidad = capacidad
+        self.completa = False
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.version = 0
+
+        # codigo -> (titulo, autor, ejemplares_totales, ejemplares_disponibles, version)
+        self._libros = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entrada(libro, version):
+        return (libro["titulo"], libro["autor"], libro["ejemplares_totales"], libro["ejemplares_disponibles"],
+                version)
+
+    @staticmethod
+    def _libro(codigo, entrada):
+        titulo, autor, totales, disponibles, _ = entrada
+        return {
+            "codigo": codigo,
+            "titulo": titulo,
+            "autor": autor,
+            "ejemplares_totales": totales,
+            "ejemplares_disponibles": disponibles
+        }
+
+    def cargar(self, conn, version=0):
+        """Precarga hasta 'capacidad' libros desde la BD (version: secuencia del log al leerlos)"""
+        cursor = conn.execute(
+            "SELECT codigo, titulo, autor, ejemplares_totales, ejemplares_disponibles FROM libros LIMIT ?",
+            (self.capacidad + 1,)
+        )
+
+        libros = OrderedDict()
+        for fila in cursor:
+            if len(libros) == self.capacidad:
+                break
+            libros[fila[0]] = (*fila[1:], version)
+        else:
+            # Se recorrio toda la tabla sin llenar la capacidad
+            self.completa = True
+
+        with self._lock:
+            self._libros = libros
+            self.version = max(self.version, version)
+
+        return len(libros)
+
+    def obtener(self, codigo):
+        """
+        Busca un libro en memoria
+
+        Returns:
+            (encontrado, libro): libro es None si no esta en cache. Con la cache
+            completa un fallo se reporta como encontrado=True y libro=None (no existe).
+        """
+        with self._lock:
+            entrada = self._libros.get(codigo)
+            if entrada is not None:
+                self._libros.move_to_end(codigo)
+                self.aciertos += 1
+                return True, self._libro(codigo, entrada)
+
+            if self.completa:
+                self.aciertos += 1
+                return True, None
+
+            self.fallos += 1
+            return False, None
+
+    def _insertar(self, codigo, entrada):
+        self._libros[codigo] = entrada
+        self._libros.move_to_end(codigo)
+        if len(self._libros) > self.capacidad:
+            self._libros.popitem(last=False)
+            self.expulsiones += 1
+            self.completa = False
+
+    def agregar_si_ausente(self, libro, version):
+        """
+        Agrega un libro leido de disco; no pisa un valor ya actualizado por una escritura
+
+        Args:
+            libro: fila leida de la tabla libros
+            version: secuencia del log en la transaccion de lectura; si despues se
+                     confirmo alguna escritura la lectura puede estar vieja y no se guarda
+        """
+        with self._lock:
+            if libro["codigo"] not in self._libros and version >= self.version:
+                self._insertar(libro["codigo"], self._entrada(libro, version))
+
+    def actualizar(self, libro, version):
+        """
+        Write-through: registra el estado confirmado de un libro
+
+        Args:
+            libro: estado del libro leido dentro de la transaccion que lo modifico
+            version: secuencia del cambio en el log; no pisa un estado mas nuevo
+        """
+        with self._lock:
+            entrada = self._libros.get(libro["codigo"])
+            if entrada is None or entrada[-1] <= version:
+                self._insertar(libro["codigo"], self._entrada(libro, version))
+            self.version = max(self.version, version)
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            muestra = next(iter(self._libros.items()), None)
+            por_entrada = 0
+            if muestra:
+                codigo, entrada = muestra
+                # Tamano aproximado: clave, tupla y sus cadenas, mas el nodo del OrderedDict
+                por_entrada = (sys.getsizeof(codigo) + sys.getsizeof(entrada) +
+                               sum(sys.getsizeof(valor) for valor in entrada) + 100)
+            return {
+                "libros": len(self._libros),
+                "capacidad": self.capacidad,
+                "completa": self.completa,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "expulsiones": self.expulsiones,
+                "tasa_aciertos": (self.aciertos / total) if total else 0,
+                "memoria_estimada_bytes": por_entrada * len(self._libros)
+            }
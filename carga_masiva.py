@@ -0,0 +1,332 @@
+"""
+Carga masiva de libros y prestamos en una BD de sede
+
+Genera un catalogo sintetico del tamano pedido o importa archivos CSV/JSONL.
+Las filas se leen en streaming y se insertan por bloques con executemany dentro
+de transacciones grandes; los indices secundarios se eliminan antes de la carga
+y se vuelven a crear al final. La disponibilidad de los libros se recalcula con
+un unico UPDATE a partir de los prestamos.
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+from esquema_bd import migrar
+
+TAMANO_BLOQUE = 10000
+FILAS_POR_TRANSACCION = 500000
+
+INSERTAR_LIBROS = ("INSERT INTO libros (codigo, titulo, autor, ejemplares_totales, ejemplares_disponibles) "
+                   "VALUES (?, ?, ?, ?, ?)")
+REEMPLAZAR_LIBROS = INSERTAR_LIBROS.replace("INSERT", "INSERT OR REPLACE", 1)
+INSERTAR_PRESTAMOS = ("INSERT INTO prestamos (codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones) "
+                      "VALUES (?, ?, ?, ?, ?)")
+
+
+def ejemplares_libro(numero):
+    """Ejemplares del libro sintetico numero (1, o entre 1 y 5)"""
+    return 1 if numero % 10 == 0 else (numero % 5 + 1)
+
+
+def generar_libros(cantidad):
+    """Catalogo sintetico ISBN0001.. con todos los ejemplares disponibles"""
+    for i in range(1, cantidad + 1):
+        ejemplares = ejemplares_libro(i)
+        yield (f"ISBN{i:04d}", f"Libro {i}", f"Autor {i % 100}", ejemplares, ejemplares)
+
+
+def generar_prestamos(cantidad, libros):
+    """
+    Prestamos sinteticos sobre el catalogo de generar_libros
+
+    Recorre el catalogo en rondas: la ronda r presta un ejemplar de cada libro
+    que tiene mas de r ejemplares, asi ningun libro queda con disponibilidad
+    negativa. Los primeros prestamos son ISBN0001/user1, ISBN0002/user2, ...
+    """
+    capacidad = sum(ejemplares_libro(i) for i in range(1, libros + 1))
+    if cantidad > capacidad:
+        raise ValueError(f"{cantidad} prestamos superan los {capacidad} ejemplares de {libros} libros")
+
+    fecha_prestamo = datetime.now().strftime("%Y-%m-%d")
+    fecha_devolucion = (datetime.now() + timedelta(weeks=2)).strftime("%Y-%m-%d")
+
+    generados = 0
+    ronda = 0
+    while generados < cantidad:
+        for i in range(1, libros + 1):
+            if ejemplares_libro(i) > ronda:
+                generados += 1
+                yield (f"ISBN{i:04d}", f"user{generados}", fecha_prestamo, fecha_devolucion, 0)
+                if generados == cantidad:
+                    return
+        ronda += 1
+
+
+def _registros(archivo):
+    """Registros (dict) de un archivo .jsonl (un objeto por linea) o .csv (con encabezado)"""
+    with open(archivo, encoding="utf-8", newline="") as f:
+        if archivo.endswith(".jsonl"):
+            for linea in f:
+                if linea.strip():
+                    yield json.loads(linea)
+        else:
+            yield from csv.DictReader(f)
+
+
+def leer_libros(archivo):
+    """
+    Libros de un archivo: codigo, titulo, autor, ejemplares_totales y opcionalmente
+    ejemplares_disponibles (por defecto todos)
+    """
+    for numero, registro in enumerate(_registros(archivo), 1):
+        try:
+            totales = int(registro["ejemplares_totales"])
+            disponibles = registro.get("ejemplares_disponibles")
+            yield (
+                registro["codigo"],
+                registro["titulo"],
+                registro["autor"],
+                totales,
+                totales if disponibles in (None, "") else int(disponibles)
+            )
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"{archivo}, registro {numero}: libro invalido ({e!r})") from None
+
+
+def leer_prestamos(archivo):
+    """
+    Prestamos activos de un archivo: codigo, usuario, fecha_prestamo, fecha_devolucion
+    y opcionalmente renovaciones (por defecto 0)
+    """
+    for numero, registro in enumerate(_registros(archivo), 1):
+        try:
+            renovaciones = registro.get("renovaciones")
+            yield (
+                registro["codigo"],
+                registro["usuario"],
+                registro["fecha_prestamo"],
+                registro["fecha_devolucion"],
+                0 if renovaciones in (None, "") else int(renovaciones)
+            )
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"{archivo}, registro {numero}: prestamo invalido ({e!r})") from None
+
+
+def suspender_indices(conn):
+    """
+    Elimina los indices secundarios de libros y prestamos
+
+    Returns:
+        sentencias CREATE INDEX para restaurarlos con restaurar_indices()
+    """
+    indices = conn.execute(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name IN ('libros', 'prestamos') AND sql IS NOT NULL"
+    ).fetchall()
+    for nombre, _ in indices:
+        conn.execute(f"DROP INDEX {nombre}")
+    conn.commit()
+    return [sql for _, sql in indices]
+
+
+def restaurar_indices(conn, sentencias):
+    for sql in sentencias:
+        conn.execute(sql)
+    conn.commit()
+
+
+def actualizar_disponibilidad(conn):
+    """
+    Descuenta los prestamos activos de los ejemplares de cada libro con una
+    sola pasada agregada sobre prestamos (en lugar de un UPDATE por prestamo)
+
+    Returns:
+        libros actualizados
+    """
+    conn.execute("DROP TABLE IF EXISTS temp.prestados")
+    conn.execute("CREATE TEMP TABLE prestados (codigo TEXT PRIMARY KEY, cantidad INTEGER NOT NULL)")
+    conn.execute("INSERT INTO temp.prestados SELECT codigo, COUNT(*) FROM prestamos GROUP BY codigo")
+    cursor = conn.execute(
+        "UPDATE libros SET ejemplares_disponibles = ejemplares_totales - "
+        "(SELECT cantidad FROM temp.prestados p WHERE p.codigo = libros.codigo) "
+        "WHERE codigo IN (SELECT codigo FROM temp.prestados)"
+    )
+    actualizados = cursor.rowcount
+    conn.execute("DROP TABLE temp.prestados")
+    return actualizados
+
+
+def insertar_por_bloques(conn, sentencia, filas, tamano_bloque=TAMANO_BLOQUE,
+                         filas_por_transaccion=FILAS_POR_TRANSACCION, progreso=None):
+    """
+    Inserta filas (cualquier iterable, se consume en streaming) con executemany
+    por bloques, confirmando cada filas_por_transaccion filas
+
+    Returns:
+        filas insertadas
+    """
+    filas = iter(filas)
+    total = 0
+    en_transaccion = 0
+
+    while True:
+        bloque = list(islice(filas, tamano_bloque))
+        if not bloque:
+            break
+        conn.executemany(sentencia, bloque)
+        total += len(bloque)
+        en_transaccion += len(bloque)
+
+        if en_transaccion >= filas_por_transaccion:
+            conn.commit()
+            en_transaccion = 0
+            if progreso:
+                progreso(total)
+
+    conn.commit()
+    return total
+
+
+def cargar(conn, libros=(), prestamos=(), tamano_bloque=TAMANO_BLOQUE,
+           filas_por_transaccion=FILAS_POR_TRANSACCION, reemplazar=False, diferir_indices=True,
+           progreso=None):
+    """
+    Carga libros y prestamos en una BD con las tablas ya creadas
+
+    Si la carga falla a mitad de camino quedan confirmadas las transacciones
+    anteriores; los indices se restauran igual.
+
+    Args:
+        conn: conexion a la BD (el GA y las replicas que la usan deben estar detenidos)
+        libros: iterable de tuplas (codigo, titulo, autor, totales, disponibles)
+        prestamos: iterable de tuplas (codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones)
+        tamano_bloque: filas por llamada a executemany
+        filas_por_transaccion: filas entre COMMITs
+        reemplazar: reemplazar los libros con codigo existente en lugar de fallar
+        diferir_indices: eliminar los indices secundarios durante la carga
+        progreso: funcion(tabla, filas) llamada al confirmar cada transaccion
+
+    Returns:
+        (libros cargados, prestamos cargados)
+    """
+    indices = suspender_indices(conn) if diferir_indices else []
+
+    def avance(tabla):
+        return (lambda filas: progreso(tabla, filas)) if progreso else None
+
+    try:
+        cantidad_libros = insertar_por_bloques(
+            conn, REEMPLAZAR_LIBROS if reemplazar else INSERTAR_LIBROS, libros,
+            tamano_bloque, filas_por_transaccion, avance("libros")
+        )
+        cantidad_prestamos = insertar_por_bloques(
+            conn, INSERTAR_PRESTAMOS, prestamos,
+            tamano_bloque, filas_por_transaccion, avance("prestamos")
+        )
+    finally:
+        conn.rollback()
+        restaurar_indices(conn, indices)
+
+    if cantidad_prestamos or reemplazar:
+        actualizar_disponibilidad(conn)
+        conn.commit()
+
+    return cantidad_libros, cantidad_prestamos
+
+
+def crear_tablas(conn):
+    """Tablas base (mismo esquema que GestorAlmacenamiento.inicializar_bd)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS libros (
+            codigo TEXT PRIMARY KEY,
+            titulo TEXT NOT NULL,
+            autor TEXT NOT NULL,
+            ejemplares_totales INTEGER NOT NULL,
+            ejemplares_disponibles INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS prestamos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codigo TEXT NOT NULL,
+            usuario TEXT NOT NULL,
+            fecha_prestamo TEXT NOT NULL,
+            fecha_devolucion TEXT NOT NULL,
+            renovaciones INTEGER DEFAULT 0,
+            FOREIGN KEY (codigo) REFERENCES libros(codigo)
+        )
+    ''')
+    conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Carga masiva de libros y prestamos en la BD de una sede (con el GA detenido)",
+        epilog="Ejemplos: python carga_masiva.py 1 --libros 1000000 --prestamos 200000\n"
+               "          python carga_masiva.py 2 --archivo-libros libros.csv --archivo-prestamos prestamos.jsonl",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("sede", type=int, help="numero de sede (1 o 2)")
+    parser.add_argument("--db", default=None, help="archivo de BD (por defecto bd_sede<sede>.db)")
+    parser.add_argument("--libros", type=int, default=0, help="libros sinteticos a generar")
+    parser.add_argument("--prestamos", type=int, default=0,
+                        help="prestamos sinteticos a generar sobre el catalogo sintetico")
+    parser.add_argument("--archivo-libros", default=None, help="importar libros de un .csv o .jsonl")
+    parser.add_argument("--archivo-prestamos", default=None, help="importar prestamos de un .csv o .jsonl")
+    parser.add_argument("--reemplazar", action="store_true", help="reemplazar libros con codigo existente")
+    parser.add_argument("--bloque", type=int, default=TAMANO_BLOQUE, help="filas por executemany")
+    parser.add_argument("--filas-transaccion", type=int, default=FILAS_POR_TRANSACCION,
+                        help="filas por transaccion")
+    parser.add_argument("--sin-diferir-indices", action="store_true",
+                        help="mantener los indices durante la carga")
+    args = parser.parse_args()
+
+    if args.libros and args.archivo_libros or args.prestamos and args.archivo_prestamos:
+        parser.error("usar datos sinteticos o archivo, no ambos, para cada tabla")
+    if args.prestamos and not args.libros:
+        parser.error("--prestamos sinteticos requiere --libros")
+    if not (args.libros or args.archivo_libros or args.archivo_prestamos):
+        parser.error("indicar --libros o algun archivo a importar")
+
+    db_file = args.db or f"bd_sede{args.sede}.db"
+    libros = leer_libros(args.archivo_libros) if args.archivo_libros else generar_libros(args.libros)
+    if args.archivo_prestamos:
+        prestamos = leer_prestamos(args.archivo_prestamos)
+    else:
+        prestamos = generar_prestamos(args.prestamos, args.libros)
+
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA journal_mode=WAL")
+    crear_tablas(conn)
+
+    print(f" Cargando en {db_file} (bloques de {args.bloque}, {args.filas_transaccion} filas por transaccion)")
+    inicio = time.perf_counter()
+
+    try:
+        cantidad_libros, cantidad_prestamos = cargar(
+            conn, libros, prestamos,
+            tamano_bloque=args.bloque,
+            filas_por_transaccion=args.filas_transaccion,
+            reemplazar=args.reemplazar,
+            diferir_indices=not args.sin_diferir_indices,
+            progreso=lambda tabla, filas: print(f"   {tabla}: {filas} filas")
+        )
+    except (ValueError, sqlite3.Error) as e:
+        print(f" Error en la carga: {e}")
+        sys.exit(1)
+
+    # Indices de esquema_bd si la BD es nueva
+    for version, descripcion in migrar(conn):
+        print(f" Migracion de esquema {version} aplicada: {descripcion}")
+    conn.close()
+
+    duracion = time.perf_counter() - inicio
+    filas = cantidad_libros + cantidad_prestamos
+    print(f" Carga completa: {cantidad_libros} libros, {cantidad_prestamos} prestamos "
+          f"en {duracion:.1f} s ({filas / duracion if duracion else 0:.0f} filas/s)")
+    print(" Las replicas deben reinicializarse: python receptor_replica.py <sede> --snapshot")
@@ -0,0 +1,234 @@
+"""
+Codec compartido para los mensajes entre procesos
+
+Formatos:
+    json:    texto JSON (formato original, lo entienden todos los procesos)
+    binario: codificacion TLV compacta y versionada
+
+Un mensaje binario empieza con el byte MAGIA seguido de la version. Ningun
+mensaje JSON ni de texto del protocolo empieza con ese byte, asi que el receptor
+detecta el formato sin configuracion. Quien responde usa el mismo formato de la
+solicitud, de modo que los procesos viejos (solo JSON) siguen funcionando.
+"""
+import json
+import struct
+
+FORMATO_JSON = "json"
+FORMATO_BINARIO = "binario"
+FORMATOS = (FORMATO_JSON, FORMATO_BINARIO)
+
+# Operacion con la que un actor se registra (y late) en los pools del GC
+REGISTRO_ACTOR = "registrar_actor"
+
+MAGIA = 0xB1
+VERSION = 1
+
+# Cadenas frecuentes que se codifican como un indice de un byte.
+# Solo se pueden agregar al final: el indice forma parte del formato de la VERSION.
+CADENAS = [
+    "operacion", "codigo", "usuario", "exito", "mensaje", "tipo", "libro",
+    "fecha_prestamo", "fecha_devolucion", "nueva_fecha", "renovaciones",
+    "disponible", "status", "sede", "ok", "prestamo", "prestamo_condicional",
+    "devolucion", "renovacion", "verificar_disponibilidad", "health_check",
+    "lote", "modo", "operaciones", "resultados", "titulo", "autor",
+    "ejemplares_totales", "ejemplares_disponibles", "transaccional",
+    "independiente", "cache", "formato", "version", "negociar_formato",
+    "formatos", "binario", "json", "estadisticas_cache",
+]
+_INDICE = {cadena: i for i, cadena in enumerate(CADENAS)}
+
+# Etiquetas TLV
+_NULO, _VERDADERO, _FALSO, _ENTERO, _REAL, _TEXTO, _REFERENCIA, _LISTA, _DICCIONARIO = range(9)
+
+_DOBLE = struct.Struct("<d")
+_CABECERA = bytes((MAGIA, VERSION))
+
+
+class ErrorCodec(ValueError):
+    pass
+
+
+def _varint(salida, n):
+    while n > 0x7F:
+        salida.append((n & 0x7F) | 0x80)
+        n >>= 7
+    salida.append(n)
+
+
+def _codificar_valor(salida, valor):
+    tipo = type(valor)
+
+    if tipo is str:
+        indice = _INDICE.get(valor)
+        if indice is not None:
+            salida.append(_REFERENCIA)
+            salida.append(indice)
+        else:
+            datos = valor.encode("utf-8")
+            salida.append(_TEXTO)
+            _varint(salida, len(datos))
+            salida += datos
+    elif tipo is dict:
+        salida.append(_DICCIONARIO)
+        _varint(salida, len(valor))
+        for clave, item in valor.items():
+            _codificar_valor(salida, clave)
+            _codificar_valor(salida, item)
+    elif valor is None:
+        salida.append(_NULO)
+    elif valor is True:
+        salida.append(_VERDADERO)
+    elif valor is False:
+        salida.append(_FALSO)
+    elif tipo is int:
+        salida.append(_ENTERO)
+        # zigzag: enteros negativos pequenos tambien ocupan pocos bytes
+        _varint(salida, (valor << 1) if valor >= 0 else ((-valor << 1) - 1))
+    elif tipo is float:
+        salida.append(_REAL)
+        salida += _DOBLE.pack(valor)
+    elif tipo in (list, tuple):
+        salida.append(_LISTA)
+        _varint(salida, len(valor))
+        for item in valor:
+            _codificar_valor(salida, item)
+    else:
+        raise ErrorCodec(f"Tipo no soportado por el codec binario: {tipo.__name__}")
+
+
+def _leer_varint(datos, pos):
+    n = 0
+    desplazamiento = 0
+    while True:
+        byte = datos[pos]
+        pos += 1
+        n |= (byte & 0x7F) << desplazamiento
+        if byte < 0x80:
+            return n, pos
+        desplazamiento += 7
+
+
+def _decodificar_valor(datos, pos):
+    etiqueta = datos[pos]
+    pos += 1
+
+    if etiqueta == _REFERENCIA:
+        return CADENAS[datos[pos]], pos + 1
+    if etiqueta == _TEXTO:
+        largo = datos[pos]
+        if largo < 0x80:
+            pos += 1
+        else:
+            largo, pos = _leer_varint(datos, pos)
+        if pos + largo > len(datos):
+            # El corte no falla solo: devolveria un texto incompleto
+            raise ErrorCodec(f"Texto de {largo} bytes truncado en mensaje binario")
+        return str(datos[pos:pos + largo], "utf-8"), pos + largo
+    if etiqueta == _DICCIONARIO:
+        cantidad, pos = _leer_varint(datos, pos)
+        resultado = {}
+        for _ in range(cantidad):
+            # Camino rapido: clave del diccionario de cadenas
+            if datos[pos] == _REFERENCIA:
+                clave = CADENAS[datos[pos + 1]]
+                pos += 2
+            else:
+                clave, pos = _decodificar_valor(datos, pos)
+            resultado[clave], pos = _decodificar_valor(datos, pos)
+        return resultado, pos
+    if etiqueta == _NULO:
+        return None, pos
+    if etiqueta == _VERDADERO:
+        return True, pos
+    if etiqueta == _FALSO:
+        return False, pos
+    if etiqueta == _ENTERO:
+        n, pos = _leer_varint(datos, pos)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+    if etiqueta == _REAL:
+        return _DOBLE.unpack_from(datos, pos)[0], pos + 8
+    if etiqueta == _LISTA:
+        cantidad, pos = _leer_varint(datos, pos)
+        resultado = []
+        for _ in range(cantidad):
+            item, pos = _decodificar_valor(datos, pos)
+            resultado.append(item)
+        return resultado, pos
+
+    raise ErrorCodec(f"Etiqueta desconocida en mensaje binario: {etiqueta}")
+
+
+def es_binario(datos):
+    """Indica si un mensaje recibido usa el formato binario"""
+    return len(datos) > 1 and datos[0] == MAGIA
+
+
+def codificar(mensaje, formato=FORMATO_JSON):
+    """Codifica un mensaje (dict/list) a bytes en el formato indicado"""
+    if formato == FORMATO_BINARIO:
+        salida = bytearray(_CABECERA)
+        _codificar_valor(salida, mensaje)
+        return bytes(salida)
+    return json.dumps(mensaje).encode("utf-8")
+
+
+def decodificar(datos):
+    """
+    Decodifica un mensaje detectando su formato
+
+    Returns:
+        (mensaje, formato)
+
+    Raises:
+        ErrorCodec: mensaje binario truncado o corrupto (ValueError si no es JSON valido)
+    """
+    if es_binario(datos):
+        if datos[1] > VERSION:
+            raise ErrorCodec(f"Version de codec no soportada: {datos[1]} (maxima {VERSION})")
+        try:
+            mensaje, pos = _decodificar_valor(datos, 2)
+        except (IndexError, struct.error, UnicodeDecodeError, RecursionError) as e:
+            # Cada lectura fuera del mensaje (etiqueta, varint, referencia, real) termina aca
+            raise ErrorCodec(f"Mensaje binario truncado o corrupto: {e}") from e
+        if pos != len(datos):
+            raise ErrorCodec(f"Mensaje binario con {len(datos) - pos} bytes sobrantes")
+        return mensaje, FORMATO_BINARIO
+    return json.loads(datos), FORMATO_JSON
+
+
+def solicitud_negociacion(formato):
+    """Mensaje JSON con el que un cliente ofrece un formato al servidor"""
+    return {"operacion": "negociar_formato", "formatos": [formato, FORMATO_JSON], "version": VERSION}
+
+
+def respuesta_negociacion(solicitud):
+    """Respuesta del servidor: el primer formato ofrecido que conoce"""
+    for formato in solicitud.get("formatos", []):
+        if formato in FORMATOS:
+            return {"status": "ok", "formato": formato, "version": VERSION}
+    return {"status": "ok", "formato": FORMATO_JSON, "version": VERSION}
+
+
+def negociar(socket, formato):
+    """
+    Negocia el formato con el servidor al otro lado de un socket REQ
+
+    Los servidores viejos no conocen la operacion y responden con un error
+    (o con un mensaje que no es de negociacion): en ese caso se usa JSON.
+
+    Args:
+        socket: socket REQ ya conectado
+        formato: formato preferido por el cliente
+    """
+    if formato == FORMATO_JSON:
+        return FORMATO_JSON
+
+    socket.send(codificar(solicitud_negociacion(formato)))
+    try:
+        respuesta, _ = decodificar(socket.recv())
+    except ValueError:
+        return FORMATO_JSON
+
+    if isinstance(respuesta, dict) and respuesta.get("formato") in FORMATOS:
+        return respuesta["formato"]
+    return FORMATO_JSON
@@ -0,0 +1,161 @@
+"""
+Cola de trabajo confiable del Gestor de Carga (devoluciones y renovaciones)
+
+Cada trabajo se guarda en un archivo SQLite local antes de responder al PS, se
+entrega a un solo actor del canal (consumidores que compiten) y se borra cuando
+ese actor confirma que lo proceso. Si la confirmacion no llega a tiempo el
+trabajo vuelve a la cola y se entrega de nuevo, posiblemente a otro actor; al
+reiniciar el GC se vuelven a entregar los que quedaron en el archivo.
+
+La entrega es "al menos una vez": cada trabajo lleva un id_operacion y el GA
+descarta las operaciones que ya aplico, asi que cada devolucion o renovacion
+se aplica una sola vez aunque se entregue dos.
+"""
+import json
+import sqlite3
+import time
+import uuid
+from collections import deque
+
+
+def coincide(canal_actor, canal):
+    """Un actor de "devolucion" atiende "devolucion" y todas sus particiones ("devolucion.p1", ...)"""
+    return canal == canal_actor or canal.startswith(canal_actor + ".")
+
+
+class ColaTrabajos:
+    def __init__(self, archivo, timeout_s=10.0, synchronous="NORMAL"):
+        """
+        Args:
+            archivo: archivo SQLite de la cola
+            timeout_s: espera maxima por la confirmacion de un trabajo entregado
+            synchronous: PRAGMA synchronous (NORMAL sobrevive a la caida del proceso;
+                         FULL tambien a la del sistema operativo)
+        """
+        self.archivo = archivo
+        self.timeout = timeout_s
+        self.conn = sqlite3.connect(archivo)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS trabajos ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "canal TEXT NOT NULL, "
+            "mensaje TEXT NOT NULL, "
+            "intentos INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.conn.commit()
+
+        self.trabajos = {}          # id -> [canal, mensaje, intentos]
+        self.pendientes = {}        # canal -> deque de ids sin entregar, del mas viejo al mas nuevo
+        self.en_vuelo = {}          # id -> (limite, identidad del actor, time.perf_counter() de la entrega)
+        self._orden_vuelo = deque()  # (limite, id) en orden de entrega
+        self.reentregas = 0
+
+        # Lo que quedo de una ejecucion anterior se vuelve a entregar
+        for id_trabajo, canal, mensaje, intentos in self.conn.execute(
+                "SELECT id, canal, mensaje, intentos FROM trabajos ORDER BY id"):
+            self.trabajos[id_trabajo] = [canal, json.loads(mensaje), intentos]
+            self.pendientes.setdefault(canal, deque()).append(id_trabajo)
+
+    def encolar(self, canal, mensaje):
+        """
+        Guarda un trabajo (ya confirmado en disco al volver)
+
+        Returns:
+            el mensaje, con su id_operacion (uno nuevo si no lo trae)
+        """
+        mensaje.setdefault("id_operacion", uuid.uuid4().hex)
+        cursor = self.conn.execute("INSERT INTO trabajos (canal, mensaje) VALUES (?, ?)",
+                                   (canal, json.dumps(mensaje)))
+        self.conn.commit()
+        self.trabajos[cursor.lastrowid] = [canal, mensaje, 0]
+        self.pendientes.setdefault(canal, deque()).append(cursor.lastrowid)
+        return mensaje
+
+    def tomar(self, canal_actor, identidad):
+        """
+        Saca el trabajo mas viejo que puede atender un actor y lo marca en vuelo
+
+        Returns:
+            (id, mensaje), o None si no hay trabajos para su canal
+        """
+        elegido = None
+        for canal, ids in self.pendientes.items():
+            if ids and coincide(canal_actor, canal) and (elegido is None or ids[0] < elegido[0]):
+                elegido = ids[0], ids
+        if elegido is None:
+            return None
+
+        id_trabajo, ids = elegido
+        ids.popleft()
+        limite = time.monotonic() + self.timeout
+        self.en_vuelo[id_trabajo] = (limite, identidad, time.perf_counter())
+        self._orden_vuelo.append((limite, id_trabajo))
+        return id_trabajo, self.trabajos[id_trabajo][1]
+
+    def confirmar(self, id_trabajo):
+        """
+        El actor proceso el trabajo: se borra de la cola
+
+        Returns:
+            (mensaje, segundos desde la entrega), o None si ya estaba confirmado
+        """
+        trabajo = self.trabajos.pop(id_trabajo, None)
+        if trabajo is None:
+            return None
+        self.conn.execute("DELETE FROM trabajos WHERE id = ?", (id_trabajo,))
+        self.conn.commit()
+
+        vuelo = self.en_vuelo.pop(id_trabajo, None)
+        if vuelo is None:
+            # Confirmado despues de volver a la cola: ya no hay que entregarlo
+            self.pendientes[trabajo[0]].remove(id_trabajo)
+            return trabajo[1], None
+        return trabajo[1], time.perf_counter() - vuelo[2]
+
+    def vencidos(self):
+        """
+        Devuelve a la cola los trabajos sin confirmacion a tiempo (al frente, conservan su orden)
+
+        Returns:
+            lista de identidades de los actores que no confirmaron
+        """
+        ahora = time.monotonic()
+        vencidos = []
+        while self._orden_vuelo and self._orden_vuelo[0][0] <= ahora:
+            _, id_trabajo = self._orden_vuelo.popleft()
+            vuelo = self.en_vuelo.pop(id_trabajo, None)
+            if vuelo is None:
+                continue
+            vencidos.append((id_trabajo, vuelo[1]))
+
+        for id_trabajo, _ in sorted(vencidos, reverse=True):
+            trabajo = self.trabajos[id_trabajo]
+            trabajo[2] += 1
+            self.pendientes[trabajo[0]].appendleft(id_trabajo)
+            self.conn.execute("UPDATE trabajos SET intentos = ? WHERE id = ?", (trabajo[2], id_trabajo))
+        if vencidos:
+            self.conn.commit()
+            self.reentregas += len(vencidos)
+        return [identidad for _, identidad in vencidos]
+
+    def hay_pendientes(self):
+        return len(self.trabajos) > len(self.en_vuelo)
+
+    def profundidad(self):
+        """Trabajos sin entregar"""
+        return len(self.trabajos) - len(self.en_vuelo)
+
+    def estado(self):
+        """Resumen para el socket de control (se llama desde su hilo: solo copias de una vez)"""
+        return {
+            "archivo": self.archivo,
+            "pendientes": {canal: len(ids) for canal, ids in list(self.pendientes.items()) if ids},
+            "en_vuelo": len(self.en_vuelo),
+            "reentregas": self.reentregas,
+            "max_intentos": max((trabajo[2] for trabajo in list(self.trabajos.values())), default=0)
+        }
+
+    def cerrar(self):
+        self.conn.close()
@@ -0,0 +1,137 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import registro
+
+log = registro.obtener("ga.commit_agrupado")
+
+
+class CommitAgrupado:
+    def __init__(self, conexiones, aplicar, al_confirmar=None, ventana_ms=2.0, max_lote=64, metricas=None,
+                 perfilador=None):
+        """
+        Group commit: agrupa escrituras concurrentes en una sola transaccion
+
+        Un hilo dedicado toma las escrituras encoladas hasta completar max_lote o
+        hasta que vence la ventana contada desde la primera. Cada escritura corre
+        dentro de su propio SAVEPOINT, de modo que un error solo deshace esa
+        operacion; el lote completo se confirma con un unico COMMIT (un fsync).
+
+        Args:
+            conexiones: GestorConexiones en modo persistente
+            aplicar: funcion(cursor, operacion, codigo, usuario, traza, id_operacion) -> (respuesta, cambio)
+                     que aplica la escritura sin hacer commit
+            al_confirmar: funcion(cambios) llamada tras el COMMIT con los cambios aplicados
+            ventana_ms: tiempo maximo que se espera para completar un lote
+            max_lote: cantidad maxima de escrituras por transaccion
+            metricas: Metricas donde registrar la espera en cola y la duracion de cada lote
+            perfilador: Perfilador del proceso; el hilo del lote lo revisa antes de cada lote
+        """
+        if not conexiones.persistente:
+            raise ValueError("El group commit requiere conexiones persistentes (WAL)")
+
+        self.conexiones = conexiones
+        self.aplicar = aplicar
+        self.al_confirmar = al_confirmar
+        self.ventana = ventana_ms / 1000.0
+        self.max_lote = max_lote
+        self.metricas = metricas
+        self.perfilador = perfilador
+
+        self.cola = queue.Queue()
+        self.lotes = 0
+        self.escrituras = 0
+
+        self.hilo = threading.Thread(target=self._ejecutar, daemon=True)
+        self.hilo.start()
+
+    def enviar(self, operacion, codigo, usuario, mensaje_error="Error", traza=None, id_operacion=None):
+        """Encola una escritura y espera su respuesta individual"""
+        futuro = Future()
+        self.cola.put((futuro, operacion, codigo, usuario, mensaje_error, traza, id_operacion, time.perf_counter()))
+        return futuro.result()
+
+    def _tomar_lote(self):
+        """Bloquea hasta la primera escritura y junta las que lleguen dentro de la ventana"""
+        lote = [self.cola.get()]
+        limite = time.monotonic() + self.ventana
+
+        while len(lote) < self.max_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.cola.get(timeout=restante))
+            except queue.Empty:
+                break
+
+        return lote
+
+    def _ejecutar(self):
+        while True:
+            lote = self._tomar_lote()
+            if self.perfilador and self.perfilador.activo:
+                self.perfilador.revisar()
+            inicio = time.perf_counter()
+
+            respuestas, cambios = self._confirmar_lote(lote)
+
+            # Replicar solo lo que quedo confirmado, luego despertar a cada solicitante
+            if cambios and self.al_confirmar:
+                try:
+                    self.al_confirmar(cambios)
+                except Exception as e:
+                    log.exception(f"L Error tras confirmar lote: {e}")
+
+            self.lotes += 1
+            self.escrituras += len(lote)
+
+            if self.metricas:
+                # Espera: desde que se encolo hasta que empezo su lote; servicio: el lote completo
+                servicio = time.perf_counter() - inicio
+                for (*_, encolado), respuesta in zip(lote, respuestas):
+                    self.metricas.registrar("commit_agrupado", "ok" if respuesta.get("exito") else "rechazo",
+                                            servicio, inicio - encolado)
+
+            for (futuro, *_), respuesta in zip(lote, respuestas):
+                futuro.set_result(respuesta)
+
+    def _confirmar_lote(self, lote):
+        conn = self.conexiones.obtener()
+        cursor = conn.cursor()
+        respuestas = []
+        cambios = []
+
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+
+            for _, operacion, codigo, usuario, mensaje_error, traza, id_operacion, _ in lote:
+                cursor.execute("SAVEPOINT escritura")
+                try:
+                    respuesta, cambio = self.aplicar(cursor, operacion, codigo, usuario, traza, id_operacion)
+                    cursor.execute("RELEASE escritura")
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO escritura")
+                    cursor.execute("RELEASE escritura")
+                    respuesta, cambio = {"exito": False, "mensaje": f"{mensaje_error}: {str(e)}"}, None
+
+                respuestas.append(respuesta)
+                if cambio:
+                    cambios.append(cambio)
+
+            conn.commit()
+            return respuestas, cambios
+
+        except Exception as e:
+            conn.rollback()
+            error = {"exito": False, "mensaje": f"Error confirmando lote: {str(e)}"}
+            return [error] * len(lote), []
+
+    def estadisticas(self):
+        return {
+            "lotes": self.lotes,
+            "escrituras": self.escrituras,
+            "promedio_lote": (self.escrituras / self.lotes) if self.lotes else 0
+        }
@@ -0,0 +1,111 @@
+import sqlite3
+import threading
+
+MODO_EFIMERA = "efimera"
+MODO_PERSISTENTE = "persistente"
+
+# Codigos primarios de SQLite que indican que otra conexion tiene la BD (se puede reintentar)
+_OCUPADA = (getattr(sqlite3, "SQLITE_BUSY", 5), getattr(sqlite3, "SQLITE_LOCKED", 6))
+
+
+def es_ocupada(error):
+    """Si un error de SQLite es SQLITE_BUSY/SQLITE_LOCKED (transitorio) y no un error permanente"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    codigo = getattr(error, "sqlite_errorcode", None)
+    if codigo is not None:
+        # Los codigos extendidos (SQLITE_BUSY_SNAPSHOT, ...) llevan el primario en el byte bajo
+        return codigo & 0xFF in _OCUPADA
+    # Python < 3.11 no expone el codigo
+    return "locked" in str(error) or "busy" in str(error)
+
+
+class GestorConexiones:
+    def __init__(self, db_file, modo=MODO_EFIMERA, synchronous="NORMAL",
+                 cache_size=-16000, mmap_size=268435456, cached_statements=256):
+        """
+        Administra las conexiones SQLite de un proceso
+
+        En modo 'efimera' se abre y cierra una conexion por operacion (comportamiento
+        original). En modo 'persistente' cada hilo mantiene una conexion abierta
+        durante toda la vida del proceso, con journal WAL y PRAGMAs ajustados.
+
+        Args:
+            db_file: ruta del archivo SQLite
+            modo: 'efimera' o 'persistente'
+            synchronous: valor de PRAGMA synchronous (OFF, NORMAL, FULL, EXTRA)
+            cache_size: valor de PRAGMA cache_size (negativo = KiB)
+            mmap_size: valor de PRAGMA mmap_size en bytes (0 lo desactiva)
+            cached_statements: sentencias preparadas que se mantienen en cache por conexion
+        """
+        if modo not in (MODO_EFIMERA, MODO_PERSISTENTE):
+            raise ValueError(f"Modo de conexion desconocido: {modo}")
+
+        self.db_file = db_file
+        self.modo = modo
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+
+        self._locales = threading.local()
+        self._abiertas = []
+        self._lock = threading.Lock()
+
+    @property
+    def persistente(self):
+        return self.modo == MODO_PERSISTENTE
+
+    def _abrir(self):
+        """Abre una conexion nueva y aplica la configuracion del modo"""
+        if not self.persistente:
+            conn = sqlite3.connect(self.db_file)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        conn = sqlite3.connect(self.db_file, timeout=30,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def obtener(self):
+        """Devuelve una conexion lista para usar; liberarla con liberar()"""
+        if not self.persistente:
+            return self._abrir()
+
+        conn = getattr(self._locales, "conn", None)
+        if conn is None:
+            conn = self._abrir()
+            self._locales.conn = conn
+            with self._lock:
+                self._abiertas.append(conn)
+        return conn
+
+    def liberar(self, conn):
+        """Devuelve la conexion; en modo efimero se cierra"""
+        if not self.persistente:
+            conn.close()
+
+    def cerrar(self):
+        """Cierra todas las conexiones persistentes abiertas"""
+        with self._lock:
+            abiertas, self._abiertas = self._abiertas, []
+        for conn in abiertas:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # Conexion creada en otro hilo; se cierra al terminar el proceso
+                pass
+        self._locales = threading.local()
+
+    def descripcion(self):
+        if not self.persistente:
+            return "efimera (una conexion por operacion)"
+        return (f"persistente (WAL, synchronous={self.synchronous}, "
+                f"cache_size={self.cache_size}, mmap_size={self.mmap_size}, "
+                f"cached_statements={self.cached_statements})")
@@ -0,0 +1,123 @@
+"""
+Consulta el socket de control (--puerto-control) de uno o varios procesos
+
+Muestra, por proceso, una tabla con las latencias de servicio y de espera de
+cada operacion, los contadores y los medidores. Con --json imprime la respuesta tal cual.
+"""
+import argparse
+import json
+import sys
+import time
+
+import zmq
+
+import codec
+
+COLUMNAS = ("n", "p50_ms", "p90_ms", "p99_ms", "p99.9_ms", "max_ms")
+
+
+def consultar(context, endpoint, solicitud, timeout_ms=2000):
+    """Envia un comando de control; None si el proceso no responde"""
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.setsockopt(zmq.RCVTIMEO, timeout_ms)
+    socket.connect(endpoint)
+    try:
+        socket.send(codec.codificar(solicitud))
+        respuesta, _ = codec.decodificar(socket.recv())
+        return respuesta
+    except zmq.error.Again:
+        return None
+    finally:
+        socket.close()
+
+
+def _parametro(texto):
+    """"clave=valor" -> (clave, valor); el valor se interpreta como JSON si se puede (30, true)"""
+    clave, separador, valor = texto.partition("=")
+    if not separador or not clave:
+        raise argparse.ArgumentTypeError(f"se esperaba clave=valor: {texto}")
+    try:
+        return clave, json.loads(valor)
+    except json.JSONDecodeError:
+        return clave, valor
+
+
+def _celdas(resumen):
+    return [str(resumen.get(columna, "-")) for columna in COLUMNAS]
+
+
+def mostrar_stats(endpoint, stats):
+    print(f"\n {stats['proceso']} ({endpoint}) - activo {stats['activo_s']} s, ventana {stats['ventana_s']} s")
+
+    filas = []
+    for operacion, por_resultado in sorted(stats["operaciones"].items()):
+        for resultado, histogramas in sorted(por_resultado.items()):
+            filas.append([operacion, resultado, "servicio"] + _celdas(histogramas["servicio"]))
+            if histogramas["espera"]["n"]:
+                filas.append(["", "", "espera"] + _celdas(histogramas["espera"]))
+
+    if filas:
+        encabezado = ["operacion", "resultado", "medida"] + list(COLUMNAS)
+        anchos = [max(len(fila[i]) for fila in filas + [encabezado]) for i in range(len(encabezado))]
+        for fila in [encabezado] + filas:
+            print(("   " + "  ".join(texto.ljust(ancho) for texto, ancho in zip(fila, anchos))).rstrip())
+    else:
+        print("   sin operaciones registradas")
+
+    if stats["contadores"]:
+        print("   contadores: " + ", ".join(f"{nombre}={valor}" for nombre, valor in sorted(stats["contadores"].items())))
+    if stats.get("medidores"):
+        print("   medidores: " + ", ".join(f"{nombre}={valor}" for nombre, valor in sorted(stats["medidores"].items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Consulta el socket de control de los procesos",
+        epilog="Ejemplos:\n"
+               "  python consultar_control.py tcp://10.43.103.177:5590 tcp://10.43.103.177:5591\n"
+               "  python consultar_control.py tcp://10.43.103.177:5590 --reiniciar --cada 10\n"
+               "  python consultar_control.py tcp://10.43.103.177:5591 --comando replicacion\n"
+               "  python consultar_control.py tcp://10.43.103.177:5591 --comando perfil_iniciar "
+               "-p modo=cprofile -p duracion_s=20",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("endpoints", nargs="+", help="endpoints de control (tcp://ip:puerto)")
+    parser.add_argument("--comando", default="stats", help="comando a enviar (por defecto stats)")
+    parser.add_argument("-p", "--parametro", type=_parametro, action="append", default=[], metavar="CLAVE=VALOR",
+                        help="campo extra del comando (repetible)")
+    parser.add_argument("--reiniciar", action="store_true",
+                        help="con stats, empezar una ventana nueva despues de cada consulta")
+    parser.add_argument("--cada", type=float, default=0,
+                        help="repetir la consulta cada N segundos (0 = una sola vez)")
+    parser.add_argument("--json", action="store_true", help="imprimir la respuesta JSON sin formato")
+    parser.add_argument("--timeout-ms", type=int, default=2000, help="espera maxima por cada proceso")
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    solicitud = {"comando": args.comando, **dict(args.parametro)}
+    if args.reiniciar:
+        solicitud["reiniciar"] = True
+
+    sin_respuesta = False
+    try:
+        while True:
+            for endpoint in args.endpoints:
+                respuesta = consultar(context, endpoint, solicitud, args.timeout_ms)
+                if respuesta is None:
+                    print(f"\n {endpoint}: sin respuesta")
+                    sin_respuesta = True
+                elif args.json or "stats" not in respuesta:
+                    print(f"\n {endpoint}:")
+                    print(json.dumps(respuesta, indent=2, ensure_ascii=False))
+                else:
+                    mostrar_stats(endpoint, respuesta["stats"])
+            if not args.cada:
+                break
+            time.sleep(args.cada)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        context.term()
+
+    sys.exit(1 if sin_respuesta else 0)
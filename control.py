@@ -0,0 +1,83 @@
+"""
+Socket de control de los procesos del sistema
+
+Cada proceso puede abrir un socket REP (--puerto-control) atendido por un hilo
+propio, fuera del camino de las solicitudes. Responde comandos como
+{"comando": "stats", "reiniciar": true} o {"comando": "perfil_iniciar",
+"modo": "muestreo", "duracion_s": 30}; los procesos agregan los suyos con
+registrar().
+"""
+import threading
+
+import zmq
+
+import codec
+import registro
+
+log = registro.obtener("control")
+
+
+class ServidorControl:
+    def __init__(self, context, puerto, metricas, perfilador=None):
+        """
+        Args:
+            context: contexto ZMQ del proceso
+            puerto: puerto REP de control
+            metricas: Metricas del proceso (comando stats)
+            perfilador: Perfilador del proceso (comandos perfil_iniciar, perfil_detener, perfil_estado)
+        """
+        self.metricas = metricas
+        self.comandos = {
+            "stats": lambda solicitud: {
+                "exito": True,
+                "stats": self.metricas.instantanea(reiniciar=bool(solicitud.get("reiniciar")))
+            },
+            "health_check": lambda solicitud: {"status": "ok", "proceso": self.metricas.proceso},
+            "comandos": lambda solicitud: {"exito": True, "comandos": sorted(self.comandos)},
+        }
+
+        if perfilador:
+            perfilador.registrar_comandos(self)
+
+        self.socket = context.socket(zmq.REP)
+        self.socket.bind(f"tcp://*:{puerto}")
+        self.hilo = threading.Thread(target=self._atender, daemon=True)
+        self.hilo.start()
+        log.info(f" Control: puerto {puerto} (stats{', perfil_*' if perfilador else ''}, comandos)")
+
+    def registrar(self, comando, funcion):
+        """Agrega un comando: funcion(solicitud) -> dict de respuesta"""
+        self.comandos[comando] = funcion
+
+    def _atender(self):
+        while True:
+            formato = codec.FORMATO_JSON
+            try:
+                solicitud, formato = codec.decodificar(self.socket.recv())
+                if solicitud.get("operacion") == "negociar_formato":
+                    respuesta = codec.respuesta_negociacion(solicitud)
+                else:
+                    comando = solicitud.get("comando") or solicitud.get("operacion")
+                    funcion = self.comandos.get(comando)
+                    if funcion:
+                        respuesta = funcion(solicitud)
+                    else:
+                        respuesta = {"exito": False, "mensaje": f"Comando desconocido: {comando}"}
+            except zmq.error.ContextTerminated:
+                break
+            except Exception as e:
+                log.exception(f" Error en comando de control: {e}")
+                respuesta = {"exito": False, "mensaje": str(e)}
+
+            try:
+                self.socket.send(codec.codificar(respuesta, formato))
+            except zmq.error.ContextTerminated:
+                break
+
+
+def agregar_argumentos(parser):
+    parser.add_argument("--puerto-control", default=None,
+                        help="puerto REP de control (stats con latencias y contadores, perfilado; "
+                             "desactivado por defecto)")
+    parser.add_argument("--perfiles-dir", default="perfiles",
+                        help="directorio donde se escriben los perfiles pedidos por el socket de control")
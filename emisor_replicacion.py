@@ -0,0 +1,105 @@
+import queue
+import threading
+import time
+
+import zmq
+
+import codec
+import metricas
+import registro
+
+log = registro.obtener("ga.replicacion")
+log_solicitudes = registro.solicitudes("ga.replicacion")
+
+# Hora (time.time() de la primaria) tomada dentro de la transaccion de cada cambio, antes
+# del COMMIT: la replica que aplico ese cambio tiene todo lo confirmado hasta esa hora
+CAMPO_PRIMARIA = "t_primaria"
+
+
+class EmisorReplicacion:
+    def __init__(self, socket, formato=codec.FORMATO_JSON, ventana_ms=2.0, max_lote=256):
+        """
+        Envia a la replica las operaciones confirmadas, agrupadas en lotes
+
+        Un hilo dedicado es el unico que usa el socket PUSH. Toma las operaciones
+        encoladas hasta completar max_lote o hasta que vence la ventana contada
+        desde la primera, y las envia en un solo mensaje {"tipo": "lote", ...}.
+        Si el envio falla las operaciones siguen en el log de replicacion del GA
+        y la replica las recupera por secuencia.
+
+        Args:
+            socket: socket PUSH conectado a la replica
+            formato: formato de los mensajes (json o binario)
+            ventana_ms: tiempo maximo que se espera para completar un lote
+            max_lote: cantidad maxima de operaciones por mensaje
+        """
+        self.socket = socket
+        self.formato = formato
+        self.ventana = ventana_ms / 1000.0
+        self.max_lote = max_lote
+
+        self.cola = queue.Queue()
+        self.lotes = 0
+        self.operaciones = 0
+        self.mayor_lote = 0
+        self.no_enviadas = 0
+
+        self.hilo = threading.Thread(target=self._ejecutar, daemon=True)
+        self.hilo.start()
+
+    def encolar(self, operaciones):
+        """Agrega operaciones ya confirmadas, en orden de secuencia"""
+        for operacion in operaciones:
+            self.cola.put(operacion)
+
+    def _tomar_lote(self):
+        """Bloquea hasta la primera operacion y junta las que lleguen dentro de la ventana"""
+        lote = [self.cola.get()]
+        limite = time.monotonic() + self.ventana
+
+        while len(lote) < self.max_lote:
+            restante = limite - time.monotonic()
+            try:
+                if restante <= 0:
+                    # Vencida la ventana solo se agrega lo que ya esta encolado
+                    lote.append(self.cola.get_nowait())
+                else:
+                    lote.append(self.cola.get(timeout=restante))
+            except queue.Empty:
+                break
+
+        return lote
+
+    def _ejecutar(self):
+        while True:
+            lote = self._tomar_lote()
+
+            # Una operacion sola viaja como antes, sin envoltorio de lote
+            mensaje = dict(lote[0]) if len(lote) == 1 else {"tipo": "lote", "operaciones": lote}
+            metricas.sellar(mensaje)
+            secuencias = f"{lote[0].get('secuencia', 'N/A')}..{lote[-1].get('secuencia', 'N/A')}"
+
+            try:
+                self.socket.send(codec.codificar(mensaje, self.formato), zmq.NOBLOCK)
+                log_solicitudes.debug("=Lote de replicacion enviado: %d operaciones (secuencias %s)",
+                                      len(lote), secuencias)
+            except zmq.error.Again:
+                self.no_enviadas += len(lote)
+                log.warning(f" Replica ocupada, las secuencias {secuencias} se recuperaran desde el log")
+            except Exception as e:
+                self.no_enviadas += len(lote)
+                log.error(f"L Error replicando: {e}")
+
+            self.lotes += 1
+            self.operaciones += len(lote)
+            self.mayor_lote = max(self.mayor_lote, len(lote))
+
+    def estadisticas(self):
+        return {
+            "lotes": self.lotes,
+            "operaciones": self.operaciones,
+            "promedio_lote": (self.operaciones / self.lotes) if self.lotes else 0,
+            "mayor_lote": self.mayor_lote,
+            "no_enviadas": self.no_enviadas,
+            "en_cola": self.cola.qsize()
+        }
@@ -0,0 +1,124 @@
+import sqlite3
+import sys
+import glob
+
+# Migraciones del esquema: (version, descripcion, sentencias)
+# La version aplicada se guarda en PRAGMA user_version del archivo SQLite,
+# asi que cada BD (primaria o replica) se actualiza en sitio una sola vez.
+MIGRACIONES = [
+    (1, "Indices secundarios de prestamos", [
+        # Devolucion y renovacion buscan por (codigo, usuario); incluye las columnas
+        # que lee la renovacion para que la consulta no toque la tabla
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_codigo_usuario "
+        "ON prestamos (codigo, usuario, renovaciones, fecha_devolucion)",
+        # Consultas de prestamos de un usuario
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_usuario "
+        "ON prestamos (usuario, codigo, fecha_devolucion)",
+        # Consultas por fecha de entrega (vencimientos)
+        "CREATE INDEX IF NOT EXISTS idx_prestamos_fecha_devolucion "
+        "ON prestamos (fecha_devolucion, codigo, usuario)",
+    ]),
+    (2, "Log de replicacion secuenciado", [
+        # En la primaria: cada cambio confirmado, en la misma transaccion que el cambio.
+        # AUTOINCREMENT garantiza que una secuencia nunca se reutiliza tras depurar el log
+        "CREATE TABLE IF NOT EXISTS replicacion_log ("
+        "secuencia INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "operacion TEXT NOT NULL)",
+        # Posiciones de replicacion: 'aplicada' en la replica, 'confirmada' (ack) en la primaria
+        "CREATE TABLE IF NOT EXISTS replicacion_estado ("
+        "clave TEXT PRIMARY KEY, "
+        "valor INTEGER NOT NULL)",
+    ]),
+    (3, "Operaciones aplicadas (idempotencia)", [
+        # Devoluciones y renovaciones de la cola del GC (entrega "al menos una vez"):
+        # una operacion que llega de nuevo devuelve la respuesta guardada sin aplicarse
+        "CREATE TABLE IF NOT EXISTS operaciones_aplicadas ("
+        "id_operacion TEXT PRIMARY KEY, "
+        "respuesta TEXT NOT NULL, "
+        "fecha REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_operaciones_aplicadas_fecha "
+        "ON operaciones_aplicadas (fecha)",
+    ]),
+    (4, "Huella de las operaciones aplicadas", [
+        # Un id_operacion repetido con otra operacion, libro o usuario no es un reintento:
+        # se rechaza en lugar de devolver la respuesta guardada. Las filas anteriores
+        # quedan sin huella y se aceptan como antes
+        "ALTER TABLE operaciones_aplicadas ADD COLUMN operacion TEXT",
+        "ALTER TABLE operaciones_aplicadas ADD COLUMN codigo TEXT",
+        "ALTER TABLE operaciones_aplicadas ADD COLUMN usuario TEXT",
+    ]),
+]
+
+VERSION_ESQUEMA = MIGRACIONES[-1][0]
+
+
+def version_actual(conn):
+    """Version del esquema guardada en la BD"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrar(conn):
+    """
+    Aplica las migraciones pendientes sobre una conexion abierta
+
+    Las tablas base deben existir. Cada migracion corre en su propia transaccion
+    junto con la actualizacion de user_version.
+
+    Returns:
+        lista de (version, descripcion) aplicadas
+    """
+    aplicadas = []
+    version = version_actual(conn)
+
+    for numero, descripcion, sentencias in MIGRACIONES:
+        if numero <= version:
+            continue
+
+        try:
+            conn.execute("BEGIN")
+            for sentencia in sentencias:
+                conn.execute(sentencia)
+            conn.execute(f"PRAGMA user_version = {numero}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        aplicadas.append((numero, descripcion))
+
+    return aplicadas
+
+
+def migrar_archivo(db_file):
+    """Actualiza en sitio un archivo bd_sede*.db existente"""
+    conn = sqlite3.connect(db_file)
+    try:
+        tablas = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "prestamos" not in tablas:
+            print(f" {db_file}: no tiene tabla prestamos, se omite")
+            return []
+
+        antes = version_actual(conn)
+        aplicadas = migrar(conn)
+
+        if aplicadas:
+            for numero, descripcion in aplicadas:
+                print(f" {db_file}: migracion {numero} aplicada ({descripcion})")
+        else:
+            print(f" {db_file}: esquema al dia (version {antes})")
+
+        return aplicadas
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    archivos = sys.argv[1:] or sorted(glob.glob("bd_sede*.db"))
+
+    if not archivos:
+        print("Uso: python esquema_bd.py [archivo.db ...]")
+        print("Sin argumentos actualiza todos los bd_sede*.db del directorio actual")
+        sys.exit(1)
+
+    for archivo in archivos:
+        migrar_archivo(archivo)
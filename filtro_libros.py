@@ -0,0 +1,199 @@
+"""
+Filtro de existencia de los codigos del catalogo (filtro de Bloom)
+
+El GA arma el filtro con los codigos de su tabla libros y se lo envia al GC,
+que rechaza al momento las solicitudes de libros que seguro no existen, sin
+pasar por los actores ni el GA. No hay falsos negativos: si el filtro no
+contiene un codigo, el libro no existe. Los falsos positivos (1% por defecto)
+siguen el camino de siempre y los rechaza el GA.
+
+Memoria: m = -n ln(p) / (ln 2)^2 bits para n libros y tasa p; con p = 1% son
+9.6 bits (1.2 bytes) por libro, 1.2 MB por millon de libros (ver
+benchmark_filtro.py para la comparacion con un set o una lista ordenada).
+
+El GC le pide el filtro a cada GA (uno por particion) al iniciar y despues cada
+`refresco_s` con la version que tiene; el GA solo lo reenvia si su catalogo
+cambio (cantidad de libros y ultimo rowid). Un libro agregado despues de la
+ultima consulta no esta en el filtro, asi que un "no existe" solo se cree
+durante `vigencia_s` desde que el GA confirmo el filtro; despues la solicitud
+sigue al GA y el filtro se vuelve a consultar en el momento.
+"""
+import hashlib
+import math
+import threading
+import time
+
+import zmq
+
+import codec
+import registro
+
+log = registro.obtener("filtro_libros")
+
+TASA_FALSOS = 0.01
+TIMEOUT_MS = 60000
+VIGENCIA_S = 5.0
+
+
+class FiltroBloom:
+    def __init__(self, bits, hashes, datos=None, elementos=0):
+        """
+        Args:
+            bits: tamano del filtro en bits
+            hashes: posiciones que se marcan por codigo
+            datos: bytes del filtro (None = vacio)
+            elementos: codigos que ya contiene `datos`
+        """
+        self.bits = bits
+        self.hashes = hashes
+        self.datos = bytearray(datos) if datos is not None else bytearray((bits + 7) // 8)
+        self.elementos = elementos
+
+    @classmethod
+    def para(cls, elementos, tasa_falsos=TASA_FALSOS):
+        """Filtro vacio con el tamano optimo para `elementos` codigos y la tasa de falsos positivos dada"""
+        bits = max(math.ceil(-max(elementos, 1) * math.log(tasa_falsos) / math.log(2) ** 2), 64)
+        hashes = max(round(bits / max(elementos, 1) * math.log(2)), 1)
+        return cls(bits, hashes)
+
+    def _posiciones(self, codigo):
+        # Doble hashing (Kirsch-Mitzenmacher): un solo digest para las k posiciones
+        digest = hashlib.blake2b(codigo.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def agregar(self, codigo):
+        datos = self.datos
+        for posicion in self._posiciones(codigo):
+            datos[posicion >> 3] |= 1 << (posicion & 7)
+        self.elementos += 1
+
+    def __contains__(self, codigo):
+        datos = self.datos
+        for posicion in self._posiciones(codigo):
+            if not datos[posicion >> 3] & (1 << (posicion & 7)):
+                return False
+        return True
+
+    def tasa_falsos(self):
+        """Tasa de falsos positivos esperada con los codigos agregados"""
+        return (1 - math.exp(-self.hashes * self.elementos / self.bits)) ** self.hashes
+
+    def estado(self):
+        return {
+            "elementos": self.elementos,
+            "bits": self.bits,
+            "hashes": self.hashes,
+            "bytes": len(self.datos),
+            "tasa_falsos": round(self.tasa_falsos(), 6)
+        }
+
+
+class FiltroCatalogo:
+    def __init__(self, context, endpoints, particion=None, refresco_s=60.0, tasa_falsos=TASA_FALSOS, metricas=None,
+                 vigencia_s=VIGENCIA_S):
+        """
+        Filtros del catalogo en el GC, actualizados por un hilo propio
+
+        Args:
+            context: contexto ZMQ del proceso
+            endpoints: particion -> endpoint REP de su GA ({None: endpoint} sin particiones)
+            particion: funcion(codigo) -> particion (None = un solo GA)
+            refresco_s: cada cuanto se pregunta a los GA si cambio el catalogo
+            tasa_falsos: tasa de falsos positivos pedida al GA
+            metricas: Metricas donde publicar la memoria y los codigos de los filtros
+            vigencia_s: segundos desde que el GA confirmo un filtro durante los que se
+                        cree su "no existe"
+        """
+        self.context = context
+        self.endpoints = dict(endpoints)
+        self.particion = particion
+        self.refresco = refresco_s
+        self.tasa_falsos = tasa_falsos
+        self.vigencia = vigencia_s
+        self.actualizaciones = 0
+        self.vencidos = 0
+
+        # particion -> (version del catalogo, FiltroBloom, cuando lo confirmo el GA); se reemplaza
+        # entero al actualizar
+        self.filtros = {}
+        self.refrescar = threading.Event()
+
+        if metricas:
+            metricas.medir("filtro_libros_bytes", lambda: sum(len(filtro.datos) for _, filtro, _ in list(self.filtros.values())))
+            metricas.medir("filtro_libros_elementos", lambda: sum(filtro.elementos for _, filtro, _ in list(self.filtros.values())))
+
+        self.hilo = threading.Thread(target=self._ejecutar, daemon=True)
+        self.hilo.start()
+
+    def existe(self, codigo):
+        """
+        False solo si el libro seguro no existe: True sin filtro de su particion todavia,
+        y tambien si el filtro no lo contiene pero el GA lo confirmo hace mas de `vigencia_s`
+        (el libro puede ser nuevo; se pide el filtro otra vez)
+        """
+        cargado = self.filtros.get(self.particion(codigo) if self.particion else None)
+        if cargado is None or codigo in cargado[1]:
+            return True
+        if time.monotonic() - cargado[2] > self.vigencia:
+            self.vencidos += 1
+            self.refrescar.set()
+            return True
+        return False
+
+    def _ejecutar(self):
+        while True:
+            for particion, endpoint in self.endpoints.items():
+                try:
+                    self._actualizar(particion, endpoint)
+                except Exception as e:
+                    log.exception(f" Error actualizando el filtro de libros de {endpoint}: {e}")
+            self.refrescar.wait(self.refresco)
+            self.refrescar.clear()
+
+    def _actualizar(self, particion, endpoint):
+        cargado = self.filtros.get(particion)
+        socket = self.context.socket(zmq.REQ)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(endpoint)
+        # El filtro vale desde que el GA lo arma: un libro agregado despues no esta
+        confirmado = time.monotonic()
+        try:
+            socket.send(codec.codificar({
+                "operacion": "filtro_libros",
+                "version": cargado[0] if cargado else None,
+                "tasa_falsos": self.tasa_falsos
+            }))
+            if not socket.poll(TIMEOUT_MS):
+                # Sin respuesta se conserva el filtro anterior (o se sigue sin filtro)
+                log.warning(f" El GA {endpoint} no respondio el filtro de libros")
+                return
+            partes = socket.recv_multipart()
+        finally:
+            socket.close()
+
+        respuesta, _ = codec.decodificar(partes[0])
+        if not respuesta.get("exito"):
+            return
+        if respuesta.get("sin_cambios"):
+            if cargado:
+                self.filtros[particion] = (cargado[0], cargado[1], confirmado)
+            return
+        filtro = FiltroBloom(respuesta["bits"], respuesta["hashes"], partes[1], respuesta["elementos"])
+        self.filtros[particion] = (respuesta["version"], filtro, confirmado)
+        self.actualizaciones += 1
+        log.info(f" Filtro de libros{f' de {particion}' if particion else ''}: {filtro.elementos} libros en "
+                 f"{len(filtro.datos)} bytes (version {respuesta['version']})")
+
+    def estado(self):
+        ahora = time.monotonic()
+        return {
+            "actualizaciones": self.actualizaciones,
+            "refresco_s": self.refresco,
+            "vigencia_s": self.vigencia,
+            "vencidos": self.vencidos,
+            "filtros": {particion or "catalogo": {"version": version, "antiguedad_s": round(ahora - confirmado, 3),
+                                                  **filtro.estado()}
+                        for particion, (version, filtro, confirmado) in list(self.filtros.items())}
+        }
@@ -1,13 +1,54 @@
 import zmq
 import json
-import sqlite3
 import time
 from datetime import datetime, timedelta
-import sys
-import os
+import argparse
+import threading
+import logging
+
+from conexion_bd import GestorConexiones, MODO_EFIMERA, MODO_PERSISTENTE
+from commit_agrupado import CommitAgrupado
+from esquema_bd import migrar
+from cache_disponibilidad import CacheDisponibilidad
+from emisor_replicacion import EmisorReplicacion, CAMPO_PRIMARIA
+from snapshot_bd import GestorSnapshots
+from antientropia import IndiceMerkle, leer_bucket
+from filtro_libros import FiltroBloom, TASA_FALSOS
+from carga_masiva import cargar, generar_libros, generar_prestamos
+from particiones import MapaParticiones, host, puerto
+import codec
+import registro
+import metricas
+import control
+import trazas
+from metricas import Metricas
+from control import ServidorControl
+from perfilador import Perfilador
+
+log = registro.obtener("ga")
+log_solicitudes = registro.solicitudes("ga")
+
+# Operaciones aplicadas que se recuerdan para descartar las repetidas (id_operacion)
+RETENCION_OPERACIONES_S = 24 * 3600
+DEPURAR_OPERACIONES_CADA = 1000
+
+# Operaciones que conserva el log de replicacion aunque la replica no confirme
+MAX_LOG_REPLICACION = 1000000
+RECORTAR_LOG_CADA = 1000
+
+
+def huella_operacion(operacion, codigo, usuario):
+    """(operacion, codigo, usuario) con que se guarda un id_operacion; los dos prestamos cuentan como uno"""
+    return ("prestamo" if operacion == "prestamo_condicional" else operacion), codigo, usuario
+
 
 class GestorAlmacenamiento:
-    def __init__(self, sede, puerto_rep="5557", replica_ip=None, replica_port=None):
+    def __init__(self, sede, puerto_rep="5557", replica_ip=None, replica_port=None,
+                 conexiones=None, workers=0, group_commit=False, ventana_ms=2.0, max_lote=64,
+                 cache_libros=0, formato=codec.FORMATO_JSON, replica_ventana_ms=2.0, replica_max_lote=256,
+                 max_log_replicacion=MAX_LOG_REPLICACION,
+                 libros_iniciales=1000, prestamos_iniciales=None, mapa=None, particion=None,
+                 puerto_control=None, dir_perfiles="perfiles", trazador=None):
         """
         Gestor de Almacenamiento - Maneja BD SQLite primaria y replica
         
@@ -16,38 +57,143 @@ class GestorAlmacenamiento:
             puerto_rep: puerto para recibir solicitudes (REP)
             replica_ip: IP de la replica secundaria
             replica_port: puerto de la replica secundaria
+            conexiones: GestorConexiones a usar (por defecto una conexion por operacion)
+            workers: hilos que atienden solicitudes detras de un broker ROUTER/DEALER
+                     (0 = un solo socket REP, comportamiento original)
+            group_commit: agrupar escrituras concurrentes en una sola transaccion
+            ventana_ms: espera maxima para completar un lote del group commit
+            max_lote: escrituras maximas por transaccion del group commit
+            cache_libros: capacidad de la cache LRU de disponibilidad (0 = sin cache)
+            formato: formato de los mensajes enviados a la replica (json o binario)
+            replica_ventana_ms: espera maxima para completar un lote de replicacion
+            replica_max_lote: operaciones maximas por mensaje de replicacion
+            max_log_replicacion: operaciones que conserva el log sin confirmar (0 = sin limite);
+                                 una replica que queda mas atras se reinicia con un snapshot
+            libros_iniciales: libros del catalogo sintetico si la BD esta vacia
+            prestamos_iniciales: prestamos sinteticos si la BD esta vacia (None = 50 en sede 1, 150 en sede 2)
+            mapa: MapaParticiones si el catalogo esta particionado entre varios GA
+            particion: particion del catalogo que atiende este GA (requiere mapa)
+            puerto_control: puerto REP de control con el comando stats (None = sin control)
+            dir_perfiles: directorio de los perfiles que se piden por el socket de control
+            trazador: Trazador; continua las trazas de las solicitudes y las pasa a la replica
         """
         self.sede = sede
-        self.db_file = f"bd_sede{sede}.db"
+        self.mapa = mapa
+        self.particion = particion
+        self.db_file = mapa.db_file(sede, particion) if particion else f"bd_sede{sede}.db"
         self.replica_ip = replica_ip
         self.replica_port = replica_port
+        self.formato = formato
+        self.max_log_replicacion = max_log_replicacion
+        self.conexiones = conexiones or GestorConexiones(self.db_file)
+        self.workers = workers
+        self.libros_iniciales = libros_iniciales
+        self.prestamos_iniciales = prestamos_iniciales
+        
+        if workers and not self.conexiones.persistente:
+            raise ValueError("El modo con workers requiere conexiones persistentes (WAL)")
         
         self.context = zmq.Context()
         
-        # Socket REP: recibe solicitudes de Actores y GC
-        self.socket_rep = self.context.socket(zmq.REP)
-        self.socket_rep.bind(f"tcp://*:{puerto_rep}")
+        # Latencias por operacion; se consultan por el socket de control
+        self.metricas = Metricas(f"ga_sede{sede}" + (f"_{particion}" if particion else ""))
+        self.perfilador = Perfilador(self.metricas.proceso, dir_perfiles)
+        self.trazas = trazador or trazas.INACTIVO
+        
+        if workers:
+            # Broker: ROUTER recibe de Actores y GC, DEALER reparte entre los workers
+            self.socket_rep = None
+            self.socket_frontend = self.context.socket(zmq.ROUTER)
+            self.socket_frontend.bind(f"tcp://*:{puerto_rep}")
+            self.socket_backend = self.context.socket(zmq.DEALER)
+            self.socket_backend.bind("inproc://ga_workers")
+        else:
+            # Socket REP: recibe solicitudes de Actores y GC
+            self.socket_rep = self.context.socket(zmq.REP)
+            self.socket_rep.bind(f"tcp://*:{puerto_rep}")
         
         # Socket PUSH: para comunicarse con r�plica (as�ncrono)
+        # Solo lo usa el hilo del emisor, que agrupa las operaciones en lotes
         self.socket_replica = None
+        self.emisor = None
         if replica_ip and replica_port:
             self.socket_replica = self.context.socket(zmq.PUSH)
             self.socket_replica.connect(f"tcp://{replica_ip}:{replica_port}")
-            print(f"=Conectado a replica en {replica_ip}:{replica_port}")
+            self.emisor = EmisorReplicacion(
+                self.socket_replica,
+                formato=formato,
+                ventana_ms=replica_ventana_ms,
+                max_lote=replica_max_lote
+            )
+            log.info(f"=Conectado a replica en {replica_ip}:{replica_port} "
+                     f"(lotes de hasta {replica_max_lote} operaciones, ventana {replica_ventana_ms}ms)")
             time.sleep(1)  # Esperar a que PULL est� listo
         
-        print(f"=Gestor de Almacenamiento Sede {sede} iniciado")
-        print(f"=REP: puerto {puerto_rep}")
-        print(f"=Base de datos SQLite: {self.db_file}\n")
+        log.info(f"=Gestor de Almacenamiento Sede {sede} iniciado")
+        if workers:
+            log.info(f"=ROUTER: puerto {puerto_rep} -> {workers} workers")
+        else:
+            log.info(f"=REP: puerto {puerto_rep}")
+        log.info(f"=Base de datos SQLite: {self.db_file}")
+        if particion:
+            log.info(f"=Particion {particion} de {len(mapa.particiones)} (mapa version {mapa.version})")
+        log.info(f"=Conexion: {self.conexiones.descripcion()}")
         
         # Inicializar BD
         self.inicializar_bd()
         
+        # Snapshots para inicializar replicas por la red
+        self.snapshots = GestorSnapshots(self.db_file)
+        
+        # Arbol Merkle para la anti-entropia con la replica (se construye con la primera consulta)
+        self.merkle = IndiceMerkle()
+        self.operaciones_registradas = 0
+        
+        # Filtro de Bloom de los codigos para el GC (se arma con el primer pedido y al cambiar el catalogo)
+        self.filtro_libros = None           # (version, tasa de falsos, FiltroBloom)
+        self.lock_filtro = threading.Lock()
+        
+        # Cache de disponibilidad: las escrituras la actualizan despues del COMMIT.
+        # La secuencia del log ordena esas actualizaciones con las lecturas de disco de los fallos
+        self.cache = None
+        if cache_libros:
+            self.cache = CacheDisponibilidad(capacidad=cache_libros)
+            conn = self.get_connection()
+            cargados = self.cache.cargar(conn, self.ultima_secuencia(conn.cursor()))
+            self.liberar_connection(conn)
+            alcance = "catalogo completo" if self.cache.completa else "catalogo parcial"
+            log.info(f"=Cache de disponibilidad: {cargados} libros ({alcance}, capacidad {cache_libros})")
+        
+        # Group commit: se crea despues de inicializar la BD
+        self.commit_agrupado = None
+        if group_commit:
+            self.commit_agrupado = CommitAgrupado(
+                self.conexiones,
+                self.aplicar_escritura,
+                al_confirmar=self.confirmar_cambios,
+                ventana_ms=ventana_ms,
+                max_lote=max_lote,
+                metricas=self.metricas,
+                perfilador=self.perfilador
+            )
+            log.info(f"=Group commit: ventana {ventana_ms}ms, maximo {max_lote} escrituras por transaccion")
+        
+        self.control = None
+        if puerto_control:
+            self.control = ServidorControl(self.context, puerto_control, self.metricas, self.perfilador)
+            self.control.registrar("replicacion", lambda solicitud: self.estado_replicacion())
+            self.control.registrar("cache", lambda solicitud: {
+                "exito": True,
+                "cache": self.cache.estadisticas() if self.cache else None
+            })
+        
     def get_connection(self):
-        """Crea una conexion a la BD SQLite"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row  # Para acceder por nombre de columna
-        return conn
+        """Obtiene una conexion a la BD SQLite segun el modo configurado"""
+        return self.conexiones.obtener()
+    
+    def liberar_connection(self, conn):
+        """Libera la conexion (en modo efimero la cierra)"""
+        self.conexiones.liberar(conn)
     
     def inicializar_bd(self):
         """Crea las tablas si no existen e inserta datos iniciales"""
@@ -83,81 +229,297 @@ class GestorAlmacenamiento:
         count = cursor.fetchone()[0]
         
         if count == 0:
-            print(" Inicializando BD con 1000 libros...")
+            prestamos_iniciales = self.prestamos_iniciales
+            if prestamos_iniciales is None:
+                # Préstamos iniciales por defecto: 50 sede 1, 150 sede 2
+                prestamos_iniciales = 50 if self.sede == 1 else 150
+            log.info(f" Inicializando BD con {self.libros_iniciales} libros...")
             
-            # Insertar 1000 libros
-            libros = []
-            for i in range(1, 1001):
-                codigo = f"ISBN{i:04d}"
-                titulo = f"Libro {i}"
-                autor = f"Autor {i % 100}"
-                ejemplares_totales = 1 if i % 10 == 0 else (i % 5 + 1)
-                ejemplares_disponibles = ejemplares_totales
-                
-                libros.append((codigo, titulo, autor, ejemplares_totales, ejemplares_disponibles))
+            libros = generar_libros(self.libros_iniciales)
+            prestamos = generar_prestamos(prestamos_iniciales, self.libros_iniciales)
+            if self.particion:
+                # Solo la parte del catalogo sintetico que pertenece a esta particion
+                libros = (libro for libro in libros if self.es_propio(libro[0]))
+                prestamos = (prestamo for prestamo in prestamos if self.es_propio(prestamo[0]))
             
-            cursor.executemany(
-                "INSERT INTO libros VALUES (?, ?, ?, ?, ?)",
-                libros
+            # Sin índices secundarios todavía: las migraciones los crean después de la carga
+            libros, prestamos = cargar(conn, libros, prestamos, diferir_indices=False)
+            log.info(f" BD inicializada: {libros} libros, {prestamos} préstamos")
+        else:
+            log.info(f" BD cargada: {count} libros existentes")
+        
+        # Indices y demas migraciones pendientes (actualiza BDs existentes en sitio)
+        for version, descripcion in migrar(conn):
+            log.info(f" Migracion de esquema {version} aplicada: {descripcion}")
+        
+        self.liberar_connection(conn)
+    
+    def replicar_operaciones(self, operaciones):
+        """Env�a operaciones confirmadas a la replica de forma asincrona (en lotes)"""
+        if self.emisor:
+            self.emisor.encolar(operaciones)
+        else:
+            log_solicitudes.debug("  Socket de replica no inicializado - NO SE REPLICA")
+    
+    def registrar_cambio(self, cursor, cambio):
+        """
+        Agrega un cambio al log de replicacion dentro de la transaccion que lo aplica
+        
+        El cambio queda en el log si y solo si se confirma la escritura. La secuencia
+        asignada viaja con el mensaje para que la replica detecte huecos y duplicados,
+        y la hora de la primaria para que mida su antiguedad con el reloj de la primaria
+        (se toma con el lock de escritura tomado: todo lo confirmado antes tiene secuencia menor).
+        """
+        operacion = {clave: valor for clave, valor in cambio.items() if clave not in ("libro", "traza")}
+        cursor.execute("INSERT INTO replicacion_log (operacion) VALUES (?)", (json.dumps(operacion),))
+        cambio["secuencia"] = cursor.lastrowid
+        cambio[CAMPO_PRIMARIA] = time.time()
+        if self.max_log_replicacion and cambio["secuencia"] % RECORTAR_LOG_CADA == 0:
+            self.recortar_log(cursor, cambio["secuencia"])
+    
+    def recortar_log(self, cursor, secuencia):
+        """
+        Limita el log cuando la replica no confirma (no hay replica o esta caida)
+        
+        Sin el limite el log crece con cada escritura. Una replica que pide operaciones
+        ya recortadas recibe requiere_resincronizacion y se reinicia con un snapshot.
+        """
+        cursor.execute("DELETE FROM replicacion_log WHERE secuencia <= ?", (secuencia - self.max_log_replicacion,))
+        if cursor.rowcount:
+            log.debug(f" Log de replicacion recortado: {cursor.rowcount} operaciones sin confirmar hasta la secuencia "
+                      f"{secuencia - self.max_log_replicacion}")
+    
+    def ultima_secuencia(self, cursor):
+        """Ultima secuencia asignada por el log (se conserva aunque el log este depurado)"""
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'replicacion_log'")
+        fila = cursor.fetchone()
+        return fila[0] if fila else 0
+    
+    def operaciones_pendientes(self, desde, limite=500):
+        """
+        Devuelve las operaciones del log posteriores a la secuencia 'desde'
+        
+        La replica las pide al arrancar, al reconectarse o al detectar un hueco.
+        Si el log ya no tiene las operaciones siguientes a 'desde' la replica no
+        puede ponerse al dia con el log y se informa requiere_resincronizacion.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            # Una sola transaccion de lectura: limites y operaciones del mismo instante
+            cursor.execute("BEGIN")
+            ultima = self.ultima_secuencia(cursor)
+            cursor.execute("SELECT MIN(secuencia) FROM replicacion_log")
+            primera = cursor.fetchone()[0] or ultima + 1
+            cursor.execute(
+                "SELECT secuencia, operacion FROM replicacion_log WHERE secuencia > ? ORDER BY secuencia LIMIT ?",
+                (desde, limite)
             )
-            
-            # Crear pr�stamos iniciales (50 sede 1, 150 sede 2)
-            prestamos_por_sede = 50 if self.sede == 1 else 150
-            fecha_prestamo = datetime.now().strftime("%Y-%m-%d")
-            fecha_devolucion = (datetime.now() + timedelta(weeks=2)).strftime("%Y-%m-%d")
-            
-            prestamos = []
-            for i in range(prestamos_por_sede):
-                codigo = f"ISBN{i+1:04d}"
-                usuario = f"user{i+1}"
-                prestamos.append((codigo, usuario, fecha_prestamo, fecha_devolucion, 0))
-            
-            cursor.executemany(
-                "INSERT INTO prestamos (codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones) VALUES (?, ?, ?, ?, ?)",
-                prestamos
+            filas = cursor.fetchall()
+        finally:
+            conn.rollback()
+            self.liberar_connection(conn)
+        
+        if desde + 1 < primera or desde > ultima:
+            return {
+                "exito": False,
+                "requiere_resincronizacion": True,
+                "mensaje": f"El log de replicacion no contiene las operaciones posteriores a {desde} "
+                           f"(disponibles {primera}..{ultima})",
+                "ultima_secuencia": ultima
+            }
+        
+        operaciones = []
+        for secuencia, operacion in filas:
+            operacion = json.loads(operacion)
+            operacion["secuencia"] = secuencia
+            operaciones.append(operacion)
+        
+        return {
+            "exito": True,
+            "mensaje": f"{len(operaciones)} operaciones pendientes desde {desde}",
+            "operaciones": operaciones,
+            "ultima_secuencia": ultima
+        }
+    
+    def confirmar_replicacion(self, secuencia):
+        """Registra la ultima secuencia aplicada por la replica y depura el log hasta ella"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                "INSERT INTO replicacion_estado (clave, valor) VALUES ('confirmada', ?) "
+                "ON CONFLICT(clave) DO UPDATE SET valor = MAX(valor, excluded.valor)",
+                (secuencia,)
             )
-            
-            # Actualizar disponibilidad de libros prestados
-            for codigo, _, _, _, _ in prestamos:
-                cursor.execute(
-                    "UPDATE libros SET ejemplares_disponibles = ejemplares_disponibles - 1 WHERE codigo = ?",
-                    (codigo,)
-                )
-            
+            cursor.execute("DELETE FROM replicacion_log WHERE secuencia <= ?", (secuencia,))
+            depuradas = cursor.rowcount
             conn.commit()
-            print(f" BD inicializada: 1000 libros, {prestamos_por_sede} pr�stamos")
-        else:
-            print(f" BD cargada: {count} libros existentes")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.liberar_connection(conn)
         
-        conn.close()
+        return {
+            "exito": True,
+            "mensaje": f"Replica confirmo hasta la secuencia {secuencia} ({depuradas} operaciones depuradas del log)"
+        }
     
-    def replicar_operacion(self, operacion):
-        """Env�a operacion a replica de forma asincrona"""
-        if self.socket_replica:
-            try:
-                mensaje = json.dumps(operacion)
-                print(f"=Intentando replicar a {self.replica_ip}:{self.replica_port}")
-                print(f"   Operacion: {operacion.get('tipo', 'desconocido')} - Codigo: {operacion.get('codigo', 'N/A')} - Usuario: {operacion.get('usuario', 'N/A')}")
-                self.socket_replica.send_string(mensaje, zmq.NOBLOCK)
-                print(f"Operacion enviada correctamente a la replica\n")
-            except zmq.error.Again:
-                print(f" Replica ocupada, operaci�n no replicada\n")
-            except Exception as e:
-                print(f"L Error replicando: {e}")
-                import traceback
-                traceback.print_exc()
-        else:
-            print(f"  Socket de replica no inicializado - NO SE REPLICA\n")
+    def estado_replicacion(self):
+        """Posicion del log de replicacion y de la ultima confirmacion de la replica"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            ultima = self.ultima_secuencia(cursor)
+            cursor.execute("SELECT valor FROM replicacion_estado WHERE clave = 'confirmada'")
+            fila = cursor.fetchone()
+            confirmada = fila[0] if fila else 0
+            cursor.execute("SELECT COUNT(*) FROM replicacion_log")
+            en_log = cursor.fetchone()[0]
+        finally:
+            self.liberar_connection(conn)
+        
+        return {
+            "exito": True,
+            "mensaje": f"Log en secuencia {ultima}, replica confirmada hasta {confirmada}",
+            "ultima_secuencia": ultima,
+            "confirmada": confirmada,
+            "pendientes": ultima - confirmada,
+            "en_log": en_log,
+            "max_log": self.max_log_replicacion,
+            "emisor": self.emisor.estadisticas() if self.emisor else None
+        }
     
-    def verificar_disponibilidad(self, codigo):
-        """Verifica si hay ejemplares disponibles de un libro"""
+    def antientropia_raiz(self):
+        """Pone al dia el arbol Merkle y devuelve su raiz junto con la secuencia que refleja"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT * FROM libros WHERE codigo = ?", (codigo,))
-        libro = cursor.fetchone()
-        conn.close()
+        try:
+            # Arbol y secuencia del mismo instante
+            cursor.execute("BEGIN")
+            secuencia = self.ultima_secuencia(cursor)
+            recalculados = self.merkle.actualizar(conn)
+        finally:
+            conn.rollback()
+            self.liberar_connection(conn)
+        
+        return {
+            "exito": True,
+            "mensaje": f"Arbol Merkle en secuencia {secuencia} ({recalculados} buckets recalculados)",
+            "secuencia": secuencia,
+            **self.merkle.resumen()
+        }
+    
+    def antientropia_nodos(self, version, nivel, indices):
+        """Hashes de nodos del arbol Merkle entregado por antientropia_raiz"""
+        hashes = self.merkle.nodos(version, nivel, indices)
+        if hashes is None:
+            return {"exito": False, "mensaje": "El arbol Merkle cambio, reiniciar la comparacion"}
+        return {"exito": True, "mensaje": f"{len(hashes)} nodos del nivel {nivel}", "hashes": hashes}
+    
+    def antientropia_bucket(self, indice, digest):
+        """Contenido de un bucket para repararlo en la replica, con la secuencia que refleja"""
+        if digest != self.merkle.digest or not 0 <= indice < len(self.merkle.limites):
+            return {"exito": False, "mensaje": "Limites de buckets distintos, reiniciar la comparacion"}
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("BEGIN")
+            secuencia = self.ultima_secuencia(cursor)
+            libros, prestamos = leer_bucket(conn, self.merkle.limites, indice)
+        finally:
+            conn.rollback()
+            self.liberar_connection(conn)
+        
+        return {
+            "exito": True,
+            "mensaje": f"Bucket {indice}: {len(libros)} libros, {len(prestamos)} prestamos",
+            "secuencia": secuencia,
+            "libros": libros,
+            "prestamos": prestamos
+        }
+    
+    def buscar_libro(self, codigo):
+        """Lee un libro de la cache o, si no esta, de la BD"""
+        if self.cache:
+            encontrado, libro = self.cache.obtener(codigo)
+            if encontrado:
+                return libro
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        if not self.cache:
+            cursor.execute("SELECT * FROM libros WHERE codigo = ?", (codigo,))
+            libro = cursor.fetchone()
+            self.liberar_connection(conn)
+            return libro
+        
+        try:
+            # Libro y secuencia del mismo instante: la cache descarta la lectura si despues confirmo una escritura
+            cursor.execute("BEGIN")
+            version = self.ultima_secuencia(cursor)
+            cursor.execute("SELECT * FROM libros WHERE codigo = ?", (codigo,))
+            libro = cursor.fetchone()
+        finally:
+            conn.rollback()
+            self.liberar_connection(conn)
+        
+        if libro:
+            self.cache.agregar_si_ausente(dict(libro), version)
+        return libro
+    
+    def enviar_filtro_libros(self, version=None, tasa_falsos=TASA_FALSOS):
+        """
+        Filtro de Bloom de los codigos propios para que el GC rechace los libros inexistentes
+        
+        La version del catalogo es la cantidad de libros y el ultimo rowid; si el GC ya
+        tiene esa version no se reenvia. Los bytes del filtro viajan en un segundo frame
+        """
+        conn = self.get_connection()
+        try:
+            cantidad, ultimo = conn.execute("SELECT COUNT(*), MAX(rowid) FROM libros").fetchone()
+            actual = f"{cantidad}:{ultimo or 0}"
+            if version == actual:
+                return {"exito": True, "version": actual, "sin_cambios": True}
+            
+            with self.lock_filtro:
+                if self.filtro_libros is None or self.filtro_libros[:2] != (actual, tasa_falsos):
+                    inicio = time.perf_counter()
+                    filtro = FiltroBloom.para(cantidad, tasa_falsos)
+                    for (codigo,) in conn.execute("SELECT codigo FROM libros"):
+                        if self.es_propio(codigo):
+                            filtro.agregar(codigo)
+                    self.filtro_libros = (actual, tasa_falsos, filtro)
+                    log.info(f" Filtro de libros armado: {filtro.elementos} libros, {len(filtro.datos)} bytes "
+                             f"en {time.perf_counter() - inicio:.2f} s")
+                filtro = self.filtro_libros[2]
+        finally:
+            self.liberar_connection(conn)
         
+        return {
+            "exito": True,
+            "version": actual,
+            "bits": filtro.bits,
+            "hashes": filtro.hashes,
+            "elementos": filtro.elementos,
+            "datos": bytes(filtro.datos)
+        }
+    
+    def verificar_disponibilidad(self, codigo):
+        """Verifica si hay ejemplares disponibles de un libro"""
+        return self.respuesta_disponibilidad(codigo, self.buscar_libro(codigo))
+    
+    def respuesta_disponibilidad(self, codigo, libro):
+        """Arma la respuesta de verificar_disponibilidad para un libro (o None)"""
         if not libro:
             return {
                 "disponible": False,
@@ -176,210 +538,459 @@ class GestorAlmacenamiento:
             "libro": dict(libro)
         }
     
-    def realizar_prestamo(self, codigo, usuario):
-        """Realiza un prestamo de libro"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def aplicar_prestamo(self, cursor, codigo, usuario, detallado=False):
+        """
+        Aplica un prestamo en la transaccion abierta, sin commit. Devuelve (respuesta, cambio)
         
-        try:
-            # Verificar disponibilidad
+        Con detallado=True los rechazos usan los mismos mensajes que verificar_disponibilidad
+        """
+        # Verificar disponibilidad
+        cursor.execute("SELECT * FROM libros WHERE codigo = ?", (codigo,))
+        libro = cursor.fetchone()
+        
+        if not libro:
+            return {
+                "exito": False,
+                "mensaje": f"El libro {codigo} no existe en la biblioteca" if detallado else "Libro no disponible"
+            }, None
+        
+        sin_ejemplares = {
+            "exito": False,
+            "mensaje": f"No hay ejemplares disponibles de '{libro['titulo']}'" if detallado else "Libro no disponible"
+        }
+        
+        if libro['ejemplares_disponibles'] <= 0:
+            return sin_ejemplares, None
+        
+        # Actualizar disponibilidad (condicional: otro worker pudo tomar el ultimo ejemplar)
+        cursor.execute(
+            "UPDATE libros SET ejemplares_disponibles = ejemplares_disponibles - 1 "
+            "WHERE codigo = ? AND ejemplares_disponibles > 0",
+            (codigo,)
+        )
+        
+        if cursor.rowcount == 0:
+            return sin_ejemplares, None
+        
+        # Crear pr�stamo
+        fecha_prestamo = datetime.now().strftime("%Y-%m-%d")
+        fecha_devolucion = (datetime.now() + timedelta(weeks=2)).strftime("%Y-%m-%d")
+        
+        cursor.execute(
+            "INSERT INTO prestamos (codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones) VALUES (?, ?, ?, ?, ?)",
+            (codigo, usuario, fecha_prestamo, fecha_devolucion, 0)
+        )
+        
+        cambio = {
+            "tipo": "prestamo",
+            "codigo": codigo,
+            "usuario": usuario,
+            "fecha_prestamo": fecha_prestamo,
+            "fecha_devolucion": fecha_devolucion
+        }
+        
+        if self.cache:
+            # Estado del libro dentro de la transaccion, para la cache (no se replica)
             cursor.execute("SELECT * FROM libros WHERE codigo = ?", (codigo,))
-            libro = cursor.fetchone()
-            
-            if not libro or libro['ejemplares_disponibles'] <= 0:
-                conn.close()
-                return {
-                    "exito": False,
-                    "mensaje": "Libro no disponible"
-                }
-            
-            # Actualizar disponibilidad
-            cursor.execute(
-                "UPDATE libros SET ejemplares_disponibles = ejemplares_disponibles - 1 WHERE codigo = ?",
-                (codigo,)
-            )
-            
-            # Crear pr�stamo
-            fecha_prestamo = datetime.now().strftime("%Y-%m-%d")
-            fecha_devolucion = (datetime.now() + timedelta(weeks=2)).strftime("%Y-%m-%d")
-            
-            cursor.execute(
-                "INSERT INTO prestamos (codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones) VALUES (?, ?, ?, ?, ?)",
-                (codigo, usuario, fecha_prestamo, fecha_devolucion, 0)
-            )
-            
-            conn.commit()
-            conn.close()
-            
-            # Replicar
-            self.replicar_operacion({
-                "tipo": "prestamo",
-                "codigo": codigo,
-                "usuario": usuario,
-                "fecha_prestamo": fecha_prestamo,
-                "fecha_devolucion": fecha_devolucion
-            })
-            
+            cambio["libro"] = dict(cursor.fetchone())
+        
+        return {
+            "exito": True,
+            "mensaje": f"Prestamo otorgado de '{libro['titulo']}'",
+            "fecha_devolucion": fecha_devolucion
+        }, cambio
+    
+    def aplicar_devolucion(self, cursor, codigo, usuario):
+        """Aplica una devolucion en la transaccion abierta, sin commit. Devuelve (respuesta, cambio)"""
+        # Eliminar pr�stamo (si otro worker ya registro la devolucion no borra nada)
+        cursor.execute(
+            "DELETE FROM prestamos WHERE codigo = ? AND usuario = ?",
+            (codigo, usuario)
+        )
+        
+        if cursor.rowcount == 0:
             return {
-                "exito": True,
-                "mensaje": f"Prestamo otorgado de '{libro['titulo']}'",
-                "fecha_devolucion": fecha_devolucion
-            }
+                "exito": False,
+                "mensaje": f"No se encontro prestamo activo para {usuario} del libro {codigo}"
+            }, None
         
-        except Exception as e:
-            conn.rollback()
-            conn.close()
+        # Aumentar disponibilidad
+        cursor.execute(
+            "UPDATE libros SET ejemplares_disponibles = ejemplares_disponibles + 1 WHERE codigo = ?",
+            (codigo,)
+        )
+        
+        # Obtener t�tulo del libro
+        cursor.execute("SELECT * FROM libros WHERE codigo = ?", (codigo,))
+        libro = cursor.fetchone()
+        
+        cambio = {
+            "tipo": "devolucion",
+            "codigo": codigo,
+            "usuario": usuario
+        }
+        
+        if self.cache:
+            cambio["libro"] = dict(libro)
+        
+        return {
+            "exito": True,
+            "mensaje": f"Devolucion de '{libro['titulo']}' registrada. Ejemplares disponibles: {libro['ejemplares_disponibles']}"
+        }, cambio
+    
+    def aplicar_renovacion(self, cursor, codigo, usuario):
+        """Aplica una renovacion en la transaccion abierta, sin commit. Devuelve (respuesta, cambio)"""
+        # Buscar pr�stamo
+        cursor.execute(
+            "SELECT renovaciones, fecha_devolucion FROM prestamos WHERE codigo = ? AND usuario = ?",
+            (codigo, usuario)
+        )
+        prestamo = cursor.fetchone()
+        
+        if not prestamo:
             return {
                 "exito": False,
-                "mensaje": f"Error realizando pr�stamo: {str(e)}"
-            }
+                "mensaje": f"No se encontr� pr�stamo activo para {usuario} del libro {codigo}"
+            }, None
+        
+        if prestamo['renovaciones'] >= 2:
+            return {
+                "exito": False,
+                "mensaje": "Ya se realizaron las 2 renovaciones m�ximas permitidas"
+            }, None
+        
+        # Actualizar fechas
+        fecha_actual = datetime.strptime(prestamo['fecha_devolucion'], "%Y-%m-%d")
+        nueva_fecha = fecha_actual + timedelta(weeks=1)
+        nueva_fecha_str = nueva_fecha.strftime("%Y-%m-%d")
+        nuevas_renovaciones = prestamo['renovaciones'] + 1
+        
+        # Condicional sobre las renovaciones leidas para no renovar dos veces en paralelo
+        cursor.execute(
+            "UPDATE prestamos SET fecha_devolucion = ?, renovaciones = ? "
+            "WHERE codigo = ? AND usuario = ? AND renovaciones = ?",
+            (nueva_fecha_str, nuevas_renovaciones, codigo, usuario, prestamo['renovaciones'])
+        )
+        
+        if cursor.rowcount == 0:
+            return {
+                "exito": False,
+                "mensaje": "El prestamo fue modificado por otra solicitud, intente de nuevo"
+            }, None
+        
+        # Obtener t�tulo
+        cursor.execute("SELECT titulo FROM libros WHERE codigo = ?", (codigo,))
+        libro = cursor.fetchone()
+        
+        return {
+            "exito": True,
+            "mensaje": f"Renovaci�n {nuevas_renovaciones}/2 de '{libro['titulo']}' realizada",
+            "nueva_fecha": nueva_fecha_str
+        }, {
+            "tipo": "renovacion",
+            "codigo": codigo,
+            "usuario": usuario,
+            "nueva_fecha": nueva_fecha_str,
+            "renovaciones": nuevas_renovaciones
+        }
     
-    def realizar_devolucion(self, codigo, usuario):
-        """Procesa la devolucion de un libro"""
+    def aplicar_escritura(self, cursor, operacion, codigo, usuario, traza=None, id_operacion=None):
+        """
+        Despacha una escritura al metodo aplicar_* correspondiente y la registra en el log de replicacion
+        
+        El contexto de traza viaja con el cambio hasta la replica (no se guarda en el log).
+        Con id_operacion, una operacion ya aplicada devuelve la respuesta de entonces sin
+        aplicarse otra vez (la cola del GC puede entregar la misma devolucion dos veces, y
+        un PS repite con la misma clave de idempotencia el prestamo que no le respondieron).
+        Si la operacion guardada con ese id es otra (operacion, codigo o usuario distintos)
+        se rechaza sin aplicarse
+        """
+        if id_operacion:
+            cursor.execute("SELECT respuesta, operacion, codigo, usuario FROM operaciones_aplicadas "
+                           "WHERE id_operacion = ?", (id_operacion,))
+            aplicada = cursor.fetchone()
+            if aplicada:
+                huella = aplicada[1:]
+                if huella[0] is not None and huella != huella_operacion(operacion, codigo, usuario):
+                    return {
+                        "exito": False,
+                        "mensaje": "El id de operacion ya se uso con otra operacion"
+                    }, None
+                return {**json.loads(aplicada[0]), "duplicada": True}, None
+        
+        aplicadores = {
+            "prestamo": self.aplicar_prestamo,
+            "prestamo_condicional": lambda cursor, codigo, usuario: self.aplicar_prestamo(
+                cursor, codigo, usuario, detallado=True),
+            "devolucion": self.aplicar_devolucion,
+            "renovacion": self.aplicar_renovacion
+        }
+        respuesta, cambio = aplicadores[operacion](cursor, codigo, usuario)
+        if cambio:
+            self.registrar_cambio(cursor, cambio)
+            if id_operacion:
+                self.registrar_operacion(cursor, id_operacion, respuesta,
+                                         huella_operacion(operacion, codigo, usuario))
+            if traza:
+                cambio["traza"] = traza
+        return respuesta, cambio
+    
+    def registrar_operacion(self, cursor, id_operacion, respuesta, huella):
+        """Recuerda una operacion aplicada, en su misma transaccion; de vez en cuando olvida las viejas"""
+        ahora = time.time()
+        cursor.execute("INSERT INTO operaciones_aplicadas (id_operacion, respuesta, fecha, operacion, codigo, usuario) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", (id_operacion, json.dumps(respuesta), ahora, *huella))
+        self.operaciones_registradas += 1
+        if self.operaciones_registradas % DEPURAR_OPERACIONES_CADA == 0:
+            cursor.execute("DELETE FROM operaciones_aplicadas WHERE fecha < ?", (ahora - RETENCION_OPERACIONES_S,))
+    
+    def confirmar_cambios(self, cambios):
+        """Se ejecuta despues del COMMIT con los cambios que quedaron confirmados"""
+        for cambio in cambios:
+            libro = cambio.pop("libro", None)
+            if libro and self.cache:
+                self.cache.actualizar(libro, cambio["secuencia"])
+        self.merkle.invalidar(cambio["codigo"] for cambio in cambios)
+        self.replicar_operaciones(cambios)
+    
+    def ejecutar_escritura(self, operacion, codigo, usuario, mensaje_error, traza=None, id_operacion=None):
+        """Ejecuta una escritura en su propia transaccion o a traves del group commit"""
+        if self.commit_agrupado:
+            return self.commit_agrupado.enviar(operacion, codigo, usuario, mensaje_error, traza, id_operacion)
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
-            # Buscar pr�stamo
-            cursor.execute(
-                "SELECT * FROM prestamos WHERE codigo = ? AND usuario = ?",
-                (codigo, usuario)
-            )
-            prestamo = cursor.fetchone()
-            
-            if not prestamo:
-                conn.close()
-                return {
-                    "exito": False,
-                    "mensaje": f"No se encontro prestamo activo para {usuario} del libro {codigo}"
-                }
-            
-            # Eliminar pr�stamo
-            cursor.execute(
-                "DELETE FROM prestamos WHERE codigo = ? AND usuario = ?",
-                (codigo, usuario)
-            )
-            
-            # Aumentar disponibilidad
-            cursor.execute(
-                "UPDATE libros SET ejemplares_disponibles = ejemplares_disponibles + 1 WHERE codigo = ?",
-                (codigo,)
-            )
-            
-            # Obtener t�tulo del libro
-            cursor.execute("SELECT titulo, ejemplares_disponibles FROM libros WHERE codigo = ?", (codigo,))
-            libro = cursor.fetchone()
-            
-            conn.commit()
-            conn.close()
-            
-            # Replicar
-            self.replicar_operacion({
-                "tipo": "devolucion",
-                "codigo": codigo,
-                "usuario": usuario
-            })
-            
-            return {
-                "exito": True,
-                "mensaje": f"Devolucion de '{libro['titulo']}' registrada. Ejemplares disponibles: {libro['ejemplares_disponibles']}"
-            }
-        
+            # La transaccion de escritura empieza antes de leer operaciones_aplicadas y el libro:
+            # dos solicitudes con el mismo id_operacion no pueden ver las dos que falta aplicarla
+            cursor.execute("BEGIN IMMEDIATE")
+            respuesta, cambio = self.aplicar_escritura(cursor, operacion, codigo, usuario, traza, id_operacion)
+            if cambio:
+                conn.commit()
+            else:
+                conn.rollback()
         except Exception as e:
             conn.rollback()
-            conn.close()
-            return {
+            respuesta, cambio = {
                 "exito": False,
-                "mensaje": f"Error en devoluci�n: {str(e)}"
-            }
+                "mensaje": f"{mensaje_error}: {str(e)}"
+            }, None
+        finally:
+            self.liberar_connection(conn)
+        
+        # Actualizar cache y replicar
+        if cambio:
+            self.confirmar_cambios([cambio])
+        
+        return respuesta
+    
+    def realizar_prestamo(self, codigo, usuario, traza=None, id_operacion=None):
+        """Realiza un prestamo de libro"""
+        return self.ejecutar_escritura("prestamo", codigo, usuario, "Error realizando pr�stamo", traza, id_operacion)
+    
+    def realizar_prestamo_condicional(self, codigo, usuario, traza=None, id_operacion=None):
+        """Verifica disponibilidad y presta en una sola operacion atomica, con mensajes detallados"""
+        return self.ejecutar_escritura("prestamo_condicional", codigo, usuario, "Error realizando pr�stamo", traza,
+                                       id_operacion)
+    
+    def realizar_devolucion(self, codigo, usuario, traza=None, id_operacion=None):
+        """Procesa la devolucion de un libro"""
+        return self.ejecutar_escritura("devolucion", codigo, usuario, "Error en devoluci�n", traza, id_operacion)
     
-    def realizar_renovacion(self, codigo, usuario):
+    def realizar_renovacion(self, codigo, usuario, traza=None, id_operacion=None):
         """Procesa la renovaci�n de un pr�stamo"""
+        return self.ejecutar_escritura("renovacion", codigo, usuario, "Error en renovaci�n", traza, id_operacion)
+    
+    def procesar_lote(self, solicitud):
+        """
+        Ejecuta una lista ordenada de operaciones en una sola transaccion
+        
+        Modos:
+            transaccional: todo o nada; si una escritura falla se revierte el lote completo
+            independiente: cada operacion en su SAVEPOINT; las que fallan no afectan a las demas
+        """
+        modo = solicitud.get("modo", "independiente")
+        operaciones = solicitud.get("operaciones", [])
+        
+        if modo not in ("transaccional", "independiente"):
+            return {"exito": False, "mensaje": f"Modo de lote desconocido: {modo}"}
+        
+        resultados = []
+        cambios = []
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
-            # Buscar pr�stamo
-            cursor.execute(
-                "SELECT * FROM prestamos WHERE codigo = ? AND usuario = ?",
-                (codigo, usuario)
-            )
-            prestamo = cursor.fetchone()
+            cursor.execute("BEGIN IMMEDIATE")
             
-            if not prestamo:
-                conn.close()
-                return {
-                    "exito": False,
-                    "mensaje": f"No se encontr� pr�stamo activo para {usuario} del libro {codigo}"
-                }
-            
-            if prestamo['renovaciones'] >= 2:
-                conn.close()
-                return {
-                    "exito": False,
-                    "mensaje": "Ya se realizaron las 2 renovaciones m�ximas permitidas"
-                }
-            
-            # Actualizar fechas
-            fecha_actual = datetime.strptime(prestamo['fecha_devolucion'], "%Y-%m-%d")
-            nueva_fecha = fecha_actual + timedelta(weeks=1)
-            nueva_fecha_str = nueva_fecha.strftime("%Y-%m-%d")
-            nuevas_renovaciones = prestamo['renovaciones'] + 1
-            
-            cursor.execute(
-                "UPDATE prestamos SET fecha_devolucion = ?, renovaciones = ? WHERE codigo = ? AND usuario = ?",
-                (nueva_fecha_str, nuevas_renovaciones, codigo, usuario)
-            )
-            
-            # Obtener t�tulo
-            cursor.execute("SELECT titulo FROM libros WHERE codigo = ?", (codigo,))
-            libro = cursor.fetchone()
+            for indice, op in enumerate(operaciones):
+                if modo == "independiente":
+                    cursor.execute("SAVEPOINT operacion_lote")
+                
+                try:
+                    respuesta, cambio = self.aplicar_en_lote(cursor, op)
+                except Exception as e:
+                    respuesta, cambio = {"exito": False, "mensaje": f"Error: {str(e)}"}, None
+                
+                fallo = "exito" in respuesta and not respuesta["exito"]
+                resultados.append(respuesta)
+                
+                if modo == "transaccional" and fallo:
+                    conn.rollback()
+                    return {
+                        "exito": False,
+                        "modo": modo,
+                        "mensaje": f"Lote revertido: fallo la operacion {indice}",
+                        "resultados": resultados
+                    }
+                
+                if modo == "independiente":
+                    if fallo:
+                        cursor.execute("ROLLBACK TO operacion_lote")
+                    cursor.execute("RELEASE operacion_lote")
+                
+                if cambio:
+                    cambios.append(cambio)
             
             conn.commit()
-            conn.close()
-            
-            # Replicar
-            self.replicar_operacion({
-                "tipo": "renovacion",
-                "codigo": codigo,
-                "usuario": usuario,
-                "nueva_fecha": nueva_fecha_str,
-                "renovaciones": nuevas_renovaciones
-            })
-            
-            return {
-                "exito": True,
-                "mensaje": f"Renovaci�n {nuevas_renovaciones}/2 de '{libro['titulo']}' realizada",
-                "nueva_fecha": nueva_fecha_str
-            }
-        
         except Exception as e:
             conn.rollback()
-            conn.close()
             return {
                 "exito": False,
-                "mensaje": f"Error en renovaci�n: {str(e)}"
+                "modo": modo,
+                "mensaje": f"Error ejecutando lote: {str(e)}",
+                "resultados": resultados
             }
+        finally:
+            self.liberar_connection(conn)
+        
+        if cambios:
+            self.confirmar_cambios(cambios)
+        
+        return {
+            "exito": True,
+            "modo": modo,
+            "mensaje": f"Lote de {len(operaciones)} operaciones confirmado",
+            "resultados": resultados
+        }
+    
+    def aplicar_en_lote(self, cursor, op):
+        """Aplica una operacion de un lote sobre el cursor de la transaccion del lote"""
+        operacion = op.get("operacion")
+        
+        if operacion in ("prestamo", "prestamo_condicional", "devolucion", "renovacion"):
+            return self.aplicar_escritura(cursor, operacion, op["codigo"], op["usuario"])
+        
+        if operacion == "verificar_disponibilidad":
+            # Lee dentro de la transaccion: ve las escrituras previas del mismo lote
+            cursor.execute("SELECT * FROM libros WHERE codigo = ?", (op["codigo"],))
+            return self.respuesta_disponibilidad(op["codigo"], cursor.fetchone()), None
+        
+        return {
+            "exito": False,
+            "mensaje": f"Operación no permitida en lote: {operacion}"
+        }, None
+    
+    def es_propio(self, codigo):
+        """Si el codigo pertenece a la particion de este GA (siempre, sin particiones)"""
+        return not self.particion or self.mapa.particion(codigo) == self.particion
+    
+    def rechazo_particion(self, codigo):
+        dueno = self.mapa.particion(codigo)
+        return {
+            "exito": False,
+            "mensaje": f"El libro {codigo} pertenece a la particion {dueno}",
+            "particion_correcta": dueno,
+            "version_mapa": self.mapa.version
+        }
     
     def procesar_solicitud(self, solicitud):
         """Procesa solicitudes de Actores/GC"""
         operacion = solicitud.get("operacion")
         
+        # Con el catalogo particionado solo se atienden los codigos propios
+        if self.particion:
+            codigos = [op.get("codigo") for op in solicitud.get("operaciones", [])] \
+                if operacion == "lote" else [solicitud.get("codigo")]
+            for codigo in codigos:
+                if codigo is not None and not self.es_propio(codigo):
+                    return self.rechazo_particion(codigo)
+        
         # Health Check
         if operacion == "health_check":
             return {"status": "ok", "sede": self.sede}
         
+        elif operacion == "negociar_formato":
+            return codec.respuesta_negociacion(solicitud)
+        
+        elif operacion == "estadisticas_cache":
+            if not self.cache:
+                return {"exito": False, "mensaje": "Cache de disponibilidad desactivada"}
+            return {"exito": True, "cache": self.cache.estadisticas()}
+        
         elif operacion == "verificar_disponibilidad":
             return self.verificar_disponibilidad(solicitud["codigo"])
         
+        elif operacion == "filtro_libros":
+            return self.enviar_filtro_libros(solicitud.get("version"), solicitud.get("tasa_falsos", TASA_FALSOS))
+        
         elif operacion == "prestamo":
-            return self.realizar_prestamo(solicitud["codigo"], solicitud["usuario"])
+            return self.realizar_prestamo(solicitud["codigo"], solicitud["usuario"], solicitud.get(trazas.CAMPO_TRAZA),
+                                          solicitud.get("id_operacion"))
+        
+        elif operacion == "prestamo_condicional":
+            return self.realizar_prestamo_condicional(solicitud["codigo"], solicitud["usuario"], solicitud.get(trazas.CAMPO_TRAZA),
+                                                      solicitud.get("id_operacion"))
         
         elif operacion == "devolucion":
-            return self.realizar_devolucion(solicitud["codigo"], solicitud["usuario"])
+            return self.realizar_devolucion(solicitud["codigo"], solicitud["usuario"], solicitud.get(trazas.CAMPO_TRAZA),
+                                            solicitud.get("id_operacion"))
         
         elif operacion == "renovacion":
-            return self.realizar_renovacion(solicitud["codigo"], solicitud["usuario"])
+            return self.realizar_renovacion(solicitud["codigo"], solicitud["usuario"], solicitud.get(trazas.CAMPO_TRAZA),
+                                            solicitud.get("id_operacion"))
+        
+        elif operacion == "lote":
+            return self.procesar_lote(solicitud)
+        
+        elif operacion == "replicacion_pendiente":
+            return self.operaciones_pendientes(solicitud.get("desde", 0), solicitud.get("limite", 500))
+        
+        elif operacion == "ack_replicacion":
+            return self.confirmar_replicacion(solicitud["secuencia"])
+        
+        elif operacion == "estado_replicacion":
+            return self.estado_replicacion()
+        
+        elif operacion == "antientropia_raiz":
+            return self.antientropia_raiz()
+        
+        elif operacion == "antientropia_limites":
+            return {"exito": True, "mensaje": "Limites de buckets", "limites": self.merkle.limites,
+                    "digest_limites": self.merkle.digest}
+        
+        elif operacion == "antientropia_nodos":
+            return self.antientropia_nodos(solicitud["version"], solicitud["nivel"], solicitud["indices"])
+        
+        elif operacion == "antientropia_bucket":
+            return self.antientropia_bucket(solicitud["indice"], solicitud["digest_limites"])
+        
+        elif operacion == "snapshot_inicio":
+            return self.snapshots.iniciar()
+        
+        elif operacion == "snapshot_estado":
+            return self.snapshots.estado(solicitud["id"])
+        
+        elif operacion == "snapshot_bloque":
+            respuesta, datos = self.snapshots.bloque(solicitud["id"], solicitud["indice"])
+            if datos is not None:
+                respuesta["datos"] = datos
+            return respuesta
+        
+        elif operacion == "snapshot_fin":
+            return self.snapshots.finalizar(solicitud["id"])
         
         else:
             return {
@@ -387,47 +998,136 @@ class GestorAlmacenamiento:
                 "mensaje": f"Operaci�n desconocida: {operacion}"
             }
     
-    def ejecutar(self):
-        """Loop principal del GA"""
-        print("= Gestor de Almacenamiento listo para recibir solicitudes...\n")
-        
+    def atender(self, socket, nombre=""):
+        """Atiende solicitudes en un socket REP hasta que se interrumpa"""
         while True:
+            formato = codec.FORMATO_JSON
             try:
-                # Recibir solicitud
-                mensaje = self.socket_rep.recv_string()
-                solicitud = json.loads(mensaje)
-                
-                print(f"= Solicitud recibida: {solicitud['operacion']}")
+                # Recibir solicitud (se responde en el mismo formato en que llega)
+                mensaje = socket.recv()
+                if self.perfilador.activo:
+                    self.perfilador.revisar()
+                recibido = time.time()
+                inicio = time.perf_counter()
+                solicitud, formato = codec.decodificar(mensaje)
                 
-                # Procesar
-                respuesta = self.procesar_solicitud(solicitud)
+                log_solicitudes.debug("= %sSolicitud recibida: %s", nombre, solicitud.get("operacion"))
                 
-                # Responder
-                self.socket_rep.send_string(json.dumps(respuesta))
+                with self.trazas.span(solicitud.get("operacion"), solicitud, codigo=solicitud.get("codigo")) as span:
+                    # Procesar (las escrituras llevan este span como padre hasta la replica)
+                    respuesta = self.procesar_solicitud(span.propagar(solicitud))
+                    
+                    # Responder (los bloques de snapshot y el filtro de libros viajan sin codificar en un segundo frame)
+                    datos = respuesta.pop("datos", None)
+                    if datos is not None:
+                        socket.send_multipart([codec.codificar(respuesta, formato), datos])
+                    else:
+                        socket.send(codec.codificar(respuesta, formato))
+                    span.resultado = metricas.resultado(respuesta)
+                self.metricas.registrar(solicitud.get("operacion"), metricas.resultado(respuesta),
+                                        time.perf_counter() - inicio, metricas.espera(solicitud, recibido))
                 
-                if respuesta.get("exito", False) or respuesta.get("disponible", False) or respuesta.get("status") == "ok":
-                    print(f" {respuesta.get('mensaje', 'OK')}\n")
-                else:
-                    print(f"L {respuesta.get('mensaje', 'Error')}\n")
+                if log_solicitudes.isEnabledFor(logging.DEBUG):
+                    if respuesta.get("exito", False) or respuesta.get("disponible", False) or respuesta.get("status") == "ok":
+                        log_solicitudes.debug(" %s", respuesta.get("mensaje", "OK"))
+                    else:
+                        log_solicitudes.debug("L %s", respuesta.get("mensaje", "Error"))
                 
-            except KeyboardInterrupt:
-                print("\n=� Deteniendo Gestor de Almacenamiento...")
+            except zmq.error.ContextTerminated:
                 break
             except Exception as e:
-                print(f"L Error: {e}\n")
+                log.exception(f"L Error: {e}")
+                self.metricas.incrementar("errores")
                 respuesta = {"exito": False, "mensaje": str(e)}
                 try:
-                    self.socket_rep.send_string(json.dumps(respuesta))
+                    socket.send(codec.codificar(respuesta, formato))
                 except:
                     pass
+    
+    def worker(self, numero):
+        """Worker: socket REP conectado al backend del broker, con su propia conexion SQLite"""
+        socket = self.context.socket(zmq.REP)
+        socket.connect("inproc://ga_workers")
+        try:
+            self.atender(socket, nombre=f"[worker {numero}] ")
+        finally:
+            socket.close(linger=0)
+    
+    def ejecutar(self):
+        """Loop principal del GA"""
+        log.info("= Gestor de Almacenamiento listo para recibir solicitudes...")
+        
+        try:
+            if not self.workers:
+                self.atender(self.socket_rep)
+                return
+            
+            for numero in range(1, self.workers + 1):
+                hilo = threading.Thread(target=self.worker, args=(numero,), daemon=True)
+                hilo.start()
+            
+            # El proxy reparte las solicitudes entre los workers y devuelve las respuestas
+            zmq.proxy(self.socket_frontend, self.socket_backend)
+        except KeyboardInterrupt:
+            log.info("=� Deteniendo Gestor de Almacenamiento...")
+        finally:
+            self.conexiones.cerrar()
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Uso: python gestor_almacenamiento.py <sede>")
-        print("Ejemplo: python gestor_almacenamiento.py 1")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Gestor de Almacenamiento",
+        epilog="Ejemplo: python gestor_almacenamiento.py 1 --conexion persistente"
+    )
+    parser.add_argument("sede", type=int, help="numero de sede (1 o 2)")
+    parser.add_argument("--conexion", choices=[MODO_EFIMERA, MODO_PERSISTENTE], default=None,
+                        help="efimera: una conexion por operacion; persistente: conexion larga con WAL "
+                             "(por defecto efimera, o persistente si se usan workers)")
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL", "EXTRA"],
+                        help="PRAGMA synchronous en modo persistente")
+    parser.add_argument("--cache-size", type=int, default=-16000,
+                        help="PRAGMA cache_size en modo persistente (negativo = KiB)")
+    parser.add_argument("--mmap-size", type=int, default=268435456,
+                        help="PRAGMA mmap_size en bytes en modo persistente")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="numero de hilos worker detras de un broker ROUTER/DEALER (0 = REP unico)")
+    parser.add_argument("--group-commit", action="store_true",
+                        help="agrupar escrituras concurrentes en una sola transaccion (util con --workers)")
+    parser.add_argument("--ventana-ms", type=float, default=2.0,
+                        help="espera maxima en ms para completar un lote del group commit")
+    parser.add_argument("--max-lote", type=int, default=64,
+                        help="escrituras maximas por transaccion del group commit")
+    parser.add_argument("--cache-libros", type=int, default=0,
+                        help="capacidad de la cache LRU de disponibilidad en libros (0 = sin cache)")
+    parser.add_argument("--formato", choices=codec.FORMATOS, default=codec.FORMATO_JSON,
+                        help="formato de los mensajes de replicacion (las respuestas usan el formato de cada solicitud)")
+    parser.add_argument("--replica-ventana-ms", type=float, default=2.0,
+                        help="espera maxima en ms para completar un lote de replicacion")
+    parser.add_argument("--replica-max-lote", type=int, default=256,
+                        help="operaciones maximas por mensaje de replicacion")
+    parser.add_argument("--max-log-replicacion", type=int, default=MAX_LOG_REPLICACION,
+                        help="operaciones que conserva el log de replicacion sin confirmar (0 = sin limite)")
+    parser.add_argument("--libros-iniciales", type=int, default=1000,
+                        help="libros del catalogo sintetico al crear una BD vacia")
+    parser.add_argument("--prestamos-iniciales", type=int, default=None,
+                        help="prestamos sinteticos al crear una BD vacia (por defecto 50 en sede 1, 150 en sede 2)")
+    parser.add_argument("--mapa", default=None,
+                        help="archivo JSON del mapa de particiones del catalogo")
+    parser.add_argument("--particion", default=None,
+                        help="particion que atiende este GA (puerto, BD y replica salen del mapa)")
+    registro.agregar_argumentos(parser)
+    control.agregar_argumentos(parser)
+    trazas.agregar_argumentos(parser)
+    args = parser.parse_args()
     
-    sede = int(sys.argv[1])
+    requiere_wal = args.workers or args.group_commit
+    if args.conexion is None:
+        args.conexion = MODO_PERSISTENTE if requiere_wal else MODO_EFIMERA
+    elif requiere_wal and args.conexion == MODO_EFIMERA:
+        parser.error("--workers y --group-commit requieren --conexion persistente")
+    
+    sede = args.sede
+    proceso = f"ga_sede{sede}" + (f"_{args.particion}" if args.particion else "")
+    registro.configurar_desde_args(proceso, args)
     
     # Configuración por sede
     if sede == 1:
@@ -439,11 +1139,50 @@ if __name__ == "__main__":
         replica_ip = "10.43.103.177"  # IP de Comp 1
         replica_port = "5559"  # Puerto PULL en Comp 1 (donde Sede 2 envía)
     
+    mapa = None
+    db_file = f"bd_sede{sede}.db"
+    if args.particion:
+        if not args.mapa:
+            parser.error("--particion requiere --mapa")
+        mapa = MapaParticiones.cargar(args.mapa)
+        if args.particion not in mapa.particiones:
+            parser.error(f"la particion {args.particion} no esta en {args.mapa}")
+        puerto_rep = puerto(mapa.ga(args.particion))
+        replica_ip = replica_port = None
+        if mapa.replica(args.particion):
+            replica_ip, replica_port = host(mapa.replica(args.particion)), puerto(mapa.replica(args.particion))
+        db_file = mapa.db_file(sede, args.particion)
+    
+    conexiones = GestorConexiones(
+        db_file,
+        modo=args.conexion,
+        synchronous=args.synchronous,
+        cache_size=args.cache_size,
+        mmap_size=args.mmap_size
+    )
+    
     ga = GestorAlmacenamiento(
         sede=sede,
         puerto_rep=puerto_rep,
         replica_ip=replica_ip,
-        replica_port=replica_port
+        replica_port=replica_port,
+        conexiones=conexiones,
+        workers=args.workers,
+        group_commit=args.group_commit,
+        ventana_ms=args.ventana_ms,
+        max_lote=args.max_lote,
+        cache_libros=args.cache_libros,
+        formato=args.formato,
+        replica_ventana_ms=args.replica_ventana_ms,
+        replica_max_lote=args.replica_max_lote,
+        max_log_replicacion=args.max_log_replicacion,
+        libros_iniciales=args.libros_iniciales,
+        prestamos_iniciales=args.prestamos_iniciales,
+        mapa=mapa,
+        particion=args.particion,
+        puerto_control=args.puerto_control,
+        dir_perfiles=args.perfiles_dir,
+        trazador=trazas.desde_args(proceso, args)
     )
     
     ga.ejecutar()
\ No newline at end of file
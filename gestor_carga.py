@@ -1,45 +1,250 @@
 import zmq
-import json
+import sys
 import time
+import argparse
+import itertools
+import logging
+from collections import deque
 from datetime import datetime, timedelta
 
+import codec
+import admision
+from admision import ControlAdmision
+from cola_trabajos import ColaTrabajos
+from idempotencia import CacheIdempotencia
+from filtro_libros import FiltroCatalogo, TASA_FALSOS, VIGENCIA_S
+from particiones import MapaParticiones
+import registro
+import metricas
+import control
+import trazas
+from metricas import Metricas
+from control import ServidorControl
+from perfilador import Perfilador
+
+log = registro.obtener("gc")
+log_solicitudes = registro.solicitudes("gc")
+
+REVISION_MS = 100
+OPERACIONES_LIBRO = ("prestamo", "devolucion", "renovacion")
+
+
+class PrestamoPendiente:
+    """Préstamo recibido de un PS que espera un Actor Préstamo libre o su respuesta"""
+    
+    def __init__(self, sobre, formato, solicitud, usuario, libro, span, recibido, inicio, limite, clave=None):
+        """
+        Args:
+            sobre: frames de identidad del PS en el ROUTER (se antepone a la respuesta)
+            formato: formato en que llegó la solicitud (y en que se responde)
+            solicitud: mensaje del PS (para la espera desde su envío)
+            span: span de la solicitud, abierto hasta que se responde
+            recibido: time.time() de la recepción
+            inicio: time.perf_counter() de la recepción
+            limite: time.perf_counter() en que se responde error si el actor no contestó
+            clave: clave_idempotencia; las repetidas que llegan mientras tanto se
+                   responden junto con este préstamo
+        """
+        self.sobre = sobre
+        self.formato = formato
+        self.solicitud = solicitud
+        self.usuario = usuario
+        self.libro = libro
+        self.span = span
+        self.recibido = recibido
+        self.inicio = inicio
+        self.limite = limite
+        self.clave = clave
+        self.repetidas = []             # (sobre, formato, inicio) de las repetidas con la misma clave
+        self.llamada = trazas.SPAN_INACTIVO
+        self.enviado = None
+        self.actor = None
+
+
+class ActorRegistrado:
+    """Actor conectado a un ROUTER del GC: un Actor Préstamo o un actor de la cola de trabajos"""
+    
+    def __init__(self, identidad, capacidad, formato, latido_s, canal=None):
+        self.identidad = identidad
+        self.canal = canal
+        self.capacidad = capacidad
+        self.formato = formato
+        self.latido_s = latido_s
+        self.en_curso = 0
+        self.atendidos = 0
+        self.visto = time.monotonic()
+        self.ultimo_envio = 0.0
+    
+    def estado(self):
+        estado = {
+            "actor": self.identidad.hex(),
+            "capacidad": self.capacidad,
+            "en_curso": self.en_curso,
+            "atendidos": self.atendidos,
+            "visto_hace_s": round(time.monotonic() - self.visto, 1)
+        }
+        if self.canal:
+            estado["canal"] = self.canal
+        return estado
+
+
 class GestorCarga:
-    def __init__(self, sede, puerto_rep="5555", puerto_pub="5556", puerto_prestamo="5570"):
+    def __init__(self, sede, puerto_rep="5555", puerto_trabajos="5556", puerto_prestamo="5570",
+                 formato=codec.FORMATO_JSON, mapa=None, timeout_prestamo_ms=5000, max_en_curso=None,
+                 tasa_ps=0, rafaga_ps=None, reintentar_ms=100, archivo_cola=None, timeout_trabajo_ms=10000,
+                 claves_idempotencia=50000, ttl_idempotencia_s=120.0, filtro_libros=None,
+                 refresco_filtro_s=60.0, tasa_falsos_filtro=TASA_FALSOS, vigencia_filtro_s=VIGENCIA_S,
+                 puerto_control=None, dir_perfiles="perfiles", trazador=None):
         """
         Gestor de Carga - Coordina las operaciones del sistema
         
         Args:
             sede: número de sede (1 o 2)
-            puerto_rep: puerto para recibir solicitudes de PS (REP)
-            puerto_pub: puerto para publicar mensajes a Actores (PUB)
-            puerto_prestamo: puerto para comunicación síncrona con Actor Préstamo (REQ)
+            puerto_rep: puerto para recibir solicitudes de PS (ROUTER; los PS usan REQ)
+            puerto_trabajos: puerto ROUTER de la cola de devoluciones y renovaciones, donde
+                             se registran sus actores (DEALER)
+            puerto_prestamo: puerto ROUTER donde se registran los Actores Préstamo (DEALER)
+            formato: formato hacia los actores: se usa con cada actor que lo acepte
+            mapa: MapaParticiones; los trabajos van al canal "tipo.particion" del
+                  libro, así cada partición puede tener sus propios actores
+            timeout_prestamo_ms: espera máxima de un préstamo desde que llega hasta que
+                                 responde un actor; al vencer se responde error al PS
+            max_en_curso: operación -> máximo aceptadas sin responder; las que exceden el
+                          límite se responden "ocupado" (None = sin límite)
+            tasa_ps: solicitudes por segundo aceptadas de cada PS (0 = sin límite)
+            rafaga_ps: solicitudes seguidas que se aceptan de un PS (None = un segundo de tasa)
+            reintentar_ms: espera sugerida al PS en las respuestas "ocupado" por límite en curso
+            archivo_cola: archivo SQLite de la cola de trabajos (None = gc_sede<N>_cola.db)
+            timeout_trabajo_ms: espera máxima por la confirmación de un trabajo entregado;
+                                al vencer se entrega de nuevo, a otro actor si hay
+            claves_idempotencia: respuestas guardadas por clave_idempotencia para
+                                 responder las solicitudes repetidas (0 = no se guardan)
+            ttl_idempotencia_s: segundos que se guarda la respuesta de una clave
+            filtro_libros: particion -> endpoint del GA de donde se carga el filtro de
+                           códigos existentes ({None: endpoint} sin mapa; None = sin filtro)
+            refresco_filtro_s: cada cuánto se pregunta a los GA si cambió el catálogo
+            tasa_falsos_filtro: tasa de falsos positivos del filtro (los falsos siguen al GA)
+            vigencia_filtro_s: segundos desde la última confirmación del GA durante los que
+                               se rechaza un libro que no está en el filtro (después sigue al GA)
+            puerto_control: puerto REP de control con el comando stats (None = sin control)
+            dir_perfiles: directorio de los perfiles que se piden por el socket de control
+            trazador: Trazador de solicitudes; el GC empieza trazas si el PS no las trae
         """
         self.sede = sede
+        self.mapa = mapa
+        self.formato = formato
         self.context = zmq.Context()
         
-        # Socket REP: comunicación con PS
-        self.socket_rep = self.context.socket(zmq.REP)
-        self.socket_rep.bind(f"tcp://*:{puerto_rep}")
+        # Latencias por operación; se consultan por el socket de control
+        self.metricas = Metricas(f"gc_sede{sede}")
+        self.perfilador = Perfilador(self.metricas.proceso, dir_perfiles)
+        self.control = ServidorControl(self.context, puerto_control, self.metricas, self.perfilador) if puerto_control else None
+        self.trazas = trazador or trazas.INACTIVO
+        
+        # Control de admisión: lo que excede los límites se responde "ocupado" al momento
+        self.admision = ControlAdmision(max_en_curso, tasa_ps, rafaga_ps, reintentar_ms, metricas=self.metricas)
+        if self.control:
+            self.control.registrar("admision", lambda solicitud: {"exito": True, **self.admision.estado()})
+        
+        # Respuestas por clave de idempotencia: una solicitud repetida no vuelve a los actores ni al GA
+        self.idempotencia = CacheIdempotencia(claves_idempotencia, ttl_idempotencia_s) if claves_idempotencia else None
+        self.prestamos_por_clave = {}       # clave -> PrestamoPendiente todavía sin responder
+        if self.idempotencia is not None:
+            self.metricas.medir("idempotencia_claves", lambda: len(self.idempotencia))
+            if self.control:
+                self.control.registrar("idempotencia", lambda solicitud: {
+                    "exito": True,
+                    **self.idempotencia.estado(),
+                    "en_curso": len(self.prestamos_por_clave)
+                })
         
-        # Socket PUB: comunicación con Actores (asíncrona)
-        self.socket_pub = self.context.socket(zmq.PUB)
-        self.socket_pub.bind(f"tcp://*:{puerto_pub}")
+        # Filtro de libros existentes: las solicitudes de un libro que seguro no existe se
+        # rechazan sin pasar por los actores ni el GA
+        self.filtro = None
+        if filtro_libros:
+            self.filtro = FiltroCatalogo(self.context, filtro_libros, mapa.particion if mapa else None,
+                                         refresco_filtro_s, tasa_falsos_filtro, self.metricas, vigencia_filtro_s)
+            if self.control:
+                self.control.registrar("filtro_libros", lambda solicitud: {"exito": True, **self.filtro.estado()})
         
-        # Socket REQ: comunicación SÍNCRONA con Actor Préstamo
-        self.socket_prestamo = self.context.socket(zmq.REQ)
+        # Socket ROUTER: comunicación con PS. Las devoluciones y renovaciones se responden
+        # al momento aunque haya préstamos esperando al Actor Préstamo
+        self.socket_ps = self.context.socket(zmq.ROUTER)
+        self.socket_ps.bind(f"tcp://*:{puerto_rep}")
+        
+        # Socket ROUTER: cola de devoluciones y renovaciones. Cada trabajo se guarda en
+        # disco antes de responder al PS, va a un solo actor del canal (DEALER) y se borra
+        # cuando ese actor confirma; sin confirmación a tiempo se entrega de nuevo
+        self.socket_trabajos = self.context.socket(zmq.ROUTER)
+        self.socket_trabajos.bind(f"tcp://*:{puerto_trabajos}")
+        self.actores_trabajo = {}           # identidad -> ActorRegistrado (con su canal)
+        self.cola = ColaTrabajos(archivo_cola or f"gc_sede{sede}_cola.db", timeout_trabajo_ms / 1000.0)
+        self.metricas.medir("cola_trabajos_pendientes", self.cola.profundidad)
+        self.metricas.medir("cola_trabajos_en_vuelo", lambda: len(self.cola.en_vuelo))
+        if self.control:
+            self.control.registrar("cola", lambda solicitud: {
+                "exito": True,
+                **self.cola.estado(),
+                "actores": [actor.estado() for actor in list(self.actores_trabajo.values())]
+            })
+        
+        # Socket ROUTER: pool de Actores Préstamo (DEALER) que se registran al iniciar;
+        # cada préstamo va al actor con menos préstamos en curso
+        self.socket_prestamo = self.context.socket(zmq.ROUTER)
         self.socket_prestamo.bind(f"tcp://*:{puerto_prestamo}")
+        self.actores_prestamo = {}          # identidad -> ActorRegistrado
         
-        print(f"  Gestor de Carga Sede {sede} iniciado")
-        print(f" REP (PS): puerto {puerto_rep}")
-        print(f" PUB (Actores Async): puerto {puerto_pub}")
-        print(f" REQ (Actor Préstamo): puerto {puerto_prestamo}\n")
+        # Préstamos sin actor libre todavía y préstamos enviados (id -> PrestamoPendiente)
+        self.timeout_prestamo = timeout_prestamo_ms / 1000.0
+        self.prestamos_pendientes = deque()
+        self.prestamos_en_curso = {}
+        self.orden_en_curso = deque()        # (limite, id) en orden de envío, para los vencimientos
+        self.ids_prestamo = itertools.count(1)
+        if self.control:
+            self.control.registrar("prestamos", lambda solicitud: {
+                "exito": True,
+                "pendientes": len(self.prestamos_pendientes),
+                "en_curso": len(self.prestamos_en_curso),
+                "actores": [actor.estado() for actor in self.actores_prestamo.values()]
+            })
         
-        # Pequeña pausa para que PUB se establezca
-        time.sleep(0.5)
+        log.info(f"  Gestor de Carga Sede {sede} iniciado")
+        log.info(f" ROUTER (PS): puerto {puerto_rep}")
+        log.info(f" ROUTER (Cola de trabajos): puerto {puerto_trabajos}, {self.cola.archivo} "
+                 f"({self.cola.profundidad()} pendientes)")
+        log.info(f" ROUTER (Actores Préstamo): puerto {puerto_prestamo}")
+        log.info(f" Formato hacia actores: {formato}")
+        if self.admision.activo:
+            log.info(f" Admisión: en curso {self.admision.max_en_curso or 'sin límite'}, "
+                     f"{tasa_ps or 'sin límite de'} solicitudes/s por PS")
+        if self.filtro:
+            log.info(f" Filtro de libros de {', '.join(filtro_libros.values())} (refresco {refresco_filtro_s:g} s, "
+                     f"vigencia {vigencia_filtro_s:g} s)")
+        if mapa:
+            log.info(f" Catálogo en {len(mapa.particiones)} particiones (mapa versión {mapa.version})")
     
-    def procesar_devolucion(self, usuario, libro):
+    def encolar_trabajo(self, tipo, usuario, libro, span=trazas.SPAN_INACTIVO, id_operacion=None):
+        """
+        Guarda una operación asíncrona en la cola para los actores de su canal
+        
+        Args:
+            id_operacion: id con que el GA descarta la operación repetida (la clave de
+                          idempotencia del PS; None = uno nuevo)
+        
+        Returns:
+            el canal; al volver el trabajo ya está en disco
+        """
+        canal = f"{tipo}.{self.mapa.particion(libro)}" if self.mapa else tipo
+        mensaje = {"operacion": tipo, "usuario": usuario, "libro": libro}
+        if id_operacion:
+            mensaje["id_operacion"] = id_operacion
+        self.cola.encolar(canal, span.propagar(metricas.sellar(mensaje)))
+        self.enviar_trabajos()
+        return canal
+    
+    def procesar_devolucion(self, usuario, libro, span=trazas.SPAN_INACTIVO, clave=None):
         """Procesa devolución de forma asíncrona"""
-        print(f" DEVOLUCIÓN | Usuario: {usuario} | Libro: {libro}")
+        log_solicitudes.debug(" DEVOLUCIÓN | Usuario: %s | Libro: %s", usuario, libro)
         
         # Respuesta inmediata al PS
         respuesta = {
@@ -47,15 +252,15 @@ class GestorCarga:
             "mensaje": "Biblioteca recibiendo el libro. Gracias por devolverlo."
         }
         
-        # Publicar al canal para que Actor lo procese
-        self.socket_pub.send_string(f"devolucion {usuario},{libro}")
-        print(f" Publicado en canal 'devolucion'\n")
+        # Encolar para que un Actor del canal lo procese
+        canal = self.encolar_trabajo("devolucion", usuario, libro, span, clave)
+        log_solicitudes.debug(" Encolado en canal '%s'", canal)
         
         return respuesta
     
-    def procesar_renovacion(self, usuario, libro):
+    def procesar_renovacion(self, usuario, libro, span=trazas.SPAN_INACTIVO, clave=None):
         """Procesa renovación de forma asíncrona"""
-        print(f" RENOVACIÓN | Usuario: {usuario} | Libro: {libro}")
+        log_solicitudes.debug(" RENOVACIÓN | Usuario: %s | Libro: %s", usuario, libro)
         
         # Calcular nueva fecha (1 semana adicional)
         fecha_actual = datetime.now()
@@ -67,125 +272,514 @@ class GestorCarga:
             "mensaje": f"Renovación aceptada. Nueva fecha de entrega: {nueva_fecha.strftime('%Y-%m-%d')}"
         }
         
-        # Publicar al canal para que Actor lo procese
-        self.socket_pub.send_string(f"renovacion {usuario},{libro}")
-        print(f" Publicado en canal 'renovacion'\n")
+        # Encolar para que un Actor del canal lo procese
+        canal = self.encolar_trabajo("renovacion", usuario, libro, span, clave)
+        log_solicitudes.debug(" Encolado en canal '%s'", canal)
         
         return respuesta
     
-    def procesar_prestamo(self, usuario, libro):
-        """Procesa préstamo de forma SÍNCRONA a través de Actor"""
-        print(f" PRÉSTAMO | Usuario: {usuario} | Libro: {libro}")
+    def encolar_prestamo(self, pendiente):
+        """Préstamo SÍNCRONO para el PS: espera su turno para ir al Actor Préstamo"""
+        if log_solicitudes.isEnabledFor(logging.DEBUG):
+            log_solicitudes.debug(f" PRÉSTAMO | Usuario: {pendiente.usuario} | Libro: {pendiente.libro}"
+                                  + (f" | Partición: {self.mapa.particion(pendiente.libro)}" if self.mapa else "")
+                                  + f" | En espera: {len(self.prestamos_pendientes)}"
+                                  + f" | En curso: {len(self.prestamos_en_curso)}")
+        
+        self.prestamos_pendientes.append(pendiente)
+        self.enviar_prestamo()
+    
+    def elegir_actor(self):
+        """Actor Préstamo con menos préstamos en curso y capacidad libre (None si no hay)"""
+        libres = [actor for actor in self.actores_prestamo.values() if actor.en_curso < actor.capacidad]
+        if not libres:
+            return None
+        # Entre los igual de ocupados, el que hace más que no recibe uno
+        return min(libres, key=lambda actor: (actor.en_curso / actor.capacidad, actor.ultimo_envio))
+    
+    def enviar_prestamo(self):
+        """Envía los préstamos en espera mientras haya actores con capacidad libre"""
+        while self.prestamos_pendientes:
+            actor = self.elegir_actor()
+            if actor is None:
+                return
+            pendiente = self.prestamos_pendientes.popleft()
+            try:
+                solicitud = {
+                    "operacion": "prestamo",
+                    "codigo": pendiente.libro,
+                    "usuario": pendiente.usuario
+                }
+                
+                if pendiente.clave:
+                    solicitud["id_operacion"] = pendiente.clave
+                
+                pendiente.llamada = pendiente.span.hijo("actor:prestamo")
+                pendiente.llamada.propagar(metricas.sellar(solicitud))
+                pendiente.enviado = time.perf_counter()
+                pendiente.actor = actor
+                
+                # [identidad del actor, id del préstamo, solicitud]: el actor responde con el mismo id
+                identificador = str(next(self.ids_prestamo)).encode()
+                self.socket_prestamo.send_multipart([
+                    actor.identidad, identificador, codec.codificar(solicitud, actor.formato)
+                ])
+                self.prestamos_en_curso[identificador] = pendiente
+                self.orden_en_curso.append((pendiente.limite, identificador))
+                actor.en_curso += 1
+                actor.ultimo_envio = time.monotonic()
+            except Exception as e:
+                log.error(f" Error enviando préstamo: {e}")
+                self.responder_prestamo(pendiente, {
+                    "exito": False,
+                    "mensaje": f"Error del sistema: {str(e)}"
+                }, definitiva=False)
+    
+    def registrar_actor(self, actores, identidad, registro_actor):
+        """Alta (o latido) de un actor en su pool: Actores Préstamo o actores de la cola"""
+        actor = actores.get(identidad)
+        if actor is None:
+            formatos = registro_actor.get("formatos", [codec.FORMATO_JSON])
+            formato = self.formato if self.formato in formatos else codec.FORMATO_JSON
+            actor = ActorRegistrado(identidad, max(int(registro_actor.get("capacidad", 1)), 1), formato,
+                                    float(registro_actor.get("latido_s", 1.0)), registro_actor.get("canal"))
+            actores[identidad] = actor
+            nombre = f"del canal '{actor.canal}'" if actor.canal else "Préstamo"
+            log.info(f" Actor {nombre} registrado: {identidad.hex()} (capacidad {actor.capacidad}, "
+                     f"formato {formato}; {len(actores)} actores)")
+        actor.visto = time.monotonic()
+    
+    def recibir_prestamo(self):
+        """Mensaje de un Actor Préstamo: registro/latido o la respuesta a un préstamo"""
+        identidad, identificador, datos = self.socket_prestamo.recv_multipart()
+        
+        if not identificador:
+            registro_actor, _ = codec.decodificar(datos)
+            if registro_actor.get("operacion") == codec.REGISTRO_ACTOR:
+                self.registrar_actor(self.actores_prestamo, identidad, registro_actor)
+            return
+        
+        actor = self.actores_prestamo.get(identidad)
+        if actor:
+            actor.visto = time.monotonic()
+        pendiente = self.prestamos_en_curso.pop(identificador, None)
+        if pendiente is None:
+            # Ya vencido: al PS se le respondió error
+            self.metricas.incrementar("prestamos_respuesta_tardia")
+            return
+        if pendiente.actor is actor:
+            actor.en_curso -= 1
+            actor.atendidos += 1
         
         try:
-            # Enviar solicitud al Actor Préstamo
-            solicitud = {
-                "operacion": "prestamo",
-                "codigo": libro,
-                "usuario": usuario
+            resultado, _ = codec.decodificar(datos)
+        except Exception as e:
+            log.error(f" Error procesando préstamo: {e}")
+            resultado = {
+                "exito": False,
+                "mensaje": f"Error del sistema: {str(e)}"
+            }
+        
+        pendiente.llamada.resultado = metricas.resultado(resultado)
+        pendiente.llamada.cerrar()
+        # Espera: lo que el préstamo estuvo en cola en el GC antes de ir al actor
+        self.metricas.registrar("actor:prestamo", metricas.resultado(resultado),
+                                time.perf_counter() - pendiente.enviado, pendiente.enviado - pendiente.inicio)
+        
+        if resultado["exito"]:
+            log_solicitudes.debug(" Préstamo otorgado hasta %s", resultado.get("fecha_devolucion", "N/A"))
+        else:
+            log_solicitudes.debug(" %s", resultado["mensaje"])
+        
+        self.responder_prestamo(pendiente, resultado)
+    
+    def revisar_prestamos(self):
+        """Vence los préstamos sin respuesta a tiempo y da de baja a los actores sin latido"""
+        ahora = time.perf_counter()
+        vencimiento = {
+            "exito": False,
+            "mensaje": "El actor de préstamo no respondió a tiempo. Intente de nuevo."
+        }
+        
+        while self.prestamos_pendientes and self.prestamos_pendientes[0].limite <= ahora:
+            self.metricas.incrementar("prestamos_vencidos")
+            self.responder_prestamo(self.prestamos_pendientes.popleft(), vencimiento, definitiva=False)
+        
+        while self.orden_en_curso and self.orden_en_curso[0][0] <= ahora:
+            _, identificador = self.orden_en_curso.popleft()
+            pendiente = self.prestamos_en_curso.pop(identificador, None)
+            if pendiente is None:
+                continue
+            # El actor no respondió: no recibe más préstamos hasta su próximo latido
+            actor = pendiente.actor
+            if self.actores_prestamo.pop(actor.identidad, None):
+                log.warning(f" Actor Préstamo {actor.identidad.hex()} no respondió a tiempo; dado de baja")
+            pendiente.llamada.resultado = "timeout"
+            pendiente.llamada.cerrar()
+            self.metricas.registrar("actor:prestamo", "timeout", ahora - pendiente.enviado,
+                                    pendiente.enviado - pendiente.inicio)
+            self.metricas.incrementar("prestamos_vencidos")
+            self.responder_prestamo(pendiente, vencimiento, definitiva=False)
+        
+        monotonic = time.monotonic()
+        for actor in list(self.actores_prestamo.values()):
+            # El actor late desde su hilo principal aunque sus hilos estén ocupados: sin latidos
+            # se da de baja aunque tenga préstamos en curso (esos vencen o responden tarde)
+            if monotonic - actor.visto > 3 * actor.latido_s:
+                del self.actores_prestamo[actor.identidad]
+                log.warning(f" Actor Préstamo {actor.identidad.hex()} sin latidos; dado de baja")
+    
+    def enviar_trabajos(self):
+        """Entrega trabajos de la cola, de a uno por ronda, a los actores con capacidad libre"""
+        if not self.cola.hay_pendientes():
+            return
+        
+        # Primero el menos ocupado; entre los igual de ocupados, el que hace más que no recibe uno
+        libres = sorted((actor for actor in self.actores_trabajo.values() if actor.en_curso < actor.capacidad),
+                        key=lambda actor: (actor.en_curso / actor.capacidad, actor.ultimo_envio))
+        while libres:
+            for actor in list(libres):
+                tomado = self.cola.tomar(actor.canal, actor.identidad)
+                if tomado is None:
+                    libres.remove(actor)
+                    continue
+                
+                # [identidad del actor, id del trabajo, trabajo]: el actor confirma con el mismo id
+                id_trabajo, mensaje = tomado
+                self.socket_trabajos.send_multipart([
+                    actor.identidad, str(id_trabajo).encode(), codec.codificar(mensaje, actor.formato)
+                ])
+                actor.en_curso += 1
+                actor.ultimo_envio = time.monotonic()
+                if actor.en_curso >= actor.capacidad:
+                    libres.remove(actor)
+    
+    def recibir_trabajo(self):
+        """Mensaje de un actor de la cola: registro/latido o la confirmación de un trabajo"""
+        identidad, identificador, datos = self.socket_trabajos.recv_multipart()
+        
+        if not identificador:
+            registro_actor, _ = codec.decodificar(datos)
+            if registro_actor.get("operacion") == codec.REGISTRO_ACTOR and registro_actor.get("canal"):
+                self.registrar_actor(self.actores_trabajo, identidad, registro_actor)
+            return
+        
+        actor = self.actores_trabajo.get(identidad)
+        if actor:
+            actor.visto = time.monotonic()
+        
+        # Libera la capacidad del actor al que se entregó (si llegó tarde, puede ser otro)
+        id_trabajo = int(identificador)
+        vuelo = self.cola.en_vuelo.get(id_trabajo)
+        encargado = self.actores_trabajo.get(vuelo[1]) if vuelo else None
+        if encargado:
+            encargado.en_curso = max(encargado.en_curso - 1, 0)
+            encargado.atendidos += 1
+        
+        confirmado = self.cola.confirmar(id_trabajo)
+        if confirmado is None:
+            # Entregado dos veces y ya confirmado por el otro actor (el GA aplicó una sola)
+            self.metricas.incrementar("trabajos_confirmacion_repetida")
+            return
+        
+        # Servicio: desde la entrega hasta la confirmación (red, actor y GA)
+        mensaje, segundos = confirmado
+        if segundos is not None:
+            confirmacion, _ = codec.decodificar(datos)
+            self.metricas.registrar(f"cola:{mensaje['operacion']}", confirmacion.get("resultado", "ok"), segundos)
+    
+    def revisar_trabajos(self):
+        """Vuelve a entregar los trabajos sin confirmación a tiempo y da de baja a los actores sin latido"""
+        for identidad in self.cola.vencidos():
+            self.metricas.incrementar("trabajos_reentregados")
+            # El actor no confirmó: no recibe más trabajos hasta su próximo latido
+            if self.actores_trabajo.pop(identidad, None):
+                log.warning(f" Actor {identidad.hex()} no confirmó un trabajo a tiempo; dado de baja")
+        
+        monotonic = time.monotonic()
+        for actor in list(self.actores_trabajo.values()):
+            # Late desde su hilo principal mientras sus hilos atienden: sin latidos se da de
+            # baja aunque tenga trabajos en vuelo (la cola los entrega de nuevo al vencer)
+            if monotonic - actor.visto > 3 * actor.latido_s:
+                del self.actores_trabajo[actor.identidad]
+                log.warning(f" Actor {actor.identidad.hex()} del canal '{actor.canal}' sin latidos; dado de baja")
+    
+    def responder_prestamo(self, pendiente, respuesta, definitiva=True):
+        """
+        Responde un préstamo al PS (y a sus repetidas) y cierra su span y su medición
+        
+        Args:
+            definitiva: si se guarda para la clave de idempotencia; un vencimiento no lo
+                        es: al repetirla, la solicitud vuelve al actor y el GA no presta dos veces
+        """
+        self.responder(pendiente.sobre, respuesta, pendiente.formato)
+        if pendiente.clave:
+            del self.prestamos_por_clave[pendiente.clave]
+            if definitiva:
+                self.idempotencia.guardar(pendiente.clave, ("prestamo", pendiente.usuario, pendiente.libro), respuesta)
+            for sobre, formato, inicio in pendiente.repetidas:
+                self.responder(sobre, respuesta, formato)
+                self.metricas.registrar("prestamo", "repetida", time.perf_counter() - inicio)
+        pendiente.span.resultado = metricas.resultado(respuesta)
+        pendiente.span.cerrar()
+        self.admision.terminar("prestamo")
+        self.metricas.registrar("prestamo", metricas.resultado(respuesta), time.perf_counter() - pendiente.inicio,
+                                metricas.espera(pendiente.solicitud, pendiente.recibido))
+    
+    def atender_repetida(self, sobre, formato, clave, huella, inicio):
+        """
+        Responde una solicitud cuya clave de idempotencia ya se vio: con la respuesta
+        guardada o, si la original está en curso, junto con ella
+        
+        Returns:
+            False si la clave es nueva (la solicitud se atiende normalmente)
+        """
+        pendiente = self.prestamos_por_clave.get(clave)
+        if pendiente is not None:
+            guardada = ("prestamo", pendiente.usuario, pendiente.libro)
+            respuesta = None
+        else:
+            entrada = self.idempotencia.obtener(clave)
+            if entrada is None:
+                return False
+            guardada, respuesta = entrada
+        
+        if guardada != huella:
+            respuesta = {
+                "exito": False,
+                "mensaje": "La clave de idempotencia ya se usó con otra solicitud"
             }
+        elif respuesta is None:
+            pendiente.repetidas.append((sobre, formato, inicio))
+            return True
+        
+        self.responder(sobre, respuesta, formato)
+        self.metricas.registrar(huella[0], "repetida", time.perf_counter() - inicio)
+        return True
+    
+    def responder(self, sobre, respuesta, formato):
+        """Responde a un PS a través del ROUTER"""
+        self.socket_ps.send_multipart(sobre + [codec.codificar(respuesta, formato)])
+    
+    def leer_solicitud(self, datos):
+        """
+        Interpreta un mensaje del PS o del monitor
+        
+        Acepta el texto original "tipo,usuario,libro" / "health_check" o un mensaje
+        JSON/binario con las claves tipo, usuario y libro (u operacion).
+        
+        Returns:
+            (solicitud, formato) donde solicitud es un dict
+        """
+        if codec.es_binario(datos) or datos[:1] == b"{":
+            return codec.decodificar(datos)
+        
+        mensaje = datos.decode("utf-8")
+        if mensaje == "health_check":
+            return {"operacion": "health_check"}, codec.FORMATO_JSON
+        
+        # Parsear mensaje: "tipo,usuario,libro"
+        tipo, usuario, libro = mensaje.split(",")
+        return {"tipo": tipo, "usuario": usuario, "libro": libro}, codec.FORMATO_JSON
+    
+    def atender_ps(self, frames):
+        """Atiende un mensaje del PS o del monitor; los préstamos quedan pendientes"""
+        # Un PS REQ llega como [identidad, "", mensaje]
+        sobre, mensaje = frames[:-1], frames[-1]
+        recibido = time.time()
+        inicio = time.perf_counter()
+        formato = codec.FORMATO_JSON
+        log_solicitudes.debug(" Mensaje recibido: %r", mensaje)
+        
+        try:
+            try:
+                solicitud, formato = self.leer_solicitud(mensaje)
+                operacion = solicitud.get("operacion")
+                
+                # ------------------------------------------------------------
+                # Health-check desde el monitor GC y negociación de formato
+                # ------------------------------------------------------------
+                if operacion == "health_check":
+                    self.responder(sobre, {"status": "ok"}, formato)
+                    return
+                if operacion == "negociar_formato":
+                    self.responder(sobre, codec.respuesta_negociacion(solicitud), formato)
+                    return
+                
+                tipo = solicitud["tipo"].strip().lower()
+                usuario = solicitud["usuario"].strip()
+                libro = solicitud["libro"].strip()
+            except (ValueError, KeyError, AttributeError):
+                respuesta = {
+                    "exito": False,
+                    "mensaje": "Formato de mensaje inválido. Use: tipo,usuario,libro"
+                }
+                self.responder(sobre, respuesta, formato)
+                self.metricas.registrar("invalida", "error", time.perf_counter() - inicio)
+                return
             
-            self.socket_prestamo.send_string(json.dumps(solicitud))
+            # Repetida de una solicitud ya respondida (o en curso): no pasa por la admisión
+            clave = solicitud.get("clave_idempotencia") if self.idempotencia is not None else None
+            if clave and self.atender_repetida(sobre, formato, clave, (tipo, usuario, libro), inicio):
+                return
             
-            # Esperar respuesta del Actor (síncrono)
-            respuesta_json = self.socket_prestamo.recv_string()
-            resultado = json.loads(respuesta_json)
+            if self.filtro and tipo in OPERACIONES_LIBRO and not self.filtro.existe(libro):
+                self.responder(sobre, {
+                    "exito": False,
+                    "mensaje": f"El libro {libro} no existe en la biblioteca"
+                }, formato)
+                self.metricas.registrar(tipo, "inexistente", time.perf_counter() - inicio)
+                return
             
-            if resultado["exito"]:
-                print(f" Préstamo otorgado hasta {resultado.get('fecha_devolucion', 'N/A')}\n")
-            else:
-                print(f" {resultado['mensaje']}\n")
+            ocupado = self.admision.admitir(sobre[0], tipo)
+            if ocupado:
+                self.responder(sobre, ocupado, formato)
+                self.metricas.registrar(tipo, "ocupado", time.perf_counter() - inicio)
+                return
             
-            return resultado
+            span = self.trazas.span(tipo, solicitud, raiz=True, codigo=libro, usuario=usuario)
+            if tipo == "prestamo":
+                # Se responde cuando conteste el Actor Préstamo; mientras, se siguen atendiendo PS
+                pendiente = PrestamoPendiente(sobre, formato, solicitud, usuario, libro, span,
+                                              recibido, inicio, inicio + self.timeout_prestamo, clave)
+                if clave:
+                    self.prestamos_por_clave[clave] = pendiente
+                self.encolar_prestamo(pendiente)
+                return
             
+            try:
+                with span:
+                    # Procesar según tipo
+                    if tipo == "devolucion":
+                        respuesta = self.procesar_devolucion(usuario, libro, span, clave)
+                    elif tipo == "renovacion":
+                        respuesta = self.procesar_renovacion(usuario, libro, span, clave)
+                    else:
+                        respuesta = {
+                            "exito": False,
+                            "mensaje": f"Tipo de operación desconocido: {tipo}"
+                        }
+                        log.warning(f" Tipo desconocido: {tipo}")
+                    
+                    # Enviar respuesta al PS
+                    self.responder(sobre, respuesta, formato)
+                    if clave:
+                        self.idempotencia.guardar(clave, (tipo, usuario, libro), respuesta)
+                    span.resultado = metricas.resultado(respuesta)
+            finally:
+                self.admision.terminar(tipo)
+            self.metricas.registrar(tipo, metricas.resultado(respuesta), time.perf_counter() - inicio,
+                                    metricas.espera(solicitud, recibido))
         except Exception as e:
-            print(f" Error procesando préstamo: {e}\n")
-            return {
-                "exito": False,
-                "mensaje": f"Error del sistema: {str(e)}"
-            }
+            log.exception(f" Error general: {e}")
+            self.metricas.incrementar("errores")
+            try:
+                self.responder(sobre, {"exito": False, "mensaje": str(e)}, formato)
+            except:
+                pass
     
     def ejecutar(self):
-        """Loop principal del GC"""
-        print(" Gestor de Carga listo para recibir solicitudes...\n")
+        """Loop principal del GC: atiende a los PS, a los Actores Préstamo y a los de la cola"""
+        log.info(" Gestor de Carga listo para recibir solicitudes...")
+        
+        poller = zmq.Poller()
+        poller.register(self.socket_ps, zmq.POLLIN)
+        poller.register(self.socket_prestamo, zmq.POLLIN)
+        poller.register(self.socket_trabajos, zmq.POLLIN)
         
         while True:
             try:
-                # Recibir solicitud del PS
-                mensaje = self.socket_rep.recv_string()
-                print(f" Mensaje recibido: {mensaje}")
-
-                 # ------------------------------------------------------------
-                 # Health-check desde el monitor GC
-                 # ------------------------------------------------------------
-                if mensaje == "health_check":
-                    self.socket_rep.send_string(json.dumps({"status": "ok"}))
-                    continue
+                eventos = dict(poller.poll(REVISION_MS))
+                if self.perfilador.activo:
+                    self.perfilador.revisar()
                 
-                # Parsear mensaje: "tipo,usuario,libro"
-                try:
-                    tipo, usuario, libro = mensaje.split(",")
-                    tipo = tipo.strip().lower()
-                    usuario = usuario.strip()
-                    libro = libro.strip()
-                except ValueError:
-                    respuesta = {
-                        "exito": False,
-                        "mensaje": "Formato de mensaje inválido. Use: tipo,usuario,libro"
-                    }
-                    self.socket_rep.send_string(json.dumps(respuesta))
-                    continue
+                if self.socket_prestamo in eventos:
+                    self.recibir_prestamo()
                 
-                # Procesar según tipo
-                if tipo == "devolucion":
-                    respuesta = self.procesar_devolucion(usuario, libro)
-                elif tipo == "renovacion":
-                    respuesta = self.procesar_renovacion(usuario, libro)
-                elif tipo == "prestamo":
-                    respuesta = self.procesar_prestamo(usuario, libro)
-                else:
-                    respuesta = {
-                        "exito": False,
-                        "mensaje": f"Tipo de operación desconocido: {tipo}"
-                    }
-                    print(f" Tipo desconocido: {tipo}\n")
+                if self.socket_trabajos in eventos:
+                    self.recibir_trabajo()
                 
-                # Enviar respuesta al PS
-                self.socket_rep.send_string(json.dumps(respuesta))
+                if self.socket_ps in eventos:
+                    self.atender_ps(self.socket_ps.recv_multipart())
+                
+                self.revisar_prestamos()
+                self.enviar_prestamo()
+                self.revisar_trabajos()
+                self.enviar_trabajos()
                 
             except KeyboardInterrupt:
-                print("\n Deteniendo Gestor de Carga...")
+                log.info(" Deteniendo Gestor de Carga...")
                 break
             except Exception as e:
-                print(f" Error general: {e}")
-                respuesta = {"exito": False, "mensaje": str(e)}
-                try:
-                    self.socket_rep.send_string(json.dumps(respuesta))
-                except:
-                    pass
+                log.exception(f" Error general: {e}")
+                self.metricas.incrementar("errores")
+        
+        self.cola.cerrar()
 
 if __name__ == "__main__":
-    import sys
-    
-    # Configurar según sede
-    if len(sys.argv) > 1:
-        sede = int(sys.argv[1])
-    else:
-        print("Uso: python gestor_carga.py <sede>")
-        print("Ejemplo: python gestor_carga.py 1")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Gestor de Carga",
+        epilog="Ejemplo: python gestor_carga.py 1"
+    )
+    parser.add_argument("sede", type=int, help="número de sede (1 o 2)")
+    parser.add_argument("--formato", choices=codec.FORMATOS, default=codec.FORMATO_JSON,
+                        help="formato hacia los actores (las respuestas al PS usan el formato de cada solicitud)")
+    parser.add_argument("--mapa", default=None,
+                        help="archivo JSON del mapa de particiones (encola por partición)")
+    parser.add_argument("--timeout-prestamo-ms", type=int, default=5000,
+                        help="espera máxima de un préstamo por la respuesta de un Actor Préstamo")
+    parser.add_argument("--max-en-curso", type=admision.limite_en_curso, action="append", default=[],
+                        metavar="OPERACION=N",
+                        help="máximo de solicitudes de la operación aceptadas sin responder; el resto se "
+                             "responde 'ocupado' (repetible, ej: prestamo=200)")
+    parser.add_argument("--tasa-ps", type=float, default=0,
+                        help="solicitudes por segundo aceptadas de cada PS (0 = sin límite)")
+    parser.add_argument("--rafaga-ps", type=int, default=None,
+                        help="solicitudes seguidas aceptadas de un PS sin esperar (por defecto, un segundo de tasa)")
+    parser.add_argument("--reintentar-ms", type=int, default=100,
+                        help="espera sugerida al PS cuando se excede un límite de en curso")
+    parser.add_argument("--cola-archivo", default=None,
+                        help="archivo SQLite de la cola de devoluciones y renovaciones (por defecto gc_sede<N>_cola.db)")
+    parser.add_argument("--timeout-trabajo-ms", type=int, default=10000,
+                        help="espera máxima por la confirmación de un actor antes de entregar el trabajo de nuevo")
+    parser.add_argument("--claves-idempotencia", type=int, default=50000,
+                        help="respuestas guardadas por clave de idempotencia para las solicitudes repetidas "
+                             "(0 = desactivado)")
+    parser.add_argument("--ttl-idempotencia-s", type=float, default=120.0,
+                        help="segundos que se guarda la respuesta de una clave de idempotencia")
+    parser.add_argument("--filtro-libros", action="store_true",
+                        help="rechazar en el GC los libros que no existen (filtro de Bloom cargado del GA, "
+                             "o de cada partición con --mapa)")
+    parser.add_argument("--ga", default=None,
+                        help="endpoint del GA para el filtro de libros (por defecto tcp://localhost:<puerto del GA de la sede>)")
+    parser.add_argument("--filtro-refresco-s", type=float, default=60.0,
+                        help="cada cuánto se pregunta al GA si cambió el catálogo")
+    parser.add_argument("--filtro-tasa-falsos", type=float, default=TASA_FALSOS,
+                        help="tasa de falsos positivos del filtro de libros (más baja, más memoria)")
+    parser.add_argument("--filtro-vigencia-s", type=float, default=VIGENCIA_S,
+                        help="segundos desde la última confirmación del GA durante los que se rechaza un libro "
+                             "que no está en el filtro (después se consulta al GA y se refresca el filtro)")
+    registro.agregar_argumentos(parser)
+    control.agregar_argumentos(parser)
+    trazas.agregar_argumentos(parser)
+    args = parser.parse_args()
+    
+    sede = args.sede
+    registro.configurar_desde_args(f"gc_sede{sede}", args)
     
     # Configuración por sede
     configuraciones = {
         1: {
             "puerto_rep": "5555",
-            "puerto_pub": "5556",
-            "puerto_prestamo": "5570"
+            "puerto_trabajos": "5556",
+            "puerto_prestamo": "5570",
+            "puerto_ga": "5557"
         },
         2: {
             "puerto_rep": "5565",
-            "puerto_pub": "5566",
-            "puerto_prestamo": "5571"
+            "puerto_trabajos": "5566",
+            "puerto_prestamo": "5571",
+            "puerto_ga": "5558"
         }
     }
     
@@ -194,11 +788,37 @@ if __name__ == "__main__":
         print(f" Sede {sede} no válida. Use 1 o 2")
         sys.exit(1)
     
+    mapa = MapaParticiones.cargar(args.mapa) if args.mapa else None
+    filtro_libros = None
+    if args.filtro_libros:
+        if mapa:
+            filtro_libros = {particion: mapa.ga(particion) for particion in mapa.particiones}
+        else:
+            filtro_libros = {None: args.ga or f"tcp://localhost:{config['puerto_ga']}"}
+    
     gc = GestorCarga(
         sede=sede,
         puerto_rep=config["puerto_rep"],
-        puerto_pub=config["puerto_pub"],
-        puerto_prestamo=config["puerto_prestamo"]
+        puerto_trabajos=config["puerto_trabajos"],
+        puerto_prestamo=config["puerto_prestamo"],
+        formato=args.formato,
+        mapa=mapa,
+        timeout_prestamo_ms=args.timeout_prestamo_ms,
+        max_en_curso=dict(args.max_en_curso),
+        tasa_ps=args.tasa_ps,
+        rafaga_ps=args.rafaga_ps,
+        reintentar_ms=args.reintentar_ms,
+        archivo_cola=args.cola_archivo,
+        timeout_trabajo_ms=args.timeout_trabajo_ms,
+        claves_idempotencia=args.claves_idempotencia,
+        ttl_idempotencia_s=args.ttl_idempotencia_s,
+        filtro_libros=filtro_libros,
+        refresco_filtro_s=args.filtro_refresco_s,
+        tasa_falsos_filtro=args.filtro_tasa_falsos,
+        vigencia_filtro_s=args.filtro_vigencia_s,
+        puerto_control=args.puerto_control,
+        dir_perfiles=args.perfiles_dir,
+        trazador=trazas.desde_args(f"gc_sede{sede}", args)
     )
     
     gc.ejecutar()
\ No newline at end of file
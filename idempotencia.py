@@ -0,0 +1,78 @@
+"""
+Claves de idempotencia del Gestor de Carga
+
+Un PS que no recibe respuesta a tiempo repite la solicitud con la misma
+clave_idempotencia. El GC guarda la respuesta de cada clave por un tiempo y
+responde las repetidas sin pasar por los actores ni el GA; si la original
+todavia esta en curso, la repetida se responde junto con ella.
+
+La clave se usa tambien como id_operacion hacia el GA: si la respuesta ya no
+esta guardada (vencio, se expulso o el GC se reinicio) el GA no aplica dos
+veces la misma escritura.
+
+La memoria esta acotada: a lo sumo `capacidad` claves, se expulsan primero las
+menos usadas, y cada una vence a los `ttl_s` segundos de guardada.
+"""
+import itertools
+import time
+from collections import OrderedDict
+
+
+class CacheIdempotencia:
+    def __init__(self, capacidad=50000, ttl_s=120.0):
+        """
+        Args:
+            capacidad: claves guardadas como maximo
+            ttl_s: segundos que se recuerda la respuesta de una clave
+        """
+        self.capacidad = capacidad
+        self.ttl = ttl_s
+        self.expulsiones = 0
+
+        # clave -> (vence, huella de la solicitud, respuesta), de la menos a la mas usada
+        self._claves = OrderedDict()
+
+    def __len__(self):
+        return len(self._claves)
+
+    def obtener(self, clave):
+        """
+        Returns:
+            (huella, respuesta) guardadas para la clave, o None si no esta o vencio
+        """
+        entrada = self._claves.get(clave)
+        if entrada is None:
+            return None
+        vence, huella, respuesta = entrada
+        if vence <= time.monotonic():
+            del self._claves[clave]
+            return None
+        self._claves.move_to_end(clave)
+        return huella, respuesta
+
+    def guardar(self, clave, huella, respuesta):
+        """
+        Args:
+            clave: clave_idempotencia de la solicitud
+            huella: (tipo, usuario, libro); una clave repetida con otra huella es un error del cliente
+            respuesta: lo que se respondio a la solicitud original
+        """
+        ahora = time.monotonic()
+        self._claves[clave] = (ahora + self.ttl, huella, respuesta)
+        self._claves.move_to_end(clave)
+
+        # Las del frente son las mas viejas: se descartan las vencidas aunque sobre lugar
+        vencidas = [vieja for vieja, (vence, _, _) in itertools.islice(self._claves.items(), 2) if vence <= ahora]
+        for vieja in vencidas:
+            del self._claves[vieja]
+        while len(self._claves) > self.capacidad:
+            self._claves.popitem(last=False)
+            self.expulsiones += 1
+
+    def estado(self):
+        return {
+            "claves": len(self._claves),
+            "capacidad": self.capacidad,
+            "ttl_s": self.ttl,
+            "expulsiones": self.expulsiones
+        }
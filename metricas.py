@@ -0,0 +1,183 @@
+"""
+Metricas de latencia y contadores por operacion
+
+Cada proceso registra, por operacion y resultado, dos histogramas:
+    servicio: desde que el proceso toma la solicitud hasta que responde
+    espera:   desde que el emisor la envio (campo t_envio del mensaje) hasta que
+              el proceso la toma; incluye la cola del socket y la red, y solo se
+              registra cuando el mensaje trae t_envio (relojes sincronizados con NTP
+              si los procesos estan en maquinas distintas)
+
+Los medidores son valores instantaneos (profundidad de una cola, ...) que se
+leen al tomar cada instantanea.
+
+Los histogramas son log-lineales al estilo HDR: valores enteros en
+microsegundos, 64 sub-buckets por potencia de 2 (error relativo < 1.6%), con
+memoria acotada sin importar cuantas muestras se registren.
+"""
+import threading
+import time
+
+CAMPO_ENVIO = "t_envio"
+
+_BITS = 7                   # 2^7 = 128 valores exactos antes del primer exponente
+_MITAD = 1 << (_BITS - 1)   # sub-buckets por potencia de 2
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def _indice(valor):
+    if valor < (1 << _BITS):
+        return valor
+    exponente = valor.bit_length() - _BITS
+    return exponente * _MITAD + (valor >> exponente)
+
+
+def _valor(indice):
+    """Valor representativo (punto medio) de un bucket"""
+    if indice < (1 << _BITS):
+        return indice
+    exponente = indice // _MITAD - 1
+    inferior = (indice - exponente * _MITAD) << exponente
+    return inferior + (1 << exponente) // 2
+
+
+class Histograma:
+    def __init__(self):
+        """Histograma de latencias en microsegundos (no es thread-safe; lo protege Metricas)"""
+        self.conteos = {}
+        self.cantidad = 0
+        self.suma = 0
+        self.minimo = None
+        self.maximo = 0
+
+    def registrar(self, segundos):
+        valor = max(int(segundos * 1_000_000), 0)
+        indice = _indice(valor)
+        self.conteos[indice] = self.conteos.get(indice, 0) + 1
+        self.cantidad += 1
+        self.suma += valor
+        self.maximo = max(self.maximo, valor)
+        self.minimo = valor if self.minimo is None else min(self.minimo, valor)
+
+    def percentil(self, p):
+        """Valor en microsegundos por debajo del cual queda el p% de las muestras"""
+        if not self.cantidad:
+            return 0
+        objetivo = max(1, -(-self.cantidad * p // 100))  # techo
+        acumulado = 0
+        for indice in sorted(self.conteos):
+            acumulado += self.conteos[indice]
+            if acumulado >= objetivo:
+                return min(_valor(indice), self.maximo)
+        return self.maximo
+
+    def resumen(self):
+        """Cantidad y latencias en milisegundos"""
+        if not self.cantidad:
+            return {"n": 0}
+        resumen = {
+            "n": self.cantidad,
+            "media_ms": round(self.suma / self.cantidad / 1000, 3),
+            "min_ms": round(self.minimo / 1000, 3),
+            "max_ms": round(self.maximo / 1000, 3),
+        }
+        for p in PERCENTILES:
+            resumen[f"p{p:g}_ms"] = round(self.percentil(p) / 1000, 3)
+        return resumen
+
+
+def sellar(mensaje):
+    """Marca la hora de envio en un mensaje (dict) antes de mandarlo"""
+    mensaje[CAMPO_ENVIO] = time.time()
+    return mensaje
+
+
+def espera(mensaje, recibido):
+    """
+    Segundos entre el envio de un mensaje y recibido (time.time()), o None si
+    el mensaje no trae t_envio
+    """
+    enviado = mensaje.get(CAMPO_ENVIO) if isinstance(mensaje, dict) else None
+    if enviado is None:
+        return None
+    return max(recibido - enviado, 0.0)
+
+
+def resultado(respuesta):
+    """Clasifica una respuesta del protocolo: ok o rechazo"""
+    if respuesta.get("exito") or respuesta.get("disponible") or respuesta.get("status") == "ok":
+        return "ok"
+    return "rechazo"
+
+
+class Metricas:
+    def __init__(self, proceso):
+        """
+        Contadores e histogramas de servicio y espera por (operacion, resultado)
+
+        Args:
+            proceso: nombre del proceso, se incluye en cada instantanea
+        """
+        self.proceso = proceso
+        self.inicio = time.time()
+        self.medidores = {}
+        self._lock = threading.Lock()
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self.desde = time.time()
+        self.operaciones = {}
+        self.contadores = {}
+
+    def registrar(self, operacion, resultado, servicio, espera=None):
+        """
+        Args:
+            operacion: tipo de operacion (o etapa, por ejemplo "ga:devolucion")
+            resultado: ok, rechazo, error, ...
+            servicio: segundos de servicio
+            espera: segundos en cola antes del servicio (None = desconocido)
+        """
+        with self._lock:
+            por_resultado = self.operaciones.setdefault(operacion, {})
+            histogramas = por_resultado.get(resultado)
+            if histogramas is None:
+                histogramas = por_resultado[resultado] = (Histograma(), Histograma())
+            histogramas[0].registrar(servicio)
+            if espera is not None:
+                histogramas[1].registrar(espera)
+
+    def incrementar(self, contador, cantidad=1):
+        with self._lock:
+            self.contadores[contador] = self.contadores.get(contador, 0) + cantidad
+
+    def medir(self, medidor, funcion):
+        """Agrega un medidor: funcion() -> valor actual (se llama desde el hilo de control)"""
+        self.medidores[medidor] = funcion
+
+    def instantanea(self, reiniciar=False):
+        """
+        Copia de las metricas acumuladas desde el ultimo reinicio
+
+        Args:
+            reiniciar: empezar una ventana nueva despues de tomar la instantanea
+        """
+        with self._lock:
+            ahora = time.time()
+            operaciones = {
+                operacion: {
+                    resultado: {"servicio": servicio.resumen(), "espera": espera.resumen()}
+                    for resultado, (servicio, espera) in por_resultado.items()
+                }
+                for operacion, por_resultado in self.operaciones.items()
+            }
+            instantanea = {
+                "proceso": self.proceso,
+                "activo_s": round(ahora - self.inicio, 1),
+                "ventana_s": round(ahora - self.desde, 3),
+                "contadores": dict(self.contadores),
+                "medidores": {medidor: funcion() for medidor, funcion in self.medidores.items()},
+                "operaciones": operaciones
+            }
+            if reiniciar:
+                self._reiniciar()
+        return instantanea
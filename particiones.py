@@ -0,0 +1,174 @@
+"""
+Particionamiento del catalogo por ISBN entre varios GA (shards)
+
+Cada particion tiene su GA, su archivo de BD y su replica. Los codigos se
+asignan con hashing consistente: cada particion ocupa `virtuales` puntos de un
+anillo de 64 bits y un codigo pertenece a la particion del primer punto a su
+derecha. Al agregar una particion solo se mueve a ella ~1/N del catalogo.
+
+Archivo del mapa (JSON):
+    {
+      "version": 1,
+      "virtuales": 64,
+      "particiones": {
+        "p1": {"ga": "tcp://10.43.103.177:5557", "replica": "tcp://10.43.103.132:5560"},
+        "p2": {"ga": "tcp://10.43.103.177:5580", "replica": "tcp://10.43.103.132:5581"}
+      }
+    }
+"""
+import bisect
+import hashlib
+import json
+import os
+
+import zmq
+
+import codec
+import registro
+
+log = registro.obtener("particiones")
+
+VIRTUALES = 64
+
+
+def _hash(texto):
+    return int.from_bytes(hashlib.blake2b(texto.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def puerto(endpoint):
+    """Puerto de un endpoint tcp://host:puerto (o host:puerto)"""
+    return endpoint.rsplit(":", 1)[1]
+
+
+def host(endpoint):
+    """Host de un endpoint tcp://host:puerto (o host:puerto)"""
+    return endpoint.split("://", 1)[-1].rsplit(":", 1)[0]
+
+
+class MapaParticiones:
+    def __init__(self, particiones, virtuales=VIRTUALES, version=1, archivo=None):
+        """
+        Args:
+            particiones: dict nombre -> {"ga": endpoint, "replica": endpoint (opcional)}
+            virtuales: puntos del anillo por particion
+            version: se incrementa con cada rebalanceo
+            archivo: archivo del que se cargo (para recargar())
+        """
+        if not particiones:
+            raise ValueError("El mapa debe tener al menos una particion")
+
+        self.particiones = particiones
+        self.virtuales = virtuales
+        self.version = version
+        self.archivo = archivo
+        self._modificado = None
+
+        anillo = sorted((_hash(f"{nombre}#{i}"), nombre)
+                        for nombre in particiones for i in range(virtuales))
+        self._puntos = [punto for punto, _ in anillo]
+        self._duenos = [nombre for _, nombre in anillo]
+
+    @classmethod
+    def cargar(cls, archivo):
+        with open(archivo, encoding="utf-8") as f:
+            datos = json.load(f)
+        mapa = cls(datos["particiones"], datos.get("virtuales", VIRTUALES), datos.get("version", 1), archivo)
+        mapa._modificado = os.path.getmtime(archivo)
+        return mapa
+
+    def guardar(self, archivo=None):
+        """Escribe el mapa de forma atomica (reemplazando el archivo)"""
+        archivo = archivo or self.archivo
+        temporal = f"{archivo}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "virtuales": self.virtuales,
+                       "particiones": self.particiones}, f, indent=2)
+        os.replace(temporal, archivo)
+
+    def recargar(self):
+        """
+        Vuelve a leer el archivo si cambio desde la ultima carga
+
+        Returns:
+            el mapa nuevo, o este mismo si no hay cambios
+        """
+        if not self.archivo or os.path.getmtime(self.archivo) == self._modificado:
+            return self
+        return MapaParticiones.cargar(self.archivo)
+
+    def con_particion(self, nombre, ga, replica=None):
+        """Mapa nuevo (version siguiente) con una particion agregada"""
+        if nombre in self.particiones:
+            raise ValueError(f"La particion {nombre} ya existe")
+        particiones = dict(self.particiones)
+        particiones[nombre] = {"ga": ga, **({"replica": replica} if replica else {})}
+        return MapaParticiones(particiones, self.virtuales, self.version + 1, self.archivo)
+
+    def particion(self, codigo):
+        """Particion duena de un codigo"""
+        indice = bisect.bisect_right(self._puntos, _hash(codigo))
+        return self._duenos[indice % len(self._duenos)]
+
+    def ga(self, particion):
+        return self.particiones[particion]["ga"]
+
+    def replica(self, particion):
+        return self.particiones[particion].get("replica")
+
+    def db_file(self, sede, particion):
+        return f"bd_sede{sede}_{particion}.db"
+
+
+class ClienteParticionado:
+    def __init__(self, context, mapa, formato=codec.FORMATO_JSON):
+        """
+        Envia cada solicitud al GA de la particion duena de su codigo
+
+        Mantiene un socket REQ por particion (con su formato negociado). Si un
+        GA responde que el codigo ya no es suyo, se recarga el mapa y se
+        reintenta una vez.
+
+        Args:
+            context: contexto ZMQ del proceso
+            mapa: MapaParticiones
+            formato: formato preferido con los GA (se negocia con cada uno)
+        """
+        self.context = context
+        self.mapa = mapa
+        self.formato = formato
+        self.sockets = {}
+        self.formatos = {}
+
+    def _socket(self, particion):
+        if particion not in self.sockets:
+            socket = self.context.socket(zmq.REQ)
+            socket.connect(self.mapa.ga(particion))
+            self.sockets[particion] = socket
+            self.formatos[particion] = codec.negociar(socket, self.formato)
+        return self.sockets[particion], self.formatos[particion]
+
+    def _enviar(self, particion, solicitud):
+        socket, formato = self._socket(particion)
+        socket.send(codec.codificar(solicitud, formato))
+        respuesta, _ = codec.decodificar(socket.recv())
+        return respuesta
+
+    def solicitar(self, solicitud):
+        respuesta = self._enviar(self.mapa.particion(solicitud["codigo"]), solicitud)
+
+        if "particion_correcta" in respuesta:
+            mapa = self.mapa.recargar()
+            if mapa is not self.mapa:
+                log.info(f" Mapa de particiones actualizado a la version {mapa.version}")
+                self.actualizar_mapa(mapa)
+                respuesta = self._enviar(self.mapa.particion(solicitud["codigo"]), solicitud)
+
+        return respuesta
+
+    def actualizar_mapa(self, mapa):
+        """Cambia de mapa; se reconectan las particiones cuyo GA cambio"""
+        for particion in list(self.sockets):
+            if particion not in mapa.particiones or mapa.ga(particion) != self.mapa.ga(particion):
+                self.sockets.pop(particion).close()
+                self.formatos.pop(particion)
+        self.mapa = mapa
@@ -0,0 +1,269 @@
+"""
+Perfilado de los procesos en ejecucion, activado desde el socket de control
+
+Dos modos, por una duracion dada:
+    muestreo: un hilo toma cada intervalo_ms las pilas de todos los hilos
+              (sys._current_frames) y cuenta cuantas veces aparece cada una.
+              Bajo costo; el resultado es aproximado.
+    cprofile: cProfile en los hilos que atienden solicitudes. cProfile solo
+              perfila el hilo que lo activa, asi que cada hilo lo enciende y lo
+              apaga al tomar su proxima solicitud (revisar()). Al terminar se
+              espera a lo sumo ESPERA_HILOS_S a que los hilos lo apaguen; los que
+              estan ociosos quedan fuera del resultado y lo apagan cuando llegue
+              su proxima solicitud. Mide cada llamada; el proceso se vuelve
+              notablemente mas lento mientras dura.
+
+Desactivado no hay hilos extra ni hooks de perfilado: el unico costo es leer
+el atributo `activo` una vez por solicitud.
+
+Los resultados se escriben en el directorio de perfiles con el nombre del
+proceso (que incluye la sede) y su pid: <proceso>_<pid>_<fecha>.pstats/.folded y
+un resumen .txt.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import registro
+
+log = registro.obtener("perfilador")
+
+MODO_MUESTREO = "muestreo"
+MODO_CPROFILE = "cprofile"
+MODOS = (MODO_MUESTREO, MODO_CPROFILE)
+
+DURACION_MAXIMA_S = 600
+ESPERA_HILOS_S = 5
+LINEAS_RESUMEN = 40
+
+
+def _marco(codigo):
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+
+class _Sesion:
+    def __init__(self, modo, duracion_s, intervalo_ms):
+        self.modo = modo
+        self.duracion_s = duracion_s
+        self.intervalo = intervalo_ms / 1000.0
+        self.inicio = time.time()
+        self.fin = None
+        self.terminada = threading.Event()
+        self.completa = threading.Event()   # cprofile: todos los hilos apagaron su cProfile
+        self.muestras = 0
+        self.pilas = Counter()          # muestreo: "hilo;f1;f2;..." -> veces
+        self.hilos = 0                  # cprofile: hilos que encendieron cProfile
+        self.estadisticas = None        # cprofile: pstats.Stats de los hilos que ya lo apagaron
+        self.cerrada = False
+
+
+class Perfilador:
+    def __init__(self, proceso, directorio="perfiles"):
+        """
+        Args:
+            proceso: nombre del proceso, con su sede (da nombre a los archivos)
+            directorio: donde se escriben los perfiles
+        """
+        self.proceso = proceso
+        self.directorio = directorio
+        self.activo = False
+        self.ultimo = None
+        self._sesion = None
+        self._perfiles = {}             # hilo -> (sesion, cProfile.Profile encendido)
+        self._lock = threading.Lock()
+
+    def iniciar(self, modo=MODO_MUESTREO, duracion_s=30, intervalo_ms=5):
+        """Empieza una sesion de perfilado que termina sola despues de duracion_s"""
+        if modo not in MODOS:
+            return {"exito": False, "mensaje": f"Modo desconocido: {modo} (use {' o '.join(MODOS)})"}
+        if not 0 < duracion_s <= DURACION_MAXIMA_S:
+            return {"exito": False, "mensaje": f"La duracion debe estar entre 0 y {DURACION_MAXIMA_S} s"}
+
+        with self._lock:
+            if self._sesion is not None:
+                return {"exito": False, "mensaje": "Ya hay un perfilado en curso", **self._estado()}
+            sesion = self._sesion = _Sesion(modo, duracion_s, max(intervalo_ms, 1))
+            self.activo = True
+
+        hilo = threading.Thread(target=self._ejecutar, args=(sesion,), daemon=True)
+        hilo.start()
+        log.info(f" Perfilado {modo} iniciado por {duracion_s} s")
+        return {"exito": True, "mensaje": f"Perfilado {modo} iniciado por {duracion_s} s"}
+
+    def detener(self):
+        """Termina antes de tiempo la sesion en curso"""
+        with self._lock:
+            sesion = self._sesion
+        if sesion is None:
+            return {"exito": False, "mensaje": "No hay un perfilado en curso", "ultimo": self.ultimo}
+        sesion.terminada.set()
+        return {"exito": True, "mensaje": "Perfilado detenido; el resultado se escribe al cerrar la sesion"}
+
+    def estado(self):
+        with self._lock:
+            return {"exito": True, **self._estado()}
+
+    def _estado(self):
+        sesion = self._sesion
+        estado = {"en_curso": None, "ultimo": self.ultimo}
+        if sesion is not None:
+            estado["en_curso"] = {
+                "modo": sesion.modo,
+                "transcurrido_s": round(time.time() - sesion.inicio, 1),
+                "duracion_s": sesion.duracion_s,
+                "muestras": sesion.muestras,
+                "hilos_perfilados": sesion.hilos
+            }
+        return estado
+
+    def _ejecutar(self, sesion):
+        """Hilo de la sesion: toma las muestras (o solo espera) y cierra la sesion"""
+        limite = time.monotonic() + sesion.duracion_s
+        if sesion.modo == MODO_MUESTREO:
+            propio = threading.get_ident()
+            while not sesion.terminada.wait(sesion.intervalo) and time.monotonic() < limite:
+                self._muestrear(sesion, propio)
+        else:
+            sesion.terminada.wait(sesion.duracion_s)
+        with self._lock:
+            sesion.terminada.set()
+            sesion.fin = time.time()
+            if not self._pendientes(sesion):
+                sesion.completa.set()
+
+        if sesion.modo == MODO_CPROFILE:
+            # Cada hilo apaga su cProfile al tomar su proxima solicitud (revisar)
+            sesion.completa.wait(ESPERA_HILOS_S)
+        self._cerrar(sesion)
+
+    def _muestrear(self, sesion, propio):
+        nombres = {hilo.ident: hilo.name for hilo in threading.enumerate()}
+        for ident, marco in sys._current_frames().items():
+            if ident == propio:
+                continue
+            pila = []
+            while marco is not None:
+                pila.append(_marco(marco.f_code))
+                marco = marco.f_back
+            pila.append(nombres.get(ident, str(ident)))
+            sesion.pilas[";".join(reversed(pila))] += 1
+        sesion.muestras += 1
+
+    def _pendientes(self, sesion):
+        return sum(1 for propia, _ in self._perfiles.values() if propia is sesion)
+
+    def revisar(self):
+        """
+        Lo llama cada hilo que atiende solicitudes, antes de procesar una, si
+        `activo` es verdadero: enciende o apaga cProfile en ese hilo
+        """
+        hilo = threading.get_ident()
+        with self._lock:
+            sesion = self._sesion
+            actual = self._perfiles.get(hilo)
+            if actual is None:
+                if sesion is not None and sesion.modo == MODO_CPROFILE and not sesion.terminada.is_set():
+                    perfil = cProfile.Profile()
+                    self._perfiles[hilo] = (sesion, perfil)
+                    sesion.hilos += 1
+                    perfil.enable()
+                return
+
+            propia, perfil = actual
+            if propia is sesion and not sesion.terminada.is_set():
+                return
+            perfil.disable()
+            del self._perfiles[hilo]
+            self.activo = self._sesion is not None or bool(self._perfiles)
+            if propia.cerrada:
+                # Llego tarde: el resultado de esa sesion ya se escribio
+                return
+            if propia.estadisticas is None:
+                propia.estadisticas = pstats.Stats(perfil)
+            else:
+                propia.estadisticas.add(perfil)
+            if not self._pendientes(propia):
+                propia.completa.set()
+
+    def _cerrar(self, sesion):
+        with self._lock:
+            sesion.cerrada = True
+            sin_apagar = self._pendientes(sesion)
+        try:
+            self.ultimo = self._escribir(sesion, sin_apagar)
+            log.info(f" Perfil escrito en {self.ultimo['archivo']}")
+        except Exception as e:
+            log.exception(f" Error escribiendo el perfil: {e}")
+            self.ultimo = {"error": str(e)}
+        with self._lock:
+            self._sesion = None
+            self.activo = bool(self._perfiles)
+
+    def _escribir(self, sesion, sin_apagar=0):
+        os.makedirs(self.directorio, exist_ok=True)
+        base = os.path.join(self.directorio, f"{self.proceso}_{os.getpid()}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        resultado = {"modo": sesion.modo, "duracion_s": round(sesion.fin - sesion.inicio, 1)}
+
+        if sesion.modo == MODO_MUESTREO:
+            # Formato "pilas plegadas" (flamegraph.pl, speedscope) y resumen por funcion
+            archivo = f"{base}.folded"
+            with open(archivo, "w", encoding="utf-8") as f:
+                for pila, veces in sesion.pilas.most_common():
+                    f.write(f"{pila} {veces}\n")
+            with open(f"{base}.txt", "w", encoding="utf-8") as f:
+                f.write(self._resumen_muestras(sesion))
+            resultado["muestras"] = sesion.muestras
+        else:
+            archivo = f"{base}.pstats"
+            resultado["hilos"] = sesion.hilos
+            if sin_apagar:
+                # Hilos ociosos desde que termino la sesion: sus llamadas no estan en el perfil
+                resultado["hilos_sin_apagar"] = sin_apagar
+            if sesion.estadisticas is None:
+                resultado["mensaje"] = ("Ningun hilo tomo solicitudes durante el perfilado" if not sesion.hilos else
+                                        "Ningun hilo tomo otra solicitud al terminar; repita con carga")
+                open(archivo, "wb").close()
+            else:
+                sesion.estadisticas.dump_stats(archivo)
+                texto = io.StringIO()
+                sesion.estadisticas.stream = texto
+                sesion.estadisticas.sort_stats("cumulative").print_stats(LINEAS_RESUMEN)
+                with open(f"{base}.txt", "w", encoding="utf-8") as f:
+                    f.write(texto.getvalue())
+
+        resultado["archivo"] = archivo
+        return resultado
+
+    def _resumen_muestras(self, sesion):
+        propias = Counter()
+        inclusivas = Counter()
+        for pila, veces in sesion.pilas.items():
+            marcos = pila.split(";")[1:]
+            if marcos:
+                propias[marcos[-1]] += veces
+            for marco in set(marcos):
+                inclusivas[marco] += veces
+
+        total = sum(sesion.pilas.values()) or 1
+        lineas = [f"{self.proceso}: {sesion.muestras} muestras cada {sesion.intervalo * 1000:g} ms", "",
+                  "Propias (la funcion estaba ejecutando):"]
+        lineas += [f"  {veces / total * 100:6.2f}%  {marco}" for marco, veces in propias.most_common(LINEAS_RESUMEN)]
+        lineas += ["", "Inclusivas (la funcion estaba en la pila):"]
+        lineas += [f"  {veces / total * 100:6.2f}%  {marco}" for marco, veces in inclusivas.most_common(LINEAS_RESUMEN)]
+        return "\n".join(lineas) + "\n"
+
+    def registrar_comandos(self, control):
+        """Agrega perfil_iniciar, perfil_detener y perfil_estado a un ServidorControl"""
+        control.registrar("perfil_iniciar", lambda solicitud: self.iniciar(
+            solicitud.get("modo", MODO_MUESTREO),
+            float(solicitud.get("duracion_s", 30)),
+            float(solicitud.get("intervalo_ms", 5))
+        ))
+        control.registrar("perfil_detener", lambda solicitud: self.detener())
+        control.registrar("perfil_estado", lambda solicitud: self.estado())
@@ -2,7 +2,12 @@ import zmq
 import time
 import random
 import sys
-import json
+import uuid
+import argparse
+
+import codec
+import metricas
+import trazas
 
 def leer_solicitudes(nombre_archivo):
     """Lee solicitudes de un archivo txt (formato: devolucion,user1,ISBN0001)"""
@@ -24,11 +29,63 @@ def leer_solicitudes(nombre_archivo):
         print(f" El archivo {nombre_archivo} no fue encontrado.")
     return solicitudes
 
-def enviar_solicitud(solicitudes, gc_ip, nombre_ps="PS"):
-    """Envía solicitudes al Gestor de Carga"""
-    context = zmq.Context()
+def codificar_solicitud(tipo_solicitud, usuario, libro, formato, span=trazas.SPAN_INACTIVO, clave=None):
+    """
+    Mensaje para el GC: texto "tipo,usuario,libro" o binario (con hora de envío) si se negoció
+
+    Las solicitudes trazadas o con clave de idempotencia van como JSON (o binario)
+    """
+    if formato == codec.FORMATO_BINARIO or span.contexto() or clave:
+        solicitud = {"tipo": tipo_solicitud, "usuario": usuario, "libro": libro}
+        if clave:
+            solicitud["clave_idempotencia"] = clave
+        return codec.codificar(span.propagar(metricas.sellar(solicitud)), formato)
+    return f"{tipo_solicitud},{usuario},{libro}".encode("utf-8")
+
+def nueva_clave(timeout_ms):
+    """Clave de idempotencia para una solicitud: solo hace falta si se reintenta sin respuesta"""
+    return uuid.uuid4().hex if timeout_ms else None
+
+def conectar_gc(context, gc_ip):
+    """
+    Socket REQ al GC que permite reenviar sin haber recibido respuesta (reintentos
+    por timeout); una respuesta tardía a un envío anterior se descarta
+    """
     socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.REQ_RELAXED, 1)
+    socket.setsockopt(zmq.REQ_CORRELATE, 1)
     socket.connect(gc_ip)
+    return socket
+
+def solicitar(socket, mensaje, max_reintentos=5, timeout_ms=None):
+    """
+    Envía una solicitud al GC y espera la respuesta; si el GC está ocupado (control
+    de admisión) reintenta después de la espera que indica, y si no responde en
+    timeout_ms la reenvía igual (la clave de idempotencia del mensaje evita que se
+    aplique dos veces), hasta max_reintentos veces
+    
+    Returns:
+        (respuesta, reintentos)
+    """
+    for reintento in range(max_reintentos + 1):
+        socket.send(mensaje)
+        if timeout_ms and not socket.poll(timeout_ms):
+            if reintento == max_reintentos:
+                return {"exito": False, "mensaje": f"Sin respuesta del GC en {timeout_ms} ms"}, reintento
+            continue
+        respuesta, _ = codec.decodificar(socket.recv())
+        if not respuesta.get("ocupado") or reintento == max_reintentos:
+            return respuesta, reintento
+        time.sleep(respuesta.get("reintentar_ms", 100) / 1000)
+
+def enviar_solicitud(solicitudes, gc_ip, nombre_ps="PS", formato=codec.FORMATO_JSON, trazador=trazas.INACTIVO,
+                     max_reintentos=5, timeout_ms=None):
+    """Envía solicitudes al Gestor de Carga (trazando las que indique el muestreo del trazador)"""
+    context = zmq.Context()
+    socket = conectar_gc(context, gc_ip)
+    
+    # Si el GC no soporta el formato pedido se usa el texto original
+    formato = codec.negociar(socket, formato)
     
     print(f" [{nombre_ps}] Iniciando proceso de solicitudes a {gc_ip}...")
     print(f" Total de solicitudes: {len(solicitudes)}\n")
@@ -45,17 +102,16 @@ def enviar_solicitud(solicitudes, gc_ip, nombre_ps="PS"):
         
         try:
             inicio = time.time()
-            socket.send_string(mensaje)
-            
-            # Esperar respuesta del Gestor de Carga
-            respuesta_json = socket.recv_string()
+            with trazador.span(tipo_solicitud, raiz=True, codigo=libro, usuario=usuario) as span:
+                # Enviar y esperar respuesta del Gestor de Carga
+                mensaje = codificar_solicitud(tipo_solicitud, usuario, libro, formato, span, nueva_clave(timeout_ms))
+                respuesta, _ = solicitar(socket, mensaje, max_reintentos, timeout_ms)
+                span.resultado = metricas.resultado(respuesta)
             fin = time.time()
             
             tiempo_respuesta = (fin - inicio) * 1000  # ms
             tiempos.append(tiempo_respuesta)
             
-            respuesta = json.loads(respuesta_json)
-            
             if respuesta.get("exito", False):
                 print(f" {respuesta['mensaje']} (Tiempo: {tiempo_respuesta:.2f}ms)\n")
                 exitosas += 1
@@ -87,21 +143,36 @@ def enviar_solicitud(solicitudes, gc_ip, nombre_ps="PS"):
     print("="*60)
 
 if __name__ == "__main__":
-    if len(sys.argv) < 4:
-        print("Uso: python proceso_solicitante.py <archivo> <gc_ip> <gc_puerto> [nombre_ps]")
-        print("\nEjemplos:")
-        print("  Sede 1: python proceso_solicitante.py solicitudes.txt 10.43.103.177 5555 PS_Sede1")
-        print("  Sede 2: python proceso_solicitante.py solicitudes_sede2.txt 10.43.103.132 5565 PS_Sede2")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Proceso solicitante",
+        epilog="Ejemplos:\n"
+               "  Sede 1: python proceso_solicitante.py solicitudes.txt 10.43.103.177 5555 PS_Sede1\n"
+               "  Sede 2: python proceso_solicitante.py solicitudes_sede2.txt 10.43.103.132 5565 PS_Sede2",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("archivo", help="archivo de solicitudes (tipo,usuario,libro)")
+    parser.add_argument("gc_ip", help="IP del Gestor de Carga")
+    parser.add_argument("gc_puerto", help="puerto REP del Gestor de Carga")
+    parser.add_argument("nombre_ps", nargs="?", default="PS", help="nombre del proceso solicitante")
+    parser.add_argument("--formato", choices=codec.FORMATOS, default=codec.FORMATO_JSON,
+                        help="formato de los mensajes al GC (binario se negocia)")
+    parser.add_argument("--reintentos", type=int, default=5,
+                        help="reintentos de una solicitud cuando el GC responde que está ocupado o no responde")
+    parser.add_argument("--timeout-ms", type=int, default=0,
+                        help="espera por la respuesta del GC antes de reenviar la solicitud con la misma "
+                             "clave de idempotencia (0 = esperar sin límite)")
+    trazas.agregar_argumentos(parser)
+    args = parser.parse_args()
     
-    ARCHIVO_SOLICITUDES = sys.argv[1]
-    GC_IP = f"tcp://{sys.argv[2]}:{sys.argv[3]}"
-    NOMBRE_PS = sys.argv[4] if len(sys.argv) > 4 else "PS"
+    ARCHIVO_SOLICITUDES = args.archivo
+    GC_IP = f"tcp://{args.gc_ip}:{args.gc_puerto}"
+    NOMBRE_PS = args.nombre_ps
     
     solicitudes = leer_solicitudes(ARCHIVO_SOLICITUDES)
     if not solicitudes:
         print(" No hay solicitudes para procesar.")
         sys.exit(0)
 
-    enviar_solicitud(solicitudes, GC_IP, NOMBRE_PS)
+    enviar_solicitud(solicitudes, GC_IP, NOMBRE_PS, args.formato, trazas.desde_args(NOMBRE_PS, args),
+                     args.reintentos, args.timeout_ms)
     print(f"\n✅ [{NOMBRE_PS}] Todas las solicitudes han sido procesadas.")
\ No newline at end of file
@@ -1,10 +1,15 @@
 import zmq
 import time
-import sys
-import json
+import argparse
 from datetime import datetime
 
-def enviar_solicitudes_con_medicion(archivo, gc_ip, nombre_ps, duracion_segundos=120):
+import codec
+import metricas
+import trazas
+from proceso_solicitante import codificar_solicitud, conectar_gc, nueva_clave, solicitar
+
+def enviar_solicitudes_con_medicion(archivo, gc_ip, nombre_ps, duracion_segundos=120, formato=codec.FORMATO_JSON,
+                                    trazador=trazas.INACTIVO, max_reintentos=5, timeout_ms=None):
     """
     Envía solicitudes y captura métricas de rendimiento
     
@@ -13,6 +18,10 @@ def enviar_solicitudes_con_medicion(archivo, gc_ip, nombre_ps, duracion_segundos
         gc_ip: IP del gestor de carga (tcp://IP:puerto)
         nombre_ps: nombre del proceso solicitante
         duracion_segundos: duración máxima de la prueba (default 120s = 2min)
+        formato: formato de los mensajes al GC (binario se negocia)
+        trazador: Trazador; las solicitudes trazadas escriben sus spans (PS -> GC -> ...)
+        max_reintentos: reintentos de una solicitud cuando el GC responde que está ocupado o no responde
+        timeout_ms: espera por la respuesta antes de reenviar con la misma clave de idempotencia
     """
     
     # Leer solicitudes
@@ -35,19 +44,21 @@ def enviar_solicitudes_con_medicion(archivo, gc_ip, nombre_ps, duracion_segundos
     
     # Conectar a GC
     context = zmq.Context()
-    socket = context.socket(zmq.REQ)
-    socket.connect(gc_ip)
+    socket = conectar_gc(context, gc_ip)
+    formato = codec.negociar(socket, formato)
     
     print(f" [{nombre_ps}] Iniciando medición")
     print(f" Solicitudes disponibles: {len(solicitudes)}")
     print(f"  Duración: {duracion_segundos}s")
-    print(f" Destino: {gc_ip}\n")
+    print(f" Destino: {gc_ip}")
+    print(f" Formato: {formato}\n")
     
     # Métricas
     tiempos_respuesta = []
     solicitudes_exitosas = 0
     solicitudes_fallidas = 0
     solicitudes_enviadas = 0
+    reintentos_ocupado = 0
     
     # Control de tiempo
     tiempo_inicio = time.time()
@@ -60,22 +71,23 @@ def enviar_solicitudes_con_medicion(archivo, gc_ip, nombre_ps, duracion_segundos
             print(f" [{nombre_ps}] Tiempo límite alcanzado ({duracion_segundos}s)")
             break
         
-        mensaje = f"{tipo},{usuario},{libro}"
+        span = trazador.span(tipo, raiz=True, codigo=libro, usuario=usuario)
+        mensaje = codificar_solicitud(tipo, usuario, libro, formato, span, nueva_clave(timeout_ms))
         
         try:
             # Medir tiempo de respuesta
-            inicio = time.time()
-            socket.send_string(mensaje)
-            respuesta_json = socket.recv_string()
-            fin = time.time()
+            # (incluye los reintentos si el GC está ocupado o no responde)
+            with span:
+                inicio = time.time()
+                respuesta, reintentos = solicitar(socket, mensaje, max_reintentos, timeout_ms)
+                fin = time.time()
+                span.resultado = metricas.resultado(respuesta)
+            reintentos_ocupado += reintentos
             
             tiempo_ms = (fin - inicio) * 1000
             tiempos_respuesta.append(tiempo_ms)
             solicitudes_enviadas += 1
             
-            # Parsear respuesta
-            respuesta = json.loads(respuesta_json)
-            
             if respuesta.get("exito", False):
                 solicitudes_exitosas += 1
                 print(f"[{solicitudes_enviadas}]  {tiempo_ms:.2f}ms | {libro}")
@@ -116,6 +128,7 @@ def enviar_solicitudes_con_medicion(archivo, gc_ip, nombre_ps, duracion_segundos
         print(f" Solicitudes enviadas: {solicitudes_enviadas}")
         print(f" Exitosas: {solicitudes_exitosas}")
         print(f" Fallidas: {solicitudes_fallidas}")
+        print(f" Reintentos por GC ocupado o sin respuesta: {reintentos_ocupado}")
         print(f"\n MÉTRICAS DE RENDIMIENTO:")
         print(f"   Tiempo promedio de respuesta: {promedio:.2f} ms")
         print(f"   Desviación estándar: {desv_std:.2f} ms")
@@ -135,6 +148,7 @@ def enviar_solicitudes_con_medicion(archivo, gc_ip, nombre_ps, duracion_segundos
             f.write(f"SOLICITUDES_ENVIADAS={solicitudes_enviadas}\n")
             f.write(f"SOLICITUDES_EXITOSAS={solicitudes_exitosas}\n")
             f.write(f"SOLICITUDES_FALLIDAS={solicitudes_fallidas}\n")
+            f.write(f"REINTENTOS_OCUPADO={reintentos_ocupado}\n")
             f.write(f"TIEMPO_PROMEDIO={promedio:.2f}\n")
             f.write(f"DESVIACION_ESTANDAR={desv_std:.2f}\n")
             f.write(f"TIEMPO_MINIMO={minimo:.2f}\n")
@@ -147,16 +161,29 @@ def enviar_solicitudes_con_medicion(archivo, gc_ip, nombre_ps, duracion_segundos
         print(" No se obtuvieron tiempos de respuesta")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 4:
-        print("Uso: python proceso_solicitante_medicion.py <archivo> <gc_ip> <gc_puerto> <nombre_ps> [duracion_s]")
-        print("\nEjemplos:")
-        print("  python proceso_solicitante_medicion.py prestamos_ps1.txt 10.43.103.177 5555 PS1_Sede1")
-        print("  python proceso_solicitante_medicion.py prestamos_ps2.txt 10.43.103.177 5555 PS2_Sede1 120")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Proceso solicitante con medición de rendimiento",
+        epilog="Ejemplos:\n"
+               "  python proceso_solicitante_medicion.py prestamos_ps1.txt 10.43.103.177 5555 PS1_Sede1\n"
+               "  python proceso_solicitante_medicion.py prestamos_ps2.txt 10.43.103.177 5555 PS2_Sede1 120",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("archivo", help="archivo de solicitudes (tipo,usuario,libro)")
+    parser.add_argument("gc_ip", help="IP del Gestor de Carga")
+    parser.add_argument("gc_puerto", help="puerto REP del Gestor de Carga")
+    parser.add_argument("nombre_ps", nargs="?", default="PS", help="nombre del proceso solicitante")
+    parser.add_argument("duracion", nargs="?", type=int, default=120, help="duración máxima en segundos")
+    parser.add_argument("--formato", choices=codec.FORMATOS, default=codec.FORMATO_JSON,
+                        help="formato de los mensajes al GC (binario se negocia)")
+    parser.add_argument("--reintentos", type=int, default=5,
+                        help="reintentos de una solicitud cuando el GC responde que está ocupado o no responde")
+    parser.add_argument("--timeout-ms", type=int, default=0,
+                        help="espera por la respuesta del GC antes de reenviar la solicitud con la misma "
+                             "clave de idempotencia (0 = esperar sin límite)")
+    trazas.agregar_argumentos(parser)
+    args = parser.parse_args()
     
-    archivo = sys.argv[1]
-    gc_ip = f"tcp://{sys.argv[2]}:{sys.argv[3]}"
-    nombre_ps = sys.argv[4] if len(sys.argv) > 4 else "PS"
-    duracion = int(sys.argv[5]) if len(sys.argv) > 5 else 120
+    gc_ip = f"tcp://{args.gc_ip}:{args.gc_puerto}"
     
-    enviar_solicitudes_con_medicion(archivo, gc_ip, nombre_ps, duracion)
\ No newline at end of file
+    enviar_solicitudes_con_medicion(args.archivo, gc_ip, args.nombre_ps, args.duracion, args.formato,
+                                    trazas.desde_args(args.nombre_ps, args), args.reintentos, args.timeout_ms)
\ No newline at end of file
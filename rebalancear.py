@@ -0,0 +1,180 @@
+"""
+Rebalanceo del catalogo entre particiones (con los GA detenidos)
+
+Agrega una particion al mapa y mueve a ella los libros (con sus prestamos) que
+ahora le pertenecen; con hashing consistente solo se mueven esos codigos. Con
+--dividir reparte una BD sin particionar entre las particiones del mapa.
+
+Cada bloque de codigos se borra primero del destino, se copia y se confirma, y
+recien entonces se borra del origen: si el proceso se interrumpe basta con
+volver a ejecutarlo. El mapa nuevo se guarda al final, cuando los datos ya
+estan en su particion.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+
+from carga_masiva import crear_tablas
+from esquema_bd import migrar
+from particiones import MapaParticiones
+
+CODIGOS_POR_BLOQUE = 500
+
+_LIBROS = "SELECT codigo, titulo, autor, ejemplares_totales, ejemplares_disponibles FROM libros"
+_PRESTAMOS = "SELECT codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones FROM prestamos"
+
+
+def abrir_particion(db_file):
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA journal_mode=WAL")
+    crear_tablas(conn)
+    migrar(conn)
+    return conn
+
+
+def codigos_a_mover(conn, mapa, particion_origen=None):
+    """
+    Codigos de la BD que pertenecen a otra particion segun el mapa
+
+    Returns:
+        dict particion destino -> lista de codigos
+    """
+    destinos = defaultdict(list)
+    for (codigo,) in conn.execute("SELECT codigo FROM libros ORDER BY codigo"):
+        dueno = mapa.particion(codigo)
+        if dueno != particion_origen:
+            destinos[dueno].append(codigo)
+    return destinos
+
+
+def mover_bloque(origen, destino, codigos, borrar_origen=True):
+    """Copia libros y prestamos de los codigos al destino y los borra del origen"""
+    marcas = ",".join("?" * len(codigos))
+    libros = origen.execute(f"{_LIBROS} WHERE codigo IN ({marcas})", codigos).fetchall()
+    prestamos = origen.execute(f"{_PRESTAMOS} WHERE codigo IN ({marcas})", codigos).fetchall()
+
+    # Se borra antes de copiar para que reintentar un bloque no duplique prestamos
+    destino.execute(f"DELETE FROM prestamos WHERE codigo IN ({marcas})", codigos)
+    destino.execute(f"DELETE FROM libros WHERE codigo IN ({marcas})", codigos)
+    destino.executemany(
+        "INSERT INTO libros (codigo, titulo, autor, ejemplares_totales, ejemplares_disponibles) "
+        "VALUES (?, ?, ?, ?, ?)", libros)
+    destino.executemany(
+        "INSERT INTO prestamos (codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones) "
+        "VALUES (?, ?, ?, ?, ?)", prestamos)
+    destino.commit()
+
+    if borrar_origen:
+        origen.execute(f"DELETE FROM prestamos WHERE codigo IN ({marcas})", codigos)
+        origen.execute(f"DELETE FROM libros WHERE codigo IN ({marcas})", codigos)
+        origen.commit()
+
+    return len(libros), len(prestamos)
+
+
+def mover(db_origen, sede, mapa, particion_origen=None, borrar_origen=True, simular=False):
+    """
+    Mueve a su particion los codigos de db_origen que no le pertenecen
+
+    Returns:
+        dict particion destino -> (libros, prestamos) movidos (o codigos, si se simula)
+    """
+    origen = sqlite3.connect(db_origen)
+    resultado = {}
+
+    try:
+        for particion, codigos in sorted(codigos_a_mover(origen, mapa, particion_origen).items()):
+            if simular:
+                resultado[particion] = len(codigos)
+                continue
+
+            destino = abrir_particion(mapa.db_file(sede, particion))
+            libros = prestamos = 0
+            try:
+                for inicio in range(0, len(codigos), CODIGOS_POR_BLOQUE):
+                    movidos = mover_bloque(origen, destino, codigos[inicio:inicio + CODIGOS_POR_BLOQUE],
+                                           borrar_origen)
+                    libros += movidos[0]
+                    prestamos += movidos[1]
+            finally:
+                destino.close()
+            resultado[particion] = (libros, prestamos)
+    finally:
+        origen.close()
+
+    return resultado
+
+
+def rebalancear(sede, mapa, mapa_nuevo, simular=False):
+    """Mueve entre particiones los codigos que cambian de dueno al pasar de mapa a mapa_nuevo"""
+    movimientos = {}
+    for particion in mapa.particiones:
+        db_file = mapa.db_file(sede, particion)
+        if not os.path.exists(db_file):
+            print(f" {db_file} no existe, se omite")
+            continue
+        movimientos[particion] = mover(db_file, sede, mapa_nuevo, particion, simular=simular)
+    return movimientos
+
+
+def mostrar(movimientos, simular):
+    for origen, destinos in movimientos.items():
+        if not destinos:
+            print(f"   {origen}: sin cambios")
+        for destino, cantidad in destinos.items():
+            if simular:
+                print(f"   {origen} -> {destino}: {cantidad} libros")
+            else:
+                print(f"   {origen} -> {destino}: {cantidad[0]} libros, {cantidad[1]} prestamos")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebalanceo del catalogo entre particiones (con los GA detenidos)",
+        epilog="Ejemplos:\n"
+               "  python rebalancear.py 1 particiones_sede1.json --dividir bd_sede1.db\n"
+               "  python rebalancear.py 1 particiones_sede1.json --agregar p3 "
+               "--ga tcp://10.43.103.177:5582 --replica tcp://10.43.103.132:5583",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("sede", type=int, help="numero de sede (1 o 2)")
+    parser.add_argument("mapa", help="archivo JSON del mapa de particiones")
+    parser.add_argument("--dividir", default=None, metavar="BD",
+                        help="repartir una BD sin particionar entre las particiones del mapa (no la modifica)")
+    parser.add_argument("--agregar", default=None, metavar="PARTICION", help="particion nueva")
+    parser.add_argument("--ga", default=None, help="endpoint REP del GA de la particion nueva")
+    parser.add_argument("--replica", default=None, help="endpoint PULL de la replica de la particion nueva")
+    parser.add_argument("--simular", action="store_true", help="solo contar los libros que se moverian")
+    args = parser.parse_args()
+
+    if bool(args.dividir) == bool(args.agregar):
+        parser.error("indicar --dividir o --agregar")
+    if args.agregar and not args.ga:
+        parser.error("--agregar requiere --ga")
+
+    mapa = MapaParticiones.cargar(args.mapa)
+    inicio = time.perf_counter()
+
+    try:
+        if args.dividir:
+            print(f" Repartiendo {args.dividir} en {len(mapa.particiones)} particiones...")
+            movimientos = {args.dividir: mover(args.dividir, args.sede, mapa, borrar_origen=False,
+                                               simular=args.simular)}
+        else:
+            mapa_nuevo = mapa.con_particion(args.agregar, args.ga, args.replica)
+            print(f" Agregando la particion {args.agregar} (mapa version {mapa_nuevo.version})...")
+            movimientos = rebalancear(args.sede, mapa, mapa_nuevo, simular=args.simular)
+            if not args.simular:
+                mapa_nuevo.guardar()
+    except (ValueError, sqlite3.Error) as e:
+        print(f" Error rebalanceando: {e}")
+        sys.exit(1)
+
+    mostrar(movimientos, args.simular)
+    print(f" Listo en {time.perf_counter() - inicio:.1f} s")
+    if not args.simular:
+        print(" Reiniciar los GA con el mapa nuevo y reinicializar sus replicas: "
+              "python receptor_replica.py <sede> --mapa <mapa> --particion <particion> --snapshot")
@@ -1,40 +1,146 @@
 import zmq
-import json
 import sqlite3
-import sys
 import os
+import time
+import hashlib
+import argparse
+from itertools import groupby
+
+from conexion_bd import GestorConexiones, MODO_PERSISTENTE, es_ocupada
+from emisor_replicacion import CAMPO_PRIMARIA
+from esquema_bd import migrar
+from antientropia import IndiceMerkle, reparar_bucket
+from particiones import MapaParticiones, puerto
+import codec
+import registro
+import metricas
+import control
+import trazas
+from metricas import Metricas
+from control import ServidorControl
+from perfilador import Perfilador
+
+log = registro.obtener("replica")
+log_solicitudes = registro.solicitudes("replica")
 
 class ReceptorReplica:
-    def __init__(self, sede, puerto_pull="5559"):
+    def __init__(self, sede, puerto_pull="5559", ga_endpoint=None, intervalo_ms=2000,
+                 espera_hueco_ms=500, ack_cada=100, limite_recuperacion=500, max_transaccion=1000,
+                 snapshot_inicial=False, intervalo_antientropia_s=300, puerto_lectura=None, particion=None,
+                 puerto_control=None, dir_perfiles="perfiles", trazador=None):
         """
         Receptor que actualiza la réplica secundaria de forma asíncrona
         
+        Las operaciones llegan numeradas desde el log de replicación del GA primario.
+        Se aplican en orden de secuencia; los duplicados se descartan y los huecos se
+        piden al GA (replicacion_pendiente). La última secuencia aplicada se guarda en
+        la misma transacción que la operación y se confirma al GA (ack_replicacion).
+        
+        Las operaciones consecutivas disponibles (un lote del GA, varios mensajes ya
+        recibidos o una recuperación) se aplican en una sola transacción, con
+        executemany sobre una conexión persistente.
+        
+        Si la réplica está vacía, o el log del GA ya no tiene lo que falta, se
+        descarga un snapshot de la primaria y se continúa desde su secuencia.
+        
         Args:
             sede: número de sede (1 o 2)
             puerto_pull: puerto para recibir actualizaciones (PULL)
+            ga_endpoint: endpoint REP del GA primario para pedir operaciones perdidas
+                         (None = sin recuperación, solo el flujo PUSH/PULL)
+            intervalo_ms: sin mensajes durante este tiempo se consulta al GA por operaciones perdidas
+            espera_hueco_ms: tiempo que se espera a que un hueco se llene solo antes de pedirlo al GA
+            ack_cada: operaciones aplicadas entre confirmaciones al GA
+            limite_recuperacion: operaciones por solicitud de recuperación
+            max_transaccion: operaciones máximas aplicadas en una transacción
+            snapshot_inicial: reemplazar la BD réplica por un snapshot de la primaria al arrancar
+            intervalo_antientropia_s: cada cuánto comparar el árbol Merkle con el GA (0 = nunca)
+            puerto_lectura: puerto REP para consultas de solo lectura sobre la réplica (None = sin endpoint)
+            particion: partición del catálogo que replica (None = catálogo completo)
+            puerto_control: puerto REP de control con los comandos stats y replicacion (None = sin control)
+            dir_perfiles: directorio de los perfiles que se piden por el socket de control
+            trazador: Trazador; registra la aplicación de las operaciones trazadas y las lecturas
         """
         self.sede = sede
-        self.db_file = f"bd_sede{sede}_replica.db"
+        self.particion = particion
+        self.db_file = f"bd_sede{sede}_{particion}_replica.db" if particion else f"bd_sede{sede}_replica.db"
+        self.ga_endpoint = ga_endpoint
+        self.intervalo_ms = intervalo_ms
+        self.espera_hueco = espera_hueco_ms / 1000.0
+        self.ack_cada = ack_cada
+        self.limite_recuperacion = limite_recuperacion
+        self.max_transaccion = max_transaccion
+        self.snapshot_inicial = snapshot_inicial
+        self.intervalo_antientropia = intervalo_antientropia_s
+        
+        # Árbol Merkle de la réplica, con los límites de buckets que define la primaria
+        self.merkle = IndiceMerkle()
+        self.limites_primaria = None
+        self.proxima_antientropia = time.monotonic() + intervalo_antientropia_s
+        self.conexiones = GestorConexiones(self.db_file, modo=MODO_PERSISTENTE)
+        
+        # Operaciones recibidas que aun no se pueden aplicar en orden: secuencia -> operacion
+        self.fuera_de_orden = {}
+        self.hueco_desde = None
+        self.sin_confirmar = 0
+        
+        # Contadores de aplicación
+        self.mensajes = 0
+        self.transacciones = 0
+        self.aplicadas = 0
+        self.mayor_transaccion = 0
+        self.tiempo_aplicacion = 0.0
+        self.mayor_tiempo = 0.0
+        self.mayor_secuencia = 0
+        
+        # Momento hasta el que se sabe que la réplica tenía todo lo confirmado en la primaria: la hora
+        # de la primaria del último cambio aplicado, o la de una consulta al GA que la encontró al día
+        self.al_dia = None
+        
+        # Hora de envío (t_envio) del mensaje más antiguo recibido y aún no aplicado
+        self.primer_envio = None
         
         self.context = zmq.Context()
         
+        # Latencias de aplicación y de lecturas; se consultan por el socket de control
+        self.metricas = Metricas(f"replica_sede{sede}" + (f"_{particion}" if particion else ""))
+        self.perfilador = Perfilador(self.metricas.proceso, dir_perfiles)
+        self.trazas = trazador or trazas.INACTIVO
+        self.control = None
+        if puerto_control:
+            self.control = ServidorControl(self.context, puerto_control, self.metricas, self.perfilador)
+            self.control.registrar("replicacion", lambda solicitud: {
+                "exito": True, **self.estadisticas(), **self.frescura()
+            })
+        self.socket_ga = None
+        
         # Socket PULL: recibe actualizaciones de la sede primaria
         self.socket_pull = self.context.socket(zmq.PULL)
         self.socket_pull.bind(f"tcp://*:{puerto_pull}")
         
-        print(f"- Receptor de Réplica Sede {sede} iniciado")
-        print(f"- PULL: puerto {puerto_pull}")
-        print(f"- BD Réplica SQLite: {self.db_file}")
-        print(f"   Recibiendo operaciones de Sede {3-sede}\n")  # 3-1=2, 3-2=1
+        # Socket REP opcional: consultas de solo lectura (disponibilidad, préstamos, salud)
+        self.socket_lectura = None
+        if puerto_lectura:
+            self.socket_lectura = self.context.socket(zmq.REP)
+            self.socket_lectura.bind(f"tcp://*:{puerto_lectura}")
+        
+        log.info(f"- Receptor de Réplica Sede {sede} iniciado" + (f" (partición {particion})" if particion else ""))
+        log.info(f"- PULL: puerto {puerto_pull}")
+        if puerto_lectura:
+            log.info(f"- REP lecturas: puerto {puerto_lectura}")
+        log.info(f"- BD Réplica SQLite: {self.db_file}")
+        log.info(f"   Recibiendo operaciones de Sede {3-sede}")  # 3-1=2, 3-2=1
+        if ga_endpoint:
+            log.info(f"- Recuperación de operaciones perdidas desde GA {ga_endpoint}")
         
         # Inicializar BD réplica si no existe
         self.inicializar_bd_replica()
+        self.ultima_secuencia = self.leer_secuencia()
+        log.info(f" Última secuencia aplicada: {self.ultima_secuencia}")
     
     def get_connection(self):
-        """Crea una conexión a la BD réplica"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Conexión persistente a la BD réplica (WAL)"""
+        return self.conexiones.obtener()
     
     def inicializar_bd_replica(self):
         """Crea las tablas de la réplica si no existen"""
@@ -69,169 +175,746 @@ class ReceptorReplica:
         count = cursor.fetchone()[0]
         
         if count > 0:
-            print(f" BD réplica cargada: {count} libros")
+            log.info(f" BD réplica cargada: {count} libros")
+        elif self.ga_endpoint:
+            log.info("  BD réplica vacía. Se cargará un snapshot de la BD primaria.")
         else:
-            print("  BD réplica vacía. Se sincronizará con las operaciones.")
+            log.info("  BD réplica vacía. Se sincronizará con las operaciones.")
+        self.libros_en_replica = count
         
         conn.commit()
-        conn.close()
+        
+        # Mismos índices que la BD primaria (actualiza réplicas existentes en sitio)
+        for version, descripcion in migrar(conn):
+            log.info(f" Migración de esquema {version} aplicada: {descripcion}")
+    
+    def leer_secuencia(self):
+        """Última secuencia del log del GA aplicada en la réplica"""
+        conn = self.get_connection()
+        fila = conn.execute("SELECT valor FROM replicacion_estado WHERE clave = 'aplicada'").fetchone()
+        return fila[0] if fila else 0
+    
+    def aplicar_prestamos(self, cursor, operaciones):
+        """Aplica préstamos consecutivos en la transacción abierta de la réplica"""
+        cursor.executemany(
+            "INSERT INTO prestamos (codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones) VALUES (?, ?, ?, ?, 0)",
+            [(op["codigo"], op["usuario"], op["fecha_prestamo"], op["fecha_devolucion"]) for op in operaciones]
+        )
+        
+        # Reducir disponibilidad
+        cursor.executemany(
+            "UPDATE libros SET ejemplares_disponibles = ejemplares_disponibles - 1 WHERE codigo = ?",
+            [(op["codigo"],) for op in operaciones]
+        )
+    
+    def aplicar_devoluciones(self, cursor, operaciones):
+        """Aplica devoluciones consecutivas en la transacción abierta de la réplica"""
+        cursor.executemany(
+            "DELETE FROM prestamos WHERE codigo = ? AND usuario = ?",
+            [(op["codigo"], op["usuario"]) for op in operaciones]
+        )
+        
+        # Aumentar disponibilidad
+        cursor.executemany(
+            "UPDATE libros SET ejemplares_disponibles = ejemplares_disponibles + 1 WHERE codigo = ?",
+            [(op["codigo"],) for op in operaciones]
+        )
     
-    def aplicar_prestamo(self, operacion):
-        """Aplica un préstamo en la réplica"""
+    def aplicar_renovaciones(self, cursor, operaciones):
+        """Aplica renovaciones consecutivas en la transacción abierta de la réplica"""
+        cursor.executemany(
+            "UPDATE prestamos SET fecha_devolucion = ?, renovaciones = ? WHERE codigo = ? AND usuario = ?",
+            [(op["nueva_fecha"], op["renovaciones"], op["codigo"], op["usuario"]) for op in operaciones]
+        )
+    
+    def aplicar_tramos(self, cursor, operaciones):
+        """
+        Aplica las operaciones en orden, agrupando las consecutivas del mismo tipo
+        
+        Dentro de un tramo del mismo tipo las sentencias conmutan, así que cada
+        sentencia se ejecuta una vez con executemany sobre todo el tramo.
+        """
+        aplicadores = {
+            "prestamo": self.aplicar_prestamos,
+            "devolucion": self.aplicar_devoluciones,
+            "renovacion": self.aplicar_renovaciones
+        }
+        
+        for tipo, tramo in groupby(operaciones, key=lambda op: op.get("tipo")):
+            if tipo in aplicadores:
+                aplicadores[tipo](cursor, list(tramo))
+            else:
+                log.warning(f" Operación desconocida: {tipo}")
+    
+    def aplicar_individual(self, cursor, operaciones):
+        """Aplica cada operación en su SAVEPOINT; las que fallan se descartan (como antes)"""
+        for operacion in operaciones:
+            cursor.execute("SAVEPOINT operacion")
+            try:
+                self.aplicar_tramos(cursor, [operacion])
+            except Exception as e:
+                if es_ocupada(e):
+                    raise
+                cursor.execute("ROLLBACK TO operacion")
+                log.error(f" Error replicando {operacion.get('tipo')} (secuencia {operacion.get('secuencia', 'N/A')}): {e}")
+            cursor.execute("RELEASE operacion")
+    
+    def aplicar_operaciones(self, operaciones):
+        """
+        Aplica operaciones en una sola transacción junto con la última secuencia
+        
+        Solo se reintenta el lote completo si la BD esta ocupada (SQLITE_BUSY/LOCKED);
+        cualquier otro error de una operacion pasa a la aplicacion una por una, que
+        descarta solo las que fallan.
+        
+        Returns:
+            False si hay que reintentarlas; la secuencia no avanza
+        """
+        inicio = time.perf_counter()
+        inicio_reloj = time.time()
         conn = self.get_connection()
         cursor = conn.cursor()
+        secuencias = [op["secuencia"] for op in operaciones if op.get("secuencia") is not None]
         
         try:
-            codigo = operacion["codigo"]
-            usuario = operacion["usuario"]
-            fecha_prestamo = operacion["fecha_prestamo"]
-            fecha_devolucion = operacion["fecha_devolucion"]
-            
-            # Verificar si el libro existe en la réplica
-            cursor.execute("SELECT * FROM libros WHERE codigo = ?", (codigo,))
-            libro = cursor.fetchone()
-            
-            if not libro:
-                print(f"  Libro {codigo} no existe en réplica, saltando operación")
-                conn.close()
-                return
+            cursor.execute("BEGIN")
+            try:
+                self.aplicar_tramos(cursor, operaciones)
+            except Exception as e:
+                if es_ocupada(e):
+                    raise
+                # Alguna operación no se puede aplicar: se reintenta una por una
+                conn.rollback()
+                log.warning(f" Error aplicando lote, se aplica operación por operación: {e}")
+                cursor.execute("BEGIN")
+                self.aplicar_individual(cursor, operaciones)
             
-            # Insertar préstamo
-            cursor.execute(
-                "INSERT INTO prestamos (codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones) VALUES (?, ?, ?, ?, ?)",
-                (codigo, usuario, fecha_prestamo, fecha_devolucion, 0)
-            )
+            if secuencias:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO replicacion_estado (clave, valor) VALUES ('aplicada', ?)",
+                    (secuencias[-1],)
+                )
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            if es_ocupada(e):
+                log.warning(f" BD réplica ocupada, se reintentarán {len(operaciones)} operaciones: {e}")
+            else:
+                # Fuera de las operaciones (BEGIN, secuencia, COMMIT): sin confirmar no se puede avanzar
+                log.error(f" Error confirmando {len(operaciones)} operaciones en la réplica, se reintentarán: {e}")
+            self.metricas.registrar("aplicar", "reintento", time.perf_counter() - inicio)
+            return False
+        
+        duracion = time.perf_counter() - inicio
+        # Espera: desde que la primaria envió el mensaje más antiguo hasta que empezó su transacción
+        espera = None
+        if self.primer_envio is not None:
+            espera = max(time.time() - duracion - self.primer_envio, 0.0)
+            self.primer_envio = None
+        self.metricas.registrar("aplicar", "ok", duracion, espera)
+        for op in operaciones:
+            if trazas.CAMPO_TRAZA in op:
+                self.trazas.registrar("aplicar", op[trazas.CAMPO_TRAZA], inicio_reloj, duracion, "ok",
+                                      secuencia=op.get("secuencia"), operaciones=len(operaciones))
+        self.transacciones += 1
+        self.aplicadas += len(operaciones)
+        self.mayor_transaccion = max(self.mayor_transaccion, len(operaciones))
+        self.tiempo_aplicacion += duracion
+        self.mayor_tiempo = max(self.mayor_tiempo, duracion)
+        
+        if secuencias:
+            self.ultima_secuencia = secuencias[-1]
+            self.sin_confirmar += len(secuencias)
+            # Con todo hasta esta secuencia aplicado, la réplica tiene lo que la primaria confirmó hasta su hora
+            primaria = operaciones[-1].get(CAMPO_PRIMARIA)
+            if primaria is not None and (self.al_dia is None or primaria > self.al_dia):
+                self.al_dia = primaria
+            log_solicitudes.debug(" REPLICADO: %d operaciones (secuencias %d..%d) en %.1f ms",
+                                  len(operaciones), secuencias[0], secuencias[-1], duracion * 1000)
+        else:
+            log_solicitudes.debug(" REPLICADO: %d operaciones sin secuencia en %.1f ms",
+                                  len(operaciones), duracion * 1000)
+        return True
+    
+    def recibir_operacion(self, operacion):
+        """Guarda una operación del flujo para aplicarla en orden de secuencia"""
+        secuencia = operacion.get("secuencia")
+        
+        if secuencia is None:
+            # GA sin log de replicación: se aplica tal cual llega
+            self.aplicar_operaciones([operacion])
+            return
+        
+        self.mayor_secuencia = max(self.mayor_secuencia, secuencia)
+        
+        if secuencia <= self.ultima_secuencia:
+            log_solicitudes.debug(" Operación %d ya aplicada, se descarta", secuencia)
+            return
+        
+        self.fuera_de_orden[secuencia] = operacion
+    
+    def recibir_mensaje(self, mensaje):
+        """Decodifica un mensaje del GA: una operación o un lote de operaciones"""
+        contenido, _ = codec.decodificar(mensaje)
+        self.mensajes += 1
+        
+        enviado = contenido.get(metricas.CAMPO_ENVIO)
+        if enviado is not None and self.primer_envio is None:
+            self.primer_envio = enviado
+        
+        if contenido.get("tipo") == "lote":
+            for operacion in contenido["operaciones"]:
+                self.recibir_operacion(operacion)
+        else:
+            self.recibir_operacion(contenido)
+    
+    def aplicar_en_orden(self):
+        """Aplica, en transacciones de hasta max_transaccion, las operaciones consecutivas a la última aplicada"""
+        for secuencia in [s for s in self.fuera_de_orden if s <= self.ultima_secuencia]:
+            del self.fuera_de_orden[secuencia]
+        
+        while self.ultima_secuencia + 1 in self.fuera_de_orden:
+            siguiente = self.ultima_secuencia + 1
+            operaciones = []
+            while siguiente in self.fuera_de_orden and len(operaciones) < self.max_transaccion:
+                operaciones.append(self.fuera_de_orden[siguiente])
+                siguiente += 1
             
-            # Reducir disponibilidad
-            cursor.execute(
-                "UPDATE libros SET ejemplares_disponibles = ejemplares_disponibles - 1 WHERE codigo = ?",
-                (codigo,)
-            )
+            if not self.aplicar_operaciones(operaciones):
+                break
             
-            conn.commit()
-            print(f" REPLICADO: Préstamo de {codigo} a {usuario}")
+            for operacion in operaciones:
+                del self.fuera_de_orden[operacion["secuencia"]]
         
-        except Exception as e:
-            conn.rollback()
-            print(f" Error replicando préstamo: {e}")
-        finally:
-            conn.close()
+        if self.fuera_de_orden:
+            if self.hueco_desde is None:
+                self.hueco_desde = time.monotonic()
+                log.info(f" Hueco: se esperaba {self.ultima_secuencia + 1}, "
+                         f"hay {len(self.fuera_de_orden)} operaciones posteriores en espera")
+        else:
+            self.hueco_desde = None
     
-    def aplicar_devolucion(self, operacion):
-        """Aplica una devolución en la réplica"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def estadisticas(self):
+        return {
+            "mensajes": self.mensajes,
+            "transacciones": self.transacciones,
+            "aplicadas": self.aplicadas,
+            "promedio_transaccion": (self.aplicadas / self.transacciones) if self.transacciones else 0,
+            "mayor_transaccion": self.mayor_transaccion,
+            "tiempo_promedio_ms": (self.tiempo_aplicacion / self.transacciones * 1000) if self.transacciones else 0,
+            "mayor_tiempo_ms": self.mayor_tiempo * 1000,
+            "ultima_secuencia": self.ultima_secuencia,
+            "en_espera": len(self.fuera_de_orden),
+            "atraso": max(self.mayor_secuencia - self.ultima_secuencia, 0)
+        }
+    
+    def mostrar_estadisticas(self):
+        e = self.estadisticas()
+        log.info(f" Estadísticas: {e['mensajes']} mensajes, {e['aplicadas']} operaciones en {e['transacciones']} transacciones "
+                 f"(promedio {e['promedio_transaccion']:.1f}, mayor {e['mayor_transaccion']}), "
+                 f"aplicación {e['tiempo_promedio_ms']:.2f} ms promedio / {e['mayor_tiempo_ms']:.2f} ms máx, "
+                 f"secuencia {e['ultima_secuencia']}, atraso {e['atraso']}, en espera {e['en_espera']}")
+    
+    def solicitar_ga(self, solicitud, timeout_ms=3000):
+        """
+        Envía una solicitud al GA primario
         
-        try:
-            codigo = operacion["codigo"]
-            usuario = operacion["usuario"]
+        Returns:
+            la respuesta, o None si el GA no respondió (el socket REQ se recrea)
+        """
+        if self.socket_ga is None:
+            self.socket_ga = self.context.socket(zmq.REQ)
+            self.socket_ga.setsockopt(zmq.LINGER, 0)
+            self.socket_ga.connect(self.ga_endpoint)
+        
+        self.socket_ga.send(codec.codificar(solicitud))
+        if self.socket_ga.poll(timeout_ms):
+            partes = self.socket_ga.recv_multipart()
+            respuesta, _ = codec.decodificar(partes[0])
+            if len(partes) > 1:
+                # Bloque de snapshot: bytes sin codificar en el segundo frame
+                respuesta["datos"] = partes[1]
+            return respuesta
+        
+        # REQ queda bloqueado esperando la respuesta: se descarta y se reconecta
+        self.socket_ga.close()
+        self.socket_ga = None
+        return None
+    
+    def recuperar(self):
+        """Pide al GA las operaciones posteriores a la última aplicada y las aplica en orden"""
+        if not self.ga_endpoint:
+            return
+        
+        while True:
+            consultado = time.time()
+            respuesta = self.solicitar_ga({
+                "operacion": "replicacion_pendiente",
+                "desde": self.ultima_secuencia,
+                "limite": self.limite_recuperacion
+            })
             
-            # Verificar si el libro existe
-            cursor.execute("SELECT * FROM libros WHERE codigo = ?", (codigo,))
-            libro = cursor.fetchone()
+            if respuesta is None:
+                log.warning(f" GA {self.ga_endpoint} no responde, se reintentará la recuperación")
+                return
             
-            if not libro:
-                print(f"  Libro {codigo} no existe en réplica, saltando operación")
-                conn.close()
+            if not respuesta.get("exito"):
+                log.warning(f" No se pudo recuperar: {respuesta.get('mensaje')}")
+                if respuesta.get("requiere_resincronizacion"):
+                    log.info("   La réplica necesita una copia completa de la BD primaria")
+                    self.cargar_snapshot()
                 return
             
-            # Eliminar préstamo
-            cursor.execute(
-                "DELETE FROM prestamos WHERE codigo = ? AND usuario = ?",
-                (codigo, usuario)
-            )
+            operaciones = respuesta["operaciones"]
+            if operaciones:
+                log.info(f" Recuperando {len(operaciones)} operaciones desde la secuencia {self.ultima_secuencia + 1}")
             
-            # Aumentar disponibilidad
-            cursor.execute(
-                "UPDATE libros SET ejemplares_disponibles = ejemplares_disponibles + 1 WHERE codigo = ?",
-                (codigo,)
-            )
+            for operacion in operaciones:
+                self.recibir_operacion(operacion)
             
-            conn.commit()
-            print(f"REPLICADO: Devolución de {codigo} por {usuario}")
+            antes = self.ultima_secuencia
+            self.aplicar_en_orden()
+            
+            if self.ultima_secuencia >= respuesta["ultima_secuencia"]:
+                self.al_dia = consultado
+            
+            if (not operaciones or self.ultima_secuencia == antes
+                    or self.ultima_secuencia >= respuesta["ultima_secuencia"]):
+                return
+    
+    def cargar_snapshot(self):
+        """
+        Reemplaza la BD réplica por un snapshot de la primaria transferido en bloques
         
-        except Exception as e:
-            conn.rollback()
-            print(f" Error replicando devolución: {e}")
+        Las operaciones que llegan mientras tanto quedan en el socket PULL o en el
+        log del GA; después se aplican solo las posteriores a la secuencia del snapshot.
+        
+        Returns:
+            True si la réplica quedó cargada
+        """
+        if not self.ga_endpoint:
+            log.info(" Sin endpoint del GA, no se puede cargar un snapshot")
+            return False
+        
+        inicio = time.perf_counter()
+        respuesta = self.solicitar_ga({"operacion": "snapshot_inicio"})
+        if not respuesta or not respuesta.get("exito"):
+            log.warning(f" No se pudo iniciar el snapshot: {respuesta.get('mensaje') if respuesta else 'GA no responde'}")
+            return False
+        
+        identificador = respuesta["id"]
+        log.info(f" Snapshot {identificador} solicitado, esperando a que la primaria lo prepare...")
+        
+        # El GA crea la copia en segundo plano
+        while True:
+            estado = self.solicitar_ga({"operacion": "snapshot_estado", "id": identificador})
+            if not estado or not estado.get("exito"):
+                log.error(f" Snapshot fallido: {estado.get('mensaje') if estado else 'GA no responde'}")
+                return False
+            if estado["listo"]:
+                break
+            time.sleep(0.2)
+        
+        temporal = f"{self.db_file}.snapshot"
+        try:
+            completo = self.descargar_snapshot(identificador, estado, temporal)
         finally:
-            conn.close()
+            self.solicitar_ga({"operacion": "snapshot_fin", "id": identificador})
+        
+        if not completo:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            return False
+        
+        # Reemplazar la BD: cerrar la conexión y descartar el WAL de la BD anterior
+        self.conexiones.cerrar()
+        for sufijo in ("-wal", "-shm"):
+            if os.path.exists(self.db_file + sufijo):
+                os.remove(self.db_file + sufijo)
+        os.replace(temporal, self.db_file)
+        self.merkle.reiniciar()
+        
+        self.inicializar_bd_replica()
+        self.ultima_secuencia = self.leer_secuencia()
+        self.aplicar_en_orden()
+        
+        log.info(f" Snapshot cargado: {estado['tamano']} bytes en {estado['bloques']} bloques, "
+                 f"secuencia {estado['secuencia']} ({time.perf_counter() - inicio:.2f} s)")
+        
+        # El GA puede depurar su log hasta la secuencia del snapshot
+        self.confirmar_aplicadas(forzar=True)
+        return True
+    
+    def descargar_snapshot(self, identificador, estado, temporal):
+        """Descarga los bloques de un snapshot listo y verifica su sha256"""
+        resumen = hashlib.sha256()
+        
+        with open(temporal, "wb") as archivo:
+            for indice in range(estado["bloques"]):
+                bloque = None
+                for _ in range(3):
+                    bloque = self.solicitar_ga({"operacion": "snapshot_bloque", "id": identificador, "indice": indice})
+                    if bloque is not None:
+                        break
+                
+                if not bloque or not bloque.get("exito"):
+                    log.error(f" Error descargando el bloque {indice}: {bloque.get('mensaje') if bloque else 'GA no responde'}")
+                    return False
+                
+                archivo.write(bloque["datos"])
+                resumen.update(bloque["datos"])
+        
+        if resumen.hexdigest() != estado["sha256"]:
+            log.error(" El snapshot recibido no coincide con el de la primaria (sha256), se descarta")
+            return False
+        return True
+    
+    def verificar_antientropia(self):
+        """
+        Compara el árbol Merkle de la réplica con el del GA y repara los buckets distintos
+        
+        Solo compara cuando la réplica aplicó exactamente la secuencia que refleja el
+        árbol del GA; si no, hay operaciones en vuelo y se pospone.
+        
+        El árbol de la réplica se recalcula leyendo toda la BD en cada comparación:
+        la anti-entropía existe para encontrar las diferencias que no vinieron por la
+        replicación (escrituras directas, corrupción), y esas no invalidan ningún bucket.
+        Solo el tráfico con el GA es proporcional a los rangos distintos.
+        """
+        inicio = time.perf_counter()
+        raiz = self.solicitar_ga({"operacion": "antientropia_raiz"})
+        if not raiz or not raiz.get("exito"):
+            log.info(f" Anti-entropía: {raiz.get('mensaje') if raiz else 'GA no responde'}")
+            return
+        
+        if raiz["secuencia"] != self.ultima_secuencia:
+            log.info(f" Anti-entropía pospuesta: réplica en secuencia {self.ultima_secuencia}, "
+                     f"primaria en {raiz['secuencia']}")
+            return
+        
+        if raiz["digest_limites"] != self.merkle.digest:
+            limites = self.solicitar_ga({"operacion": "antientropia_limites"})
+            if not limites or limites.get("digest_limites") != raiz["digest_limites"]:
+                log.info(" Anti-entropía: los límites de buckets cambiaron, se reintentará")
+                return
+            self.limites_primaria = limites["limites"]
+            self.merkle = IndiceMerkle(fanout=raiz["fanout"])
+        
+        self.merkle.reiniciar()
+        self.merkle.actualizar(self.get_connection(), limites=self.limites_primaria)
+        arbol = self.merkle.arbol
+        
+        if arbol.raiz == raiz["raiz"]:
+            log.info(f" Anti-entropía: réplica idéntica a la primaria en la secuencia {self.ultima_secuencia} "
+                     f"({len(self.limites_primaria)} buckets, {(time.perf_counter() - inicio) * 1000:.1f} ms)")
+            return
+        
+        # Bajar por el árbol pidiendo solo los hijos de los nodos distintos
+        distintos = [0]
+        consultados = 1
+        for nivel in range(arbol.altura - 1, 0, -1):
+            hijos = [hijo for indice in distintos for hijo in arbol.hijos(nivel, indice)]
+            respuesta = self.solicitar_ga({
+                "operacion": "antientropia_nodos",
+                "version": raiz["version"],
+                "nivel": nivel - 1,
+                "indices": hijos
+            })
+            if not respuesta or not respuesta.get("exito"):
+                log.info(f" Anti-entropía interrumpida: {respuesta.get('mensaje') if respuesta else 'GA no responde'}")
+                return
+            
+            consultados += len(hijos)
+            distintos = [hijo for hijo, valor in zip(hijos, respuesta["hashes"]) if arbol.niveles[nivel - 1][hijo] != valor]
+        
+        reparados = 0
+        for indice in distintos:
+            datos = self.solicitar_ga({
+                "operacion": "antientropia_bucket",
+                "indice": indice,
+                "digest_limites": raiz["digest_limites"]
+            })
+            if not datos or not datos.get("exito") or datos["secuencia"] != self.ultima_secuencia:
+                log.info(" Anti-entropía: la primaria cambió durante la reparación, se reintentará")
+                break
+            
+            if self.reparar_bucket(indice, datos):
+                reparados += 1
+        
+        log.info(f" Anti-entropía: {len(distintos)} de {len(self.limites_primaria)} buckets distintos, "
+                 f"{reparados} reparados ({consultados} nodos consultados, "
+                 f"{(time.perf_counter() - inicio) * 1000:.1f} ms)")
     
-    def aplicar_renovacion(self, operacion):
-        """Aplica una renovación en la réplica"""
+    def reparar_bucket(self, indice, datos):
+        """Reemplaza un bucket de la réplica por el contenido de la primaria"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
-            codigo = operacion["codigo"]
-            usuario = operacion["usuario"]
-            nueva_fecha = operacion["nueva_fecha"]
-            renovaciones = operacion["renovaciones"]
-            
-            # Actualizar préstamo
-            cursor.execute(
-                "UPDATE prestamos SET fecha_devolucion = ?, renovaciones = ? WHERE codigo = ? AND usuario = ?",
-                (nueva_fecha, renovaciones, codigo, usuario)
-            )
-            
+            cursor.execute("BEGIN")
+            reparar_bucket(cursor, self.limites_primaria, indice, datos["libros"], datos["prestamos"])
             conn.commit()
-            print(f" REPLICADO: Renovación {renovaciones}/2 de {codigo} por {usuario}")
-        
-        except Exception as e:
+        except sqlite3.Error as e:
             conn.rollback()
-            print(f" Error replicando renovación: {e}")
-        finally:
-            conn.close()
-    
-    def aplicar_operacion(self, operacion):
-        """Aplica una operación en la BD réplica"""
-        tipo = operacion.get("tipo")
-        
-        if tipo == "prestamo":
-            self.aplicar_prestamo(operacion)
-        elif tipo == "devolucion":
-            self.aplicar_devolucion(operacion)
-        elif tipo == "renovacion":
-            self.aplicar_renovacion(operacion)
+            log.error(f" Error reparando el bucket {indice}: {e}")
+            return False
+        
+        desde = self.limites_primaria[indice]
+        hasta = self.limites_primaria[indice + 1] if indice + 1 < len(self.limites_primaria) else "fin"
+        log.info(f" REPARADO: bucket {indice} [{desde or 'inicio'}, {hasta}): "
+              f"{len(datos['libros'])} libros, {len(datos['prestamos'])} préstamos")
+        return True
+    
+    def frescura(self):
+        """Qué tan al día está la réplica; se agrega a cada respuesta de lectura"""
+        return {
+            "secuencia_replica": self.ultima_secuencia,
+            "atraso": max(self.mayor_secuencia - self.ultima_secuencia, 0),
+            "antiguedad_s": round(time.time() - self.al_dia, 3) if self.al_dia else None
+        }
+    
+    def verificar_disponibilidad(self, codigo):
+        """Misma respuesta que verificar_disponibilidad del GA, leída de la réplica"""
+        libro = self.get_connection().execute("SELECT * FROM libros WHERE codigo = ?", (codigo,)).fetchone()
+        
+        if not libro:
+            return {
+                "disponible": False,
+                "mensaje": f"El libro {codigo} no existe en la biblioteca"
+            }
+        
+        if libro['ejemplares_disponibles'] <= 0:
+            return {
+                "disponible": False,
+                "mensaje": f"No hay ejemplares disponibles de '{libro['titulo']}'"
+            }
+        
+        return {
+            "disponible": True,
+            "mensaje": f"Hay {libro['ejemplares_disponibles']} ejemplar(es) disponible(s)",
+            "libro": dict(libro)
+        }
+    
+    def consultar_prestamos(self, usuario=None, codigo=None, limite=1000):
+        """Préstamos activos de un usuario, de un libro o de ambos"""
+        if not usuario and not codigo:
+            return {"exito": False, "mensaje": "Indicar usuario y/o codigo"}
+        
+        condiciones = []
+        parametros = []
+        if usuario:
+            condiciones.append("usuario = ?")
+            parametros.append(usuario)
+        if codigo:
+            condiciones.append("codigo = ?")
+            parametros.append(codigo)
+        
+        filas = self.get_connection().execute(
+            "SELECT codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones FROM prestamos "
+            f"WHERE {' AND '.join(condiciones)} ORDER BY fecha_devolucion LIMIT ?",
+            (*parametros, limite)
+        ).fetchall()
+        
+        return {
+            "exito": True,
+            "mensaje": f"{len(filas)} préstamo(s) activo(s)",
+            "prestamos": [dict(fila) for fila in filas]
+        }
+    
+    def procesar_lectura(self, solicitud):
+        """Procesa una consulta de solo lectura"""
+        operacion = solicitud.get("operacion")
+        
+        if operacion == "health_check":
+            respuesta = {"status": "ok", "sede": self.sede, "rol": "replica"}
+        elif operacion == "negociar_formato":
+            return codec.respuesta_negociacion(solicitud)
+        elif operacion == "verificar_disponibilidad":
+            respuesta = self.verificar_disponibilidad(solicitud["codigo"])
+        elif operacion == "consultar_prestamos":
+            respuesta = self.consultar_prestamos(solicitud.get("usuario"), solicitud.get("codigo"))
         else:
-            print(f" Operación desconocida: {tipo}")
+            respuesta = {"exito": False, "mensaje": f"Operación no disponible en la réplica: {operacion}"}
+        
+        respuesta.update(self.frescura())
+        return respuesta
+    
+    def atender_lectura(self):
+        """Responde una consulta del socket REP de lecturas, en el formato en que llegó"""
+        formato = codec.FORMATO_JSON
+        solicitud = {}
+        mensaje = self.socket_lectura.recv()
+        recibido = time.time()
+        inicio = time.perf_counter()
+        try:
+            solicitud, formato = codec.decodificar(mensaje)
+            with self.trazas.span(f"lectura:{solicitud.get('operacion')}", solicitud,
+                                  codigo=solicitud.get("codigo")) as span:
+                respuesta = self.procesar_lectura(solicitud)
+                resultado = span.resultado = metricas.resultado(respuesta)
+        except Exception as e:
+            respuesta = {"exito": False, "mensaje": f"Error en consulta: {e}"}
+            resultado = "error"
+        self.socket_lectura.send(codec.codificar(respuesta, formato))
+        self.metricas.registrar(f"lectura:{solicitud.get('operacion')}", resultado,
+                                time.perf_counter() - inicio, metricas.espera(solicitud, recibido))
+    
+    def confirmar_aplicadas(self, forzar=False):
+        """Informa al GA la última secuencia aplicada para que depure su log"""
+        if not self.ga_endpoint or not (self.sin_confirmar or forzar):
+            return
+        
+        respuesta = self.solicitar_ga({"operacion": "ack_replicacion", "secuencia": self.ultima_secuencia})
+        if respuesta and respuesta.get("exito"):
+            self.sin_confirmar = 0
     
     def ejecutar(self):
         """Loop principal del receptor"""
-        print(" Esperando actualizaciones de la BD primaria...\n")
+        # Réplica nueva (o reinicialización pedida): copia completa de la primaria
+        if self.snapshot_inicial or (self.libros_en_replica == 0 and self.ga_endpoint):
+            self.cargar_snapshot()
+        
+        # Al arrancar: lo que se haya confirmado en el GA mientras la réplica no estaba
+        self.recuperar()
+        self.confirmar_aplicadas()
+        
+        log.info(" Esperando actualizaciones de la BD primaria...")
+        
+        poller = zmq.Poller()
+        poller.register(self.socket_pull, zmq.POLLIN)
+        if self.socket_lectura:
+            poller.register(self.socket_lectura, zmq.POLLIN)
+        transacciones_mostradas = 0
+        ultimo_trafico = time.monotonic()
         
         while True:
             try:
-                # Recibir operación de replicación
-                mensaje = self.socket_pull.recv_string()
-                operacion = json.loads(mensaje)
+                eventos = dict(poller.poll(self.intervalo_ms))
+                if self.perfilador.activo:
+                    self.perfilador.revisar()
                 
-                print(f" Operación recibida: {operacion.get('tipo', 'desconocido')}")
+                # Las consultas se atienden entre transacciones: ven un estado consistente
+                if self.socket_lectura in eventos:
+                    self.atender_lectura()
                 
-                # Aplicar operación en réplica
-                self.aplicar_operacion(operacion)
-                print()  # Línea en blanco para separar operaciones
+                if self.socket_pull in eventos:
+                    # Recibir todo lo que ya llegó y aplicarlo junto
+                    self.recibir_mensaje(self.socket_pull.recv())
+                    while len(self.fuera_de_orden) < self.max_transaccion:
+                        try:
+                            self.recibir_mensaje(self.socket_pull.recv(zmq.NOBLOCK))
+                        except zmq.error.Again:
+                            break
+                    
+                    self.aplicar_en_orden()
+                    ultimo_trafico = time.monotonic()
+                elif time.monotonic() - ultimo_trafico >= self.intervalo_ms / 1000.0:
+                    ultimo_trafico = time.monotonic()
+                    
+                    # Sin tráfico: recuperar operaciones que no llegaron (envíos fallidos, reconexión)
+                    self.recuperar()
+                    self.confirmar_aplicadas()
+                    
+                    if self.transacciones != transacciones_mostradas:
+                        self.mostrar_estadisticas()
+                        transacciones_mostradas = self.transacciones
+                    
+                    # Anti-entropía en los momentos sin tráfico
+                    if (self.ga_endpoint and self.intervalo_antientropia
+                            and time.monotonic() >= self.proxima_antientropia):
+                        self.verificar_antientropia()
+                        self.proxima_antientropia = time.monotonic() + self.intervalo_antientropia
+                
+                if self.hueco_desde is not None and time.monotonic() - self.hueco_desde >= self.espera_hueco:
+                    self.recuperar()
+                
+                if self.sin_confirmar >= self.ack_cada:
+                    self.confirmar_aplicadas()
                 
             except KeyboardInterrupt:
-                print("\n Deteniendo Receptor de Réplica...")
+                log.info(" Deteniendo Receptor de Réplica...")
+                self.mostrar_estadisticas()
+                self.conexiones.cerrar()
                 break
             except Exception as e:
-                print(f" Error procesando replicación: {e}\n")
+                log.exception(f" Error procesando replicación: {e}")
+                self.metricas.incrementar("errores")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Uso: python receptor_replica.py <sede>")
-        print("Ejemplo: python receptor_replica.py 1")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Receptor de Réplica",
+        epilog="Ejemplo: python receptor_replica.py 1"
+    )
+    parser.add_argument("sede", type=int, help="número de sede (1 o 2)")
+    parser.add_argument("--ga", default=None,
+                        help="endpoint REP del GA primario para recuperar operaciones perdidas "
+                             "(por defecto el de la otra sede; 'ninguno' lo desactiva)")
+    parser.add_argument("--intervalo-ms", type=int, default=2000,
+                        help="sin mensajes durante este tiempo se consulta al GA por operaciones perdidas")
+    parser.add_argument("--espera-hueco-ms", type=int, default=500,
+                        help="espera antes de pedir al GA las operaciones que faltan")
+    parser.add_argument("--ack-cada", type=int, default=100,
+                        help="operaciones aplicadas entre confirmaciones al GA")
+    parser.add_argument("--max-transaccion", type=int, default=1000,
+                        help="operaciones máximas aplicadas en una transacción")
+    parser.add_argument("--antientropia-s", type=int, default=300,
+                        help="segundos entre comparaciones del árbol Merkle con la primaria (0 = desactivada)")
+    parser.add_argument("--puerto-lectura", default=None,
+                        help="puerto REP para consultas de solo lectura (verificar_disponibilidad, "
+                             "consultar_prestamos, health_check)")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="reemplazar la BD réplica por un snapshot de la primaria al arrancar")
+    parser.add_argument("--mapa", default=None,
+                        help="archivo JSON del mapa de particiones de la sede primaria")
+    parser.add_argument("--particion", default=None,
+                        help="partición a replicar (puerto PULL y GA salen del mapa)")
+    registro.agregar_argumentos(parser)
+    control.agregar_argumentos(parser)
+    trazas.agregar_argumentos(parser)
+    args = parser.parse_args()
     
-    sede = int(sys.argv[1])
+    sede = args.sede
+    proceso = f"replica_sede{sede}" + (f"_{args.particion}" if args.particion else "")
+    registro.configurar_desde_args(proceso, args)
     
     # Configuración por sede
     if sede == 1:
         # Sede 1 recibe replicaciones de Sede 2 en puerto 5559
         puerto_pull = "5559"
+        ga_endpoint = "tcp://10.43.103.132:5558"  # GA de Sede 2 en Comp 2
     else:  # sede == 2
         # Sede 2 recibe replicaciones de Sede 1 en puerto 5560
         puerto_pull = "5560"
+        ga_endpoint = "tcp://10.43.103.177:5557"  # GA de Sede 1 en Comp 1
+    
+    if args.particion:
+        if not args.mapa:
+            parser.error("--particion requiere --mapa")
+        mapa = MapaParticiones.cargar(args.mapa)
+        if args.particion not in mapa.particiones or not mapa.replica(args.particion):
+            parser.error(f"la particion {args.particion} no tiene replica en {args.mapa}")
+        puerto_pull = puerto(mapa.replica(args.particion))
+        ga_endpoint = mapa.ga(args.particion)
+    
+    if args.ga == "ninguno":
+        ga_endpoint = None
+    elif args.ga:
+        ga_endpoint = args.ga
     
-    receptor = ReceptorReplica(sede=sede, puerto_pull=puerto_pull)
-    receptor.ejecutar()
\ No newline at end of file
+    receptor = ReceptorReplica(
+        sede=sede,
+        puerto_pull=puerto_pull,
+        ga_endpoint=ga_endpoint,
+        intervalo_ms=args.intervalo_ms,
+        espera_hueco_ms=args.espera_hueco_ms,
+        ack_cada=args.ack_cada,
+        max_transaccion=args.max_transaccion,
+        snapshot_inicial=args.snapshot,
+        intervalo_antientropia_s=args.antientropia_s,
+        puerto_lectura=args.puerto_lectura,
+        particion=args.particion,
+        puerto_control=args.puerto_control,
+        dir_perfiles=args.perfiles_dir,
+        trazador=trazas.desde_args(proceso, args)
+    )
+    receptor.ejecutar()
@@ -0,0 +1,169 @@
+"""
+Registro (logging) compartido por los procesos del sistema
+
+Los mensajes se encolan y un hilo de fondo (QueueListener) los escribe en la
+consola y, opcionalmente, en archivos rotativos con una linea JSON por
+registro. El proceso que registra no formatea ni escribe: solo crea el
+registro y lo encola.
+
+Las lineas por solicitud van al logger "<componente>.solicitudes" con nivel
+DEBUG y argumentos diferidos (log.debug("... %s", valor)). Con el nivel de
+produccion (INFO) esas llamadas terminan en la comprobacion de nivel, sin
+crear el registro ni formatear. Con DEBUG se puede muestrear 1 de cada N.
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+NIVELES = ["DEBUG", "INFO", "WARNING", "ERROR"]
+NIVEL_PRODUCCION = "INFO"
+
+_listener = None
+_muestreo = []  # filtro compartido por los loggers "*.solicitudes" (vacio = sin muestreo)
+
+
+class FiltroMuestreo(logging.Filter):
+    def __init__(self, cada):
+        """Deja pasar 1 de cada 'cada' registros (los WARNING o mas graves pasan siempre)"""
+        super().__init__()
+        self.cada = cada
+        self._contador = itertools.count()
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or next(self._contador) % self.cada == 0
+
+
+class FormateadorJSON(logging.Formatter):
+    def __init__(self, proceso):
+        super().__init__()
+        self.proceso = proceso
+
+    def format(self, record):
+        registro = {
+            "ts": round(record.created, 6),
+            "nivel": record.levelname,
+            "proceso": self.proceso,
+            "pid": record.process,
+            "hilo": record.threadName,
+            "logger": record.name,
+            "mensaje": record.getMessage()
+        }
+        # Campos estructurados: log.info("...", extra={"campos": {...}})
+        campos = getattr(record, "campos", None)
+        if campos:
+            registro.update(campos)
+        if record.exc_info:
+            registro["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(registro, ensure_ascii=False, default=str)
+
+
+class _ManejadorCola(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # QueueHandler.prepare formatea el mensaje en el hilo que registra; aqui se
+        # encola tal cual y el formateo queda en el hilo del listener
+        return record
+
+
+def configurar(proceso, nivel=NIVEL_PRODUCCION, archivo=None, muestreo=1,
+               max_bytes=50 * 1024 * 1024, respaldos=5, consola=True):
+    """
+    Configura el logging del proceso
+
+    Args:
+        proceso: nombre del proceso (se incluye en cada registro JSON)
+        nivel: DEBUG, INFO, WARNING o ERROR
+        archivo: archivo JSON lines rotativo (None = solo consola)
+        muestreo: con DEBUG, registrar 1 de cada N lineas por solicitud
+        max_bytes: tamano a partir del cual se rota el archivo
+        respaldos: archivos rotados que se conservan
+        consola: escribir tambien en la consola (solo el mensaje, como antes)
+    """
+    global _listener
+    detener()
+
+    manejadores = []
+    if consola:
+        manejador = logging.StreamHandler()
+        manejador.setFormatter(logging.Formatter("%(message)s"))
+        manejadores.append(manejador)
+    if archivo:
+        directorio = os.path.dirname(archivo)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        manejador = logging.handlers.RotatingFileHandler(
+            archivo, maxBytes=max_bytes, backupCount=respaldos, encoding="utf-8")
+        manejador.setFormatter(FormateadorJSON(proceso))
+        manejadores.append(manejador)
+
+    cola = queue.SimpleQueue()
+    raiz = logging.getLogger()
+    for manejador in list(raiz.handlers):
+        raiz.removeHandler(manejador)
+    raiz.addHandler(_ManejadorCola(cola))
+    raiz.setLevel(nivel)
+
+    # El muestreo se aplica a todos los loggers "*.solicitudes"
+    _muestreo.clear()
+    if muestreo > 1:
+        _muestreo.append(FiltroMuestreo(muestreo))
+    for nombre, logger in list(logging.Logger.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and nombre.endswith(".solicitudes"):
+            _aplicar_muestreo(logger)
+
+    # Sin respect_handler_level cada manejador recibe todo lo que pasa el nivel del logger
+    _listener = logging.handlers.QueueListener(cola, *manejadores)
+    _listener.start()
+    atexit.register(detener)
+
+
+def _aplicar_muestreo(logger):
+    for filtro in [f for f in logger.filters if isinstance(f, FiltroMuestreo)]:
+        logger.removeFilter(filtro)
+    if _muestreo:
+        logger.addFilter(_muestreo[0])
+
+
+def obtener(componente):
+    """Logger de un componente (eventos del proceso)"""
+    return logging.getLogger(componente)
+
+
+def solicitudes(componente):
+    """Logger para las lineas por solicitud (DEBUG, muestreadas)"""
+    logger = logging.getLogger(f"{componente}.solicitudes")
+    _aplicar_muestreo(logger)
+    return logger
+
+
+def detener():
+    """Vacia la cola y detiene el hilo escritor"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+
+def agregar_argumentos(parser):
+    """Opciones de logging comunes para el argparse de cada proceso"""
+    parser.add_argument("--log-nivel", type=str.upper, choices=NIVELES, default=NIVEL_PRODUCCION,
+                        help="nivel de log (DEBUG muestra cada solicitud)")
+    parser.add_argument("--log-archivo", default=None,
+                        help="archivo de log JSON lines con rotacion (ademas de la consola)")
+    parser.add_argument("--log-muestreo", type=int, default=1,
+                        help="con DEBUG, registrar 1 de cada N lineas por solicitud")
+    parser.add_argument("--log-sin-consola", action="store_true",
+                        help="no escribir el log en la consola")
+
+
+def configurar_desde_args(proceso, args):
+    configurar(
+        proceso,
+        nivel=args.log_nivel,
+        archivo=args.log_archivo,
+        muestreo=max(args.log_muestreo, 1),
+        consola=not args.log_sin_consola
+    )
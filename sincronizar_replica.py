@@ -1,59 +1,44 @@
 import sqlite3
 import sys
 
-def sincronizar_libros(sede):
-    """Copia los libros de la BD primaria a la réplica"""
-    
+from snapshot_bd import copiar_bd
+
+def sincronizar_replica(sede):
+    """Copia la BD primaria completa (libros y préstamos) a la réplica local"""
+
     bd_primaria = f"bd_sede{sede}.db"
     bd_replica = f"bd_sede{sede}_replica.db"
-    
-    print(f" Sincronizando libros de {bd_primaria} a {bd_replica}...")
-    
+
+    print(f" Sincronizando {bd_primaria} a {bd_replica}...")
+    print("  Detener el receptor de réplica que use ese archivo antes de sincronizar")
+
     try:
-        # Conectar a BD primaria
-        conn_primaria = sqlite3.connect(bd_primaria)
-        cursor_primaria = conn_primaria.cursor()
-        
-        # Conectar a BD réplica
+        # Copia consistente con la API de backup (la primaria puede seguir en uso)
+        secuencia = copiar_bd(bd_primaria, bd_replica)
+
+        # Verificar
         conn_replica = sqlite3.connect(bd_replica)
         cursor_replica = conn_replica.cursor()
-        
-        # Obtener todos los libros de la primaria
-        cursor_primaria.execute("SELECT * FROM libros")
-        libros = cursor_primaria.fetchall()
-        
-        print(f" Encontrados {len(libros)} libros en BD primaria")
-        
-        # Limpiar libros existentes en réplica (si hay)
-        cursor_replica.execute("DELETE FROM libros")
-        
-        # Copiar libros a réplica
-        cursor_replica.executemany(
-            "INSERT INTO libros (codigo, titulo, autor, ejemplares_totales, ejemplares_disponibles) VALUES (?, ?, ?, ?, ?)",
-            libros
-        )
-        
-        conn_replica.commit()
-        
-        # Verificar
         cursor_replica.execute("SELECT COUNT(*) FROM libros")
-        count = cursor_replica.fetchone()[0]
-        
-        print(f"Sincronización completa: {count} libros copiados a la réplica")
-        
-        conn_primaria.close()
+        libros = cursor_replica.fetchone()[0]
+        cursor_replica.execute("SELECT COUNT(*) FROM prestamos")
+        prestamos = cursor_replica.fetchone()[0]
         conn_replica.close()
-        
+
+        print(f"Sincronización completa: {libros} libros y {prestamos} préstamos copiados a la réplica")
+        print(f" La réplica continúa el flujo de replicación desde la secuencia {secuencia}")
+
     except Exception as e:
         print(f" Error durante sincronización: {e}")
         import traceback
         traceback.print_exc()
 
-if __name__ == "_main_":
+if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Uso: python sincronizar_replica.py <sede>")
         print("Ejemplo: python sincronizar_replica.py 1")
+        print("Para inicializar una réplica remota por la red: python receptor_replica.py <sede> --snapshot")
         sys.exit(1)
-    
+
     sede = int(sys.argv[1])
-    sincronizar_libros(sede)
+    sincronizar_replica(sede)
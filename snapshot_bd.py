@@ -0,0 +1,173 @@
+import glob
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import registro
+
+log = registro.obtener("ga.snapshot")
+
+TAMANO_BLOQUE = 1 << 20
+EXPIRACION = 1800  # segundos que se conserva un snapshot abandonado
+
+
+def copiar_bd(origen, destino):
+    """
+    Copia consistente de una BD, lista para usarse como replica
+
+    Usa la API de backup de SQLite en un solo paso: la copia corresponde a un
+    unico instante y, con la primaria en WAL, las escrituras siguen mientras se
+    copia. El log de replicacion no se copia; en su lugar la copia registra como
+    aplicada la ultima secuencia que contiene, para seguir el flujo desde ahi.
+
+    Returns:
+        secuencia del log de replicacion incluida en la copia
+    """
+    fuente = sqlite3.connect(origen)
+    copia = sqlite3.connect(destino)
+
+    try:
+        fuente.backup(copia)
+        copia.execute("PRAGMA journal_mode=DELETE")
+
+        tablas = {fila[0] for fila in copia.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        secuencia = 0
+        if "replicacion_log" in tablas:
+            fila = copia.execute("SELECT seq FROM sqlite_sequence WHERE name = 'replicacion_log'").fetchone()
+            secuencia = fila[0] if fila else 0
+            copia.execute("DELETE FROM replicacion_log")
+            copia.execute("DELETE FROM replicacion_estado")
+            copia.execute("INSERT INTO replicacion_estado (clave, valor) VALUES ('aplicada', ?)", (secuencia,))
+        copia.commit()
+    finally:
+        copia.close()
+        fuente.close()
+
+    return secuencia
+
+
+class GestorSnapshots:
+    def __init__(self, db_file, tamano_bloque=TAMANO_BLOQUE):
+        """
+        Snapshots de la BD primaria para inicializar replicas por la red
+
+        Cada snapshot se crea en un hilo aparte (el GA sigue atendiendo) en un
+        archivo temporal junto a la BD, y se entrega por bloques hasta que el
+        cliente lo finaliza o expira.
+
+        Args:
+            db_file: BD primaria
+            tamano_bloque: bytes por bloque transferido
+        """
+        self.db_file = db_file
+        self.tamano_bloque = tamano_bloque
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+        # Copias que quedaron de una ejecucion anterior
+        for archivo in glob.glob(f"{db_file}.snapshot-*"):
+            os.remove(archivo)
+
+    def iniciar(self):
+        """Empieza a crear un snapshot; el cliente consulta estado() hasta que este listo"""
+        self._depurar()
+
+        identificador = uuid.uuid4().hex[:12]
+        snapshot = {
+            "archivo": f"{self.db_file}.snapshot-{identificador}",
+            "creado": time.time(),
+            "listo": False,
+            "error": None
+        }
+        with self._lock:
+            self._snapshots[identificador] = snapshot
+
+        threading.Thread(target=self._crear, args=(snapshot,), daemon=True).start()
+        return {"exito": True, "id": identificador, "mensaje": "Snapshot en preparacion"}
+
+    def _crear(self, snapshot):
+        try:
+            inicio = time.perf_counter()
+            secuencia = copiar_bd(self.db_file, snapshot["archivo"])
+
+            resumen = hashlib.sha256()
+            with open(snapshot["archivo"], "rb") as archivo:
+                for bloque in iter(lambda: archivo.read(self.tamano_bloque), b""):
+                    resumen.update(bloque)
+
+            tamano = os.path.getsize(snapshot["archivo"])
+            snapshot.update(
+                secuencia=secuencia,
+                tamano=tamano,
+                bloques=(tamano + self.tamano_bloque - 1) // self.tamano_bloque,
+                sha256=resumen.hexdigest(),
+                listo=True
+            )
+            log.info(f"=Snapshot creado: {tamano} bytes, secuencia {secuencia} "
+                     f"({time.perf_counter() - inicio:.2f} s)")
+        except Exception as e:
+            snapshot["error"] = str(e)
+            log.error(f"L Error creando snapshot: {e}")
+
+    def _buscar(self, identificador):
+        with self._lock:
+            return self._snapshots.get(identificador)
+
+    def estado(self, identificador):
+        snapshot = self._buscar(identificador)
+        if not snapshot:
+            return {"exito": False, "mensaje": f"Snapshot desconocido: {identificador}"}
+        if snapshot["error"]:
+            return {"exito": False, "mensaje": f"Error creando snapshot: {snapshot['error']}"}
+        if not snapshot["listo"]:
+            return {"exito": True, "listo": False, "mensaje": "Snapshot en preparacion"}
+
+        return {
+            "exito": True,
+            "listo": True,
+            "mensaje": f"Snapshot listo: {snapshot['tamano']} bytes en {snapshot['bloques']} bloques",
+            "secuencia": snapshot["secuencia"],
+            "tamano": snapshot["tamano"],
+            "bloques": snapshot["bloques"],
+            "tamano_bloque": self.tamano_bloque,
+            "sha256": snapshot["sha256"]
+        }
+
+    def bloque(self, identificador, indice):
+        """
+        Returns:
+            (respuesta, datos): datos son los bytes del bloque o None si hubo error
+        """
+        snapshot = self._buscar(identificador)
+        if not snapshot or not snapshot["listo"]:
+            return {"exito": False, "mensaje": f"Snapshot no disponible: {identificador}"}, None
+        if not 0 <= indice < snapshot["bloques"]:
+            return {"exito": False, "mensaje": f"Bloque fuera de rango: {indice}"}, None
+
+        with open(snapshot["archivo"], "rb") as archivo:
+            archivo.seek(indice * self.tamano_bloque)
+            datos = archivo.read(self.tamano_bloque)
+
+        return {"exito": True, "indice": indice, "mensaje": f"Bloque {indice + 1}/{snapshot['bloques']}"}, datos
+
+    def finalizar(self, identificador):
+        with self._lock:
+            snapshot = self._snapshots.pop(identificador, None)
+        if not snapshot:
+            return {"exito": False, "mensaje": f"Snapshot desconocido: {identificador}"}
+
+        if os.path.exists(snapshot["archivo"]):
+            os.remove(snapshot["archivo"])
+        return {"exito": True, "mensaje": f"Snapshot {identificador} finalizado"}
+
+    def _depurar(self):
+        """Elimina los snapshots abandonados (ya creados) que expiraron"""
+        limite = time.time() - EXPIRACION
+        with self._lock:
+            vencidos = [ident for ident, snapshot in self._snapshots.items()
+                        if snapshot["creado"] < limite and (snapshot["listo"] or snapshot["error"])]
+        for identificador in vencidos:
+            self.finalizar(identificador)
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# Los modulos del sistema estan en la raiz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Reloj:
+    """time.monotonic controlado por la prueba"""
+
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj_de(monkeypatch):
+    """reloj_de(modulo) reemplaza modulo.time.monotonic por un Reloj y lo devuelve"""
+    def fijar(modulo):
+        reloj = Reloj()
+        monkeypatch.setattr(modulo.time, "monotonic", reloj)
+        return reloj
+    return fijar
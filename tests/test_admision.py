@@ -0,0 +1,94 @@
+import pytest
+
+import admision
+from admision import ControlAdmision, CuboTokens, limite_en_curso
+
+
+@pytest.fixture
+def reloj(reloj_de):
+    return reloj_de(admision)
+
+
+def test_cubo_tokens(reloj):
+    cubo = CuboTokens(tasa=10, rafaga=2)
+    assert cubo.tomar(reloj()) == 0
+    assert cubo.tomar(reloj()) == 0
+    assert cubo.tomar(reloj()) == pytest.approx(0.1)
+
+    reloj.ahora += 0.1
+    assert cubo.tomar(reloj()) == 0
+
+    # Nunca acumula mas que la rafaga
+    reloj.ahora += 60
+    assert [cubo.tomar(reloj()) == 0 for _ in range(3)] == [True, True, False]
+
+
+def test_limite_en_curso(reloj):
+    control = ControlAdmision(max_en_curso={"prestamo": 2}, reintentar_ms=100)
+
+    assert control.admitir("ps1", "prestamo") is None
+    assert control.admitir("ps2", "prestamo") is None
+    ocupado = control.admitir("ps3", "prestamo")
+    assert ocupado["ocupado"] and not ocupado["exito"]
+    assert 100 <= ocupado["reintentar_ms"] <= 150
+
+    # Las operaciones sin limite no se cuentan
+    assert control.admitir("ps3", "devolucion") is None
+
+    control.terminar("prestamo")
+    assert control.admitir("ps3", "prestamo") is None
+    assert control.estado()["en_curso"] == {"prestamo": 2}
+    assert control.descartadas == {"prestamo:en_curso": 1}
+
+
+def test_tasa_por_cliente(reloj):
+    control = ControlAdmision(tasa_cliente=5, rafaga_cliente=2)
+
+    assert control.admitir("ps1", "prestamo") is None
+    assert control.admitir("ps1", "devolucion") is None
+    ocupado = control.admitir("ps1", "prestamo")
+    assert ocupado["ocupado"] and ocupado["reintentar_ms"] == 200
+
+    # Cada cliente tiene su propio cubo
+    assert control.admitir("ps2", "prestamo") is None
+
+    reloj.ahora += 0.2
+    assert control.admitir("ps1", "prestamo") is None
+    assert control.descartadas == {"prestamo:tasa": 1}
+
+
+def test_rechazo_en_curso_no_gasta_tokens(reloj):
+    control = ControlAdmision(max_en_curso={"prestamo": 1}, tasa_cliente=1, rafaga_cliente=2)
+
+    assert control.admitir("ps1", "prestamo") is None
+    for _ in range(5):
+        assert control.admitir("ps1", "prestamo")["reintentar_ms"] >= 100
+    control.terminar("prestamo")
+
+    # Al cliente le queda el segundo token de su rafaga
+    assert control.admitir("ps1", "prestamo") is None
+    assert control.descartadas == {"prestamo:en_curso": 5}
+
+
+def test_rechazo_por_tasa_no_cuenta_en_curso(reloj):
+    control = ControlAdmision(max_en_curso={"prestamo": 5}, tasa_cliente=1, rafaga_cliente=1)
+
+    assert control.admitir("ps1", "prestamo") is None
+    assert control.admitir("ps1", "prestamo")["ocupado"]
+    assert control.en_curso["prestamo"] == 1
+
+
+def test_clientes_acotados(reloj):
+    control = ControlAdmision(tasa_cliente=1, max_clientes=3)
+    for cliente in ("ps1", "ps2", "ps3", "ps4"):
+        control.admitir(cliente, "prestamo")
+    assert control.estado()["clientes"] == 3
+
+    # ps1 fue el descartado: vuelve con el cubo lleno
+    assert control.admitir("ps1", "prestamo") is None
+
+
+def test_limite_en_curso_argumento():
+    assert limite_en_curso("Prestamo=200") == ("prestamo", 200)
+    with pytest.raises(ValueError):
+        limite_en_curso("prestamo")
@@ -0,0 +1,107 @@
+import socket
+import sqlite3
+
+import pytest
+
+from antientropia import IndiceMerkle
+from gestor_almacenamiento import GestorAlmacenamiento
+from receptor_replica import ReceptorReplica
+
+CORROMPER = "UPDATE libros SET ejemplares_disponibles = 99 WHERE codigo = 'ISBN0700'"
+DISPONIBLES = "SELECT ejemplares_disponibles FROM libros WHERE codigo = 'ISBN0700'"
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return str(s.getsockname()[1])
+
+
+@pytest.fixture
+def primaria_y_replica(tmp_path, monkeypatch):
+    """GA con 1000 libros y una replica que parte de una copia exacta de su BD"""
+    monkeypatch.chdir(tmp_path)
+    ga = GestorAlmacenamiento(1, puerto_rep=puerto_libre(), libros_iniciales=1000)
+
+    with sqlite3.connect("bd_sede1.db") as origen, sqlite3.connect("bd_sede2_replica.db") as destino:
+        origen.backup(destino)
+
+    replica = ReceptorReplica(2, puerto_pull=puerto_libre(), ga_endpoint="tcp://127.0.0.1:1",
+                              intervalo_antientropia_s=0)
+    # La replica le habla al GA del mismo proceso, sin pasar por la red
+    replica.solicitar_ga = lambda solicitud, timeout_ms=3000: ga.procesar_solicitud(solicitud)
+    yield ga, replica
+    replica.context.destroy(linger=0)
+    ga.context.destroy(linger=0)
+
+
+def crear_bd(ruta, libros=1000):
+    conn = sqlite3.connect(ruta)
+    conn.execute("CREATE TABLE libros (codigo TEXT PRIMARY KEY, titulo TEXT, autor TEXT, "
+                 "ejemplares_totales INTEGER, ejemplares_disponibles INTEGER)")
+    conn.execute("CREATE TABLE prestamos (id INTEGER PRIMARY KEY AUTOINCREMENT, codigo TEXT, usuario TEXT, "
+                 "fecha_prestamo TEXT, fecha_devolucion TEXT, renovaciones INTEGER)")
+    conn.executemany("INSERT INTO libros VALUES (?, ?, ?, 3, 3)",
+                     [(f"ISBN{i:04d}", f"Libro {i}", f"Autor {i % 100}") for i in range(1, libros + 1)])
+    conn.commit()
+    return conn
+
+
+def test_incremental_igual_a_reconstruir(tmp_path):
+    conn = crear_bd(str(tmp_path / "bd.db"))
+    indice = IndiceMerkle()
+    indice.actualizar(conn)
+
+    conn.execute("INSERT INTO prestamos (codigo, usuario, fecha_prestamo, fecha_devolucion, renovaciones) "
+                 "VALUES ('ISBN0300', 'user1', '2026-10-17', '2026-10-31', 0)")
+    conn.execute("UPDATE libros SET ejemplares_disponibles = 2 WHERE codigo = 'ISBN0300'")
+    conn.commit()
+    indice.invalidar(["ISBN0300"])
+
+    assert indice.actualizar(conn) == 1
+    completo = IndiceMerkle()
+    completo.actualizar(conn, limites=indice.limites)
+    assert indice.arbol.raiz == completo.arbol.raiz
+
+
+def test_cambio_sin_invalidar_solo_se_ve_al_reiniciar(tmp_path):
+    conn = crear_bd(str(tmp_path / "bd.db"))
+    indice = IndiceMerkle()
+    indice.actualizar(conn)
+    antes = indice.arbol.raiz
+
+    # Una escritura que no paso por la replicacion no invalida ningun bucket
+    conn.execute(CORROMPER)
+    conn.commit()
+    indice.actualizar(conn)
+    assert indice.arbol.raiz == antes
+
+    indice.reiniciar()
+    indice.actualizar(conn)
+    assert indice.arbol.raiz != antes
+    assert indice.bucket("ISBN0700") == 2
+
+
+def test_replica_detecta_y_repara_corrupcion(primaria_y_replica):
+    ga, replica = primaria_y_replica
+    conn = sqlite3.connect(replica.db_file)
+    original = conn.execute(DISPONIBLES).fetchone()[0]
+
+    replica.verificar_antientropia()
+    raiz = replica.merkle.arbol.raiz
+    assert raiz == ga.merkle.arbol.raiz
+
+    conn.execute(CORROMPER)
+    conn.commit()
+
+    reparados = []
+    reparar = replica.reparar_bucket
+    replica.reparar_bucket = lambda indice, datos: reparados.append(indice) or reparar(indice, datos)
+    replica.verificar_antientropia()
+
+    assert replica.merkle.arbol.raiz != raiz
+    assert reparados == [replica.merkle.bucket("ISBN0700")]
+    assert conn.execute(DISPONIBLES).fetchone()[0] == original
+
+    replica.verificar_antientropia()
+    assert replica.merkle.arbol.raiz == ga.merkle.arbol.raiz
@@ -0,0 +1,82 @@
+import sqlite3
+import threading
+
+import pytest
+
+from cache_disponibilidad import CacheDisponibilidad
+
+
+def libro(codigo, disponibles):
+    return {"codigo": codigo, "titulo": f"Libro {codigo}", "autor": "Autor",
+            "ejemplares_totales": 3, "ejemplares_disponibles": disponibles}
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE libros (codigo TEXT PRIMARY KEY, titulo TEXT, autor TEXT, "
+                 "ejemplares_totales INTEGER, ejemplares_disponibles INTEGER)")
+    conn.executemany("INSERT INTO libros VALUES (?, ?, ?, 3, 3)",
+                     [(f"ISBN{i:04d}", f"Libro {i}", "Autor") for i in range(1, 11)])
+    return conn
+
+
+def test_catalogo_completo_responde_inexistentes(conn):
+    cache = CacheDisponibilidad(capacidad=100)
+    assert cache.cargar(conn) == 10
+    assert cache.obtener("ISBN0001")[1]["ejemplares_disponibles"] == 3
+    assert cache.obtener("ISBN9999") == (True, None)
+
+
+def test_lru_con_catalogo_incompleto(conn):
+    cache = CacheDisponibilidad(capacidad=3)
+    cache.cargar(conn)
+    assert not cache.completa
+
+    assert cache.obtener("ISBN9999") == (False, None)
+    cache.obtener("ISBN0001")
+    cache.agregar_si_ausente(libro("ISBN0005", 3), 0)
+
+    assert cache.obtener("ISBN0002") == (False, None)
+    assert cache.obtener("ISBN0001")[0]
+    assert cache.estadisticas()["expulsiones"] == 1
+
+
+def test_escritura_vieja_no_pisa_una_nueva():
+    cache = CacheDisponibilidad()
+    cache.actualizar(libro("ISBN0001", 1), 7)
+    cache.actualizar(libro("ISBN0001", 2), 6)
+    assert cache.obtener("ISBN0001")[1]["ejemplares_disponibles"] == 1
+
+
+def test_lectura_anterior_a_una_escritura_no_se_agrega():
+    cache = CacheDisponibilidad()
+    # Lectura de disco en la secuencia 4; mientras tanto se confirma la 5 (otro libro)
+    cache.actualizar(libro("ISBN0002", 2), 5)
+    cache.agregar_si_ausente(libro("ISBN0001", 3), 4)
+    assert cache.obtener("ISBN0001") == (False, None)
+
+    cache.agregar_si_ausente(libro("ISBN0001", 3), 5)
+    assert cache.obtener("ISBN0001")[1]["ejemplares_disponibles"] == 3
+
+    # No pisa un valor que ya esta
+    cache.agregar_si_ausente(libro("ISBN0001", 0), 9)
+    assert cache.obtener("ISBN0001")[1]["ejemplares_disponibles"] == 3
+
+
+def test_escrituras_concurrentes_terminan_en_la_ultima_version():
+    cache = CacheDisponibilidad()
+    versiones = list(range(1, 2001))
+
+    def escribir(propias):
+        for version in propias:
+            cache.actualizar(libro("ISBN0001", version), version)
+
+    hilos = [threading.Thread(target=escribir, args=(versiones[i::4],)) for i in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert cache.obtener("ISBN0001")[1]["ejemplares_disponibles"] == 2000
+    assert cache.version == 2000
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+import codec
+from codec import ErrorCodec
+
+MENSAJES = [
+    {"operacion": "prestamo_condicional", "codigo": "ISBN0617", "usuario": "user12", "id_operacion": "a1b2"},
+    {"exito": True, "mensaje": "Préstamo otorgado de 'Libro 617'", "fecha_devolucion": "2026-10-31"},
+    {"exito": False, "ocupado": True, "reintentar_ms": 137},
+    {"operacion": "lote", "modo": "transaccional", "operaciones": [
+        {"operacion": "devolucion", "codigo": "ISBN0001", "usuario": "user1"},
+        {"operacion": "renovacion", "codigo": "ISBN0002", "usuario": "user2"},
+    ]},
+    {"enteros": [0, 1, -1, 63, -64, 127, 128, 2 ** 40, -(2 ** 40)], "real": 1761234567.125,
+     "nulo": None, "vacio": {}, "lista_vacia": [], "texto_largo": "x" * 300, "ñandú": "ünïcödé"},
+    [1, "dos", 3.5, None, False],
+]
+
+
+@pytest.mark.parametrize("formato", codec.FORMATOS)
+@pytest.mark.parametrize("mensaje", MENSAJES)
+def test_ida_y_vuelta(mensaje, formato):
+    datos = codec.codificar(mensaje, formato)
+
+    assert codec.es_binario(datos) == (formato == codec.FORMATO_BINARIO)
+    assert codec.decodificar(datos) == (mensaje, formato)
+
+
+def test_binario_mas_chico_que_json():
+    mensaje = MENSAJES[0]
+    assert len(codec.codificar(mensaje, codec.FORMATO_BINARIO)) < len(codec.codificar(mensaje))
+
+
+@pytest.mark.parametrize("mensaje", MENSAJES)
+def test_binario_truncado(mensaje):
+    datos = codec.codificar(mensaje, codec.FORMATO_BINARIO)
+    for largo in range(2, len(datos)):
+        with pytest.raises(ErrorCodec):
+            codec.decodificar(datos[:largo])
+
+
+def test_bytes_sobrantes():
+    datos = codec.codificar(MENSAJES[0], codec.FORMATO_BINARIO)
+    with pytest.raises(ErrorCodec):
+        codec.decodificar(datos + b"\x00")
+
+
+def test_version_no_soportada():
+    datos = bytearray(codec.codificar(MENSAJES[0], codec.FORMATO_BINARIO))
+    datos[1] = codec.VERSION + 1
+    with pytest.raises(ErrorCodec):
+        codec.decodificar(bytes(datos))
+
+
+def test_basura_solo_levanta_error_codec():
+    azar = random.Random(8)
+    for _ in range(2000):
+        datos = bytes((codec.MAGIA, codec.VERSION)) + azar.randbytes(azar.randint(0, 40))
+        try:
+            codec.decodificar(datos)
+        except ErrorCodec:
+            pass
+
+
+def test_error_codec_es_value_error():
+    # Los receptores atrapan ValueError para JSON invalido y binario corrupto por igual
+    assert issubclass(ErrorCodec, ValueError)
+    with pytest.raises(ValueError):
+        codec.decodificar(b"{no es json")
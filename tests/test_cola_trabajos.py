@@ -0,0 +1,103 @@
+import pytest
+
+import cola_trabajos
+from cola_trabajos import ColaTrabajos, coincide
+
+
+@pytest.fixture
+def reloj(reloj_de):
+    return reloj_de(cola_trabajos)
+
+
+@pytest.fixture
+def cola(tmp_path, reloj):
+    cola = ColaTrabajos(str(tmp_path / "cola.db"), timeout_s=1.0)
+    yield cola
+    cola.cerrar()
+
+
+def trabajo(libro):
+    return {"usuario": "user1", "libro": libro}
+
+
+def test_entrega_en_orden_y_confirma(cola):
+    primero = cola.encolar("devolucion", trabajo("ISBN0001"))
+    cola.encolar("devolucion", trabajo("ISBN0002"))
+    assert primero["id_operacion"]
+
+    id_trabajo, mensaje = cola.tomar("devolucion", b"actor1")
+    assert mensaje == primero
+    assert cola.profundidad() == 1
+
+    mensaje, segundos = cola.confirmar(id_trabajo)
+    assert mensaje == primero and segundos >= 0
+    assert cola.confirmar(id_trabajo) is None
+    assert cola.tomar("devolucion", b"actor1")[1]["libro"] == "ISBN0002"
+    assert cola.tomar("devolucion", b"actor1") is None
+
+
+def test_vencido_se_entrega_de_nuevo_al_frente(cola, reloj):
+    cola.encolar("devolucion", trabajo("ISBN0001"))
+    cola.encolar("devolucion", trabajo("ISBN0002"))
+    id_trabajo, mensaje = cola.tomar("devolucion", b"actor1")
+
+    reloj.ahora += 0.5
+    assert cola.vencidos() == []
+
+    reloj.ahora += 0.6
+    assert cola.vencidos() == [b"actor1"]
+    assert cola.estado()["reentregas"] == 1
+    assert cola.estado()["max_intentos"] == 1
+
+    # Vuelve antes que el segundo, con el mismo id_operacion, y lo puede tomar otro actor
+    otro_id, otro_mensaje = cola.tomar("devolucion", b"actor2")
+    assert otro_id == id_trabajo
+    assert otro_mensaje["id_operacion"] == mensaje["id_operacion"]
+
+    cola.confirmar(otro_id)
+    reloj.ahora += 5
+    assert cola.vencidos() == []
+
+
+def test_confirmacion_tardia_no_se_entrega_otra_vez(cola, reloj):
+    cola.encolar("renovacion", trabajo("ISBN0001"))
+    id_trabajo, _ = cola.tomar("renovacion", b"actor1")
+    reloj.ahora += 2
+    cola.vencidos()
+    assert cola.hay_pendientes()
+
+    mensaje, segundos = cola.confirmar(id_trabajo)
+    assert mensaje["libro"] == "ISBN0001" and segundos is None
+    assert not cola.hay_pendientes()
+    assert cola.tomar("renovacion", b"actor2") is None
+
+
+def test_reinicio_entrega_lo_que_quedo(tmp_path, reloj):
+    archivo = str(tmp_path / "cola.db")
+    cola = ColaTrabajos(archivo)
+    confirmado = cola.encolar("devolucion", trabajo("ISBN0001"))
+    en_vuelo = cola.encolar("devolucion", trabajo("ISBN0002"))
+    pendiente = cola.encolar("devolucion", trabajo("ISBN0003"))
+    cola.confirmar(cola.tomar("devolucion", b"actor1")[0])
+    cola.tomar("devolucion", b"actor1")
+    cola.cerrar()
+
+    cola = ColaTrabajos(archivo)
+    entregados = [cola.tomar("devolucion", b"actor1")[1] for _ in range(2)]
+    assert entregados == [en_vuelo, pendiente]
+    assert confirmado not in entregados
+    assert cola.tomar("devolucion", b"actor1") is None
+    cola.cerrar()
+
+
+def test_canales_por_particion(cola):
+    cola.encolar("devolucion.p2", trabajo("ISBN0002"))
+    cola.encolar("devolucion.p1", trabajo("ISBN0001"))
+
+    assert cola.tomar("devolucion.p1", b"actor_p1")[1]["libro"] == "ISBN0001"
+    assert cola.tomar("devolucion.p1", b"actor_p1") is None
+    assert cola.tomar("renovacion", b"actor") is None
+    assert cola.tomar("devolucion", b"actor")[1]["libro"] == "ISBN0002"
+
+    assert coincide("devolucion", "devolucion.p1")
+    assert not coincide("devolucion", "devolucion_x")
@@ -0,0 +1,90 @@
+import sqlite3
+import threading
+
+import pytest
+
+from commit_agrupado import CommitAgrupado
+from conexion_bd import GestorConexiones, MODO_PERSISTENTE
+
+
+class ConexionesTrazadas(GestorConexiones):
+    """Conexiones persistentes que anotan cada sentencia que ejecuta SQLite"""
+
+    def __init__(self, db_file):
+        super().__init__(db_file, modo=MODO_PERSISTENTE)
+        self.sentencias = []
+
+    def _abrir(self):
+        conn = super()._abrir()
+        conn.set_trace_callback(self.sentencias.append)
+        return conn
+
+
+def aplicar(cursor, operacion, codigo, usuario, traza=None, id_operacion=None):
+    """Escritura de prueba: anota el prestamo y falla despues de escribir si el libro es 'ROTO'"""
+    cursor.execute("INSERT INTO prestamos (codigo, usuario) VALUES (?, ?)", (codigo, usuario))
+    if codigo == "ROTO":
+        raise sqlite3.IntegrityError("libro roto")
+    return {"exito": True, "mensaje": f"{operacion} {codigo}"}, {"codigo": codigo}
+
+
+def crear_bd(tmp_path):
+    db_file = str(tmp_path / "bd.db")
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE prestamos (codigo TEXT NOT NULL, usuario TEXT NOT NULL)")
+    conn.commit()
+    conn.close()
+    return db_file
+
+
+def enviar_juntas(commit, codigos):
+    """Envia una escritura por hilo, todas a la vez; devuelve codigo -> respuesta"""
+    respuestas = {}
+    hilos = [threading.Thread(target=lambda c=c: respuestas.__setitem__(c, commit.enviar("prestamo", c, "u1")))
+             for c in codigos]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(10)
+    return respuestas
+
+
+def test_un_commit_por_lote(tmp_path):
+    conexiones = ConexionesTrazadas(crear_bd(tmp_path))
+    confirmados = []
+    commit = CommitAgrupado(conexiones, aplicar, al_confirmar=confirmados.extend, ventana_ms=2000, max_lote=8)
+
+    codigos = [f"ISBN{i:04d}" for i in range(8)]
+    respuestas = enviar_juntas(commit, codigos)
+
+    assert all(respuestas[c]["exito"] for c in codigos)
+    assert commit.estadisticas()["lotes"] == 1
+    assert conexiones.sentencias.count("COMMIT") == 1
+    assert sorted(cambio["codigo"] for cambio in confirmados) == codigos
+
+    conn = sqlite3.connect(conexiones.db_file)
+    assert conn.execute("SELECT COUNT(*) FROM prestamos").fetchone()[0] == 8
+
+
+def test_escritura_fallida_solo_deshace_su_savepoint(tmp_path):
+    conexiones = ConexionesTrazadas(crear_bd(tmp_path))
+    confirmados = []
+    commit = CommitAgrupado(conexiones, aplicar, al_confirmar=confirmados.extend, ventana_ms=2000, max_lote=4)
+
+    respuestas = enviar_juntas(commit, ["ISBN0001", "ROTO", "ISBN0002", "ISBN0003"])
+
+    assert commit.estadisticas()["lotes"] == 1
+    assert conexiones.sentencias.count("COMMIT") == 1
+    assert not respuestas["ROTO"]["exito"]
+    assert "libro roto" in respuestas["ROTO"]["mensaje"]
+    assert all(respuestas[c]["exito"] for c in ("ISBN0001", "ISBN0002", "ISBN0003"))
+    assert "ROTO" not in [cambio["codigo"] for cambio in confirmados]
+
+    conn = sqlite3.connect(conexiones.db_file)
+    codigos = sorted(fila[0] for fila in conn.execute("SELECT codigo FROM prestamos"))
+    assert codigos == ["ISBN0001", "ISBN0002", "ISBN0003"]
+
+
+def test_requiere_conexiones_persistentes(tmp_path):
+    with pytest.raises(ValueError):
+        CommitAgrupado(GestorConexiones(crear_bd(tmp_path)), aplicar)
@@ -0,0 +1,117 @@
+import socket
+import sqlite3
+import threading
+import time
+
+import pytest
+import zmq
+
+import codec
+from filtro_libros import FiltroBloom, FiltroCatalogo
+from gestor_almacenamiento import GestorAlmacenamiento
+
+INEXISTENTE = "ISBN9999"
+
+
+def codigos(cantidad):
+    return [f"ISBN{i:07d}" for i in range(1, cantidad + 1)]
+
+
+def test_sin_falsos_negativos():
+    filtro = FiltroBloom.para(10000, 0.01)
+    for codigo in codigos(10000):
+        filtro.agregar(codigo)
+
+    assert all(codigo in filtro for codigo in codigos(10000))
+    assert filtro.elementos == 10000
+
+
+def test_tasa_de_falsos_positivos():
+    filtro = FiltroBloom.para(10000, 0.01)
+    for codigo in codigos(10000):
+        filtro.agregar(codigo)
+
+    falsos = sum(f"OTRO{i:07d}" in filtro for i in range(20000)) / 20000
+    assert falsos < 0.02
+    assert filtro.tasa_falsos() == pytest.approx(0.01, rel=0.2)
+
+
+def test_se_reconstruye_desde_sus_bytes():
+    filtro = FiltroBloom.para(500)
+    for codigo in codigos(500):
+        filtro.agregar(codigo)
+
+    copia = FiltroBloom(filtro.bits, filtro.hashes, bytes(filtro.datos), filtro.elementos)
+    assert all(codigo in copia for codigo in codigos(500))
+    assert copia.estado() == filtro.estado()
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def ga(tmp_path, monkeypatch):
+    """GA del mismo proceso atendido por un REP propio (el bloque del filtro va en un segundo frame)"""
+    monkeypatch.chdir(tmp_path)
+    ga = GestorAlmacenamiento(1, puerto_rep=str(puerto_libre()), libros_iniciales=1000, prestamos_iniciales=0)
+    ga.endpoint = f"tcp://127.0.0.1:{puerto_libre()}"
+    detener = threading.Event()
+
+    def atender():
+        rep = ga.context.socket(zmq.REP)
+        rep.bind(ga.endpoint)
+        while not detener.is_set():
+            if rep.poll(50):
+                respuesta = ga.procesar_solicitud(codec.decodificar(rep.recv())[0])
+                rep.send_multipart([codec.codificar({k: v for k, v in respuesta.items() if k != "datos"}),
+                                    respuesta.get("datos", b"")])
+        rep.close(linger=0)
+
+    hilo = threading.Thread(target=atender, daemon=True)
+    hilo.start()
+    yield ga
+    detener.set()
+    hilo.join(5)
+    ga.context.destroy(linger=0)
+
+
+def esperar(condicion, segundos=5.0):
+    limite = time.monotonic() + segundos
+    while not condicion():
+        assert time.monotonic() < limite, "condicion no cumplida a tiempo"
+        time.sleep(0.01)
+
+
+def test_no_existe_solo_dentro_de_la_vigencia(ga):
+    context = zmq.Context()
+    catalogo = FiltroCatalogo(context, {None: ga.endpoint}, refresco_s=60, vigencia_s=0.5)
+    esperar(lambda: catalogo.actualizaciones == 1)
+
+    assert catalogo.existe("ISBN0001")
+    assert not catalogo.existe(INEXISTENTE)
+
+    # Vencida la vigencia el ausente sigue al GA y se vuelve a pedir el filtro; el GA
+    # responde sin_cambios y eso renueva la confirmacion
+    time.sleep(0.6)
+    assert catalogo.existe(INEXISTENTE)
+    assert catalogo.vencidos == 1
+    esperar(lambda: not catalogo.existe(INEXISTENTE))
+    assert catalogo.actualizaciones == 1
+
+    # Un libro nuevo se rechaza hasta que vence la vigencia, y el refresco lo incorpora
+    conn = sqlite3.connect("bd_sede1.db")
+    conn.execute("INSERT INTO libros VALUES ('NUEVO0001', 'Nuevo', 'Autor', 1, 1)")
+    conn.commit()
+    assert not catalogo.existe("NUEVO0001")
+
+    time.sleep(0.6)
+    assert catalogo.existe("NUEVO0001")
+    esperar(lambda: catalogo.actualizaciones == 2)
+    assert catalogo.existe("NUEVO0001")
+    assert not catalogo.existe(INEXISTENTE)
+    assert catalogo.estado()["filtros"]["catalogo"]["elementos"] == 1001
+
+    context.destroy(linger=0)
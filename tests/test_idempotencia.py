@@ -0,0 +1,141 @@
+import socket
+import sqlite3
+import threading
+
+import pytest
+
+import idempotencia
+from conexion_bd import GestorConexiones, MODO_EFIMERA, MODO_PERSISTENTE
+from gestor_almacenamiento import GestorAlmacenamiento
+from idempotencia import CacheIdempotencia
+
+HUELLA = ("prestamo", "user1", "ISBN0001")
+
+
+@pytest.fixture
+def reloj(reloj_de):
+    return reloj_de(idempotencia)
+
+
+def test_guarda_y_devuelve(reloj):
+    cache = CacheIdempotencia(capacidad=10, ttl_s=60)
+    assert cache.obtener("k1") is None
+
+    cache.guardar("k1", HUELLA, {"exito": True})
+    assert cache.obtener("k1") == (HUELLA, {"exito": True})
+    assert len(cache) == 1
+
+
+def test_expulsa_la_menos_usada(reloj):
+    cache = CacheIdempotencia(capacidad=3, ttl_s=60)
+    for clave in ("k1", "k2", "k3"):
+        cache.guardar(clave, HUELLA, {"clave": clave})
+
+    # k1 se usa: la menos usada pasa a ser k2
+    assert cache.obtener("k1")
+    cache.guardar("k4", HUELLA, {"clave": "k4"})
+
+    assert cache.obtener("k2") is None
+    assert [clave for clave in ("k1", "k3", "k4") if cache.obtener(clave)] == ["k1", "k3", "k4"]
+    assert len(cache) == 3
+    assert cache.estado()["expulsiones"] == 1
+
+
+def test_vence_con_el_ttl(reloj):
+    cache = CacheIdempotencia(capacidad=10, ttl_s=60)
+    cache.guardar("k1", HUELLA, {"exito": True})
+
+    reloj.ahora += 59.9
+    assert cache.obtener("k1")
+    reloj.ahora += 0.1
+    assert cache.obtener("k1") is None
+    assert len(cache) == 0
+
+
+def test_guardar_descarta_vencidas_aunque_sobre_lugar(reloj):
+    cache = CacheIdempotencia(capacidad=10, ttl_s=60)
+    cache.guardar("k1", HUELLA, {})
+    reloj.ahora += 61
+    cache.guardar("k2", HUELLA, {})
+
+    assert len(cache) == 1
+    assert cache.estado()["expulsiones"] == 0
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return str(s.getsockname()[1])
+
+
+@pytest.fixture
+def ga(tmp_path, monkeypatch, request):
+    """GA del mismo proceso; request.param elige el modo de conexion (por defecto efimera)"""
+    monkeypatch.chdir(tmp_path)
+    conexiones = GestorConexiones("bd_sede1.db", modo=getattr(request, "param", MODO_EFIMERA))
+    ga = GestorAlmacenamiento(1, puerto_rep=puerto_libre(), conexiones=conexiones, libros_iniciales=100,
+                              prestamos_iniciales=0)
+    yield ga
+    ga.context.destroy(linger=0)
+
+
+def solicitar(ga, operacion, codigo, usuario="user1", id_operacion="k1"):
+    return ga.procesar_solicitud({"operacion": operacion, "codigo": codigo, "usuario": usuario,
+                                  "id_operacion": id_operacion})
+
+
+def disponibles(ga, codigo):
+    with sqlite3.connect(ga.db_file) as conn:
+        return conn.execute("SELECT ejemplares_disponibles FROM libros WHERE codigo = ?", (codigo,)).fetchone()[0]
+
+
+def test_ga_id_repetido_devuelve_la_respuesta_guardada(ga):
+    antes = disponibles(ga, "ISBN0001")
+    primera = solicitar(ga, "prestamo_condicional", "ISBN0001")
+    repetida = solicitar(ga, "prestamo_condicional", "ISBN0001")
+
+    assert primera["exito"] and "duplicada" not in primera
+    assert repetida == {**primera, "duplicada": True}
+    # prestamo y prestamo_condicional son la misma operacion
+    assert solicitar(ga, "prestamo", "ISBN0001")["duplicada"]
+    assert disponibles(ga, "ISBN0001") == antes - 1
+
+
+@pytest.mark.parametrize("ga", [MODO_EFIMERA, MODO_PERSISTENTE], indirect=True)
+def test_ga_id_repetido_en_paralelo_se_aplica_una_vez(ga):
+    # Varios hilos envian a la vez las mismas operaciones, como una reentrega de la cola
+    # mientras el GA todavia atiende la primera
+    ids = 40
+    antes = {i: disponibles(ga, f"ISBN{i:04d}") for i in range(1, ids + 1)}
+    respuestas = []
+
+    def enviar():
+        for i in range(1, ids + 1):
+            respuestas.append(solicitar(ga, "prestamo_condicional", f"ISBN{i:04d}", id_operacion=f"k{i}"))
+
+    hilos = [threading.Thread(target=enviar) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(30)
+
+    assert len(respuestas) == 4 * ids
+    assert [r for r in respuestas if not r["exito"]] == []
+    assert sum(1 for r in respuestas if not r.get("duplicada")) == ids
+    assert {i: disponibles(ga, f"ISBN{i:04d}") for i in antes} == {i: n - 1 for i, n in antes.items()}
+
+
+@pytest.mark.parametrize("operacion, codigo, usuario", [
+    ("prestamo_condicional", "ISBN0002", "user1"),
+    ("prestamo_condicional", "ISBN0001", "user2"),
+    ("devolucion", "ISBN0001", "user1"),
+])
+def test_ga_id_repetido_con_otra_operacion_se_rechaza(ga, operacion, codigo, usuario):
+    solicitar(ga, "prestamo_condicional", "ISBN0001")
+    antes = disponibles(ga, codigo)
+
+    respuesta = solicitar(ga, operacion, codigo, usuario)
+
+    assert not respuesta["exito"] and "duplicada" not in respuesta
+    assert "otra operacion" in respuesta["mensaje"]
+    assert disponibles(ga, codigo) == antes
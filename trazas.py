@@ -0,0 +1,228 @@
+"""
+Trazas de solicitudes de extremo a extremo
+
+Una solicitud lleva en su mensaje el campo "traza": {"id": <traza>, "span": <span
+padre>}. Cada proceso que la atiende abre un span hijo (con su inicio y su fin),
+lo propaga en los mensajes que envia y, al cerrarlo, lo escribe en su archivo
+local de trazas (una linea JSON por span). analizar_trazas.py junta los archivos
+de todos los procesos y reconstruye cada solicitud.
+
+El punto de entrada (PS, o el GC si el PS no traza) decide con el muestreo que
+solicitudes se trazan; los demas procesos solo continuan las trazas que llegan.
+Sin archivo de trazas los spans no hacen nada.
+
+Los inicios son time.time() de cada maquina: entre maquinas distintas los
+tiempos relativos dependen de la sincronizacion de relojes (NTP).
+"""
+import atexit
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+CAMPO_TRAZA = "traza"
+
+
+def _nuevo_id(bits):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    def __init__(self, trazador, nombre, traza, padre, atributos):
+        self.trazador = trazador
+        self.nombre = nombre
+        self.traza = traza
+        self.id = _nuevo_id(32)
+        self.padre = padre
+        self.atributos = atributos
+        self.resultado = None
+        self.inicio = time.time()
+        self._t0 = time.perf_counter()
+
+    def contexto(self):
+        """Contexto a propagar: los spans abiertos con el seran hijos de este"""
+        return {"id": self.traza, "span": self.id}
+
+    def propagar(self, mensaje):
+        """Agrega el contexto de este span a un mensaje (dict) saliente"""
+        mensaje[CAMPO_TRAZA] = self.contexto()
+        return mensaje
+
+    def hijo(self, nombre, **atributos):
+        """Span hijo en el mismo proceso (por ejemplo, la ida y vuelta a otro proceso)"""
+        return Span(self.trazador, nombre, self.traza, self.id, atributos)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, tb):
+        if tipo is not None and self.resultado is None:
+            self.resultado = "error"
+        self.cerrar()
+        return False
+
+    def cerrar(self):
+        """Termina el span y lo escribe (para spans que siguen abiertos fuera de un with)"""
+        self.trazador._escribir({
+            "traza": self.traza,
+            "span": self.id,
+            "padre": self.padre,
+            "proceso": self.trazador.proceso,
+            "nombre": self.nombre,
+            "inicio": round(self.inicio, 6),
+            "duracion_ms": round((time.perf_counter() - self._t0) * 1000, 3),
+            "resultado": self.resultado,
+            **self.atributos
+        })
+
+
+class _SpanInactivo:
+    """Span de una solicitud que no se traza: no mide ni escribe nada"""
+    resultado = None
+
+    def contexto(self):
+        return None
+
+    def propagar(self, mensaje):
+        return mensaje
+
+    def hijo(self, nombre, **atributos):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, tb):
+        return False
+
+    def cerrar(self):
+        pass
+
+    def __setattr__(self, nombre, valor):
+        pass
+
+
+SPAN_INACTIVO = _SpanInactivo()
+
+
+class Trazador:
+    def __init__(self, proceso, archivo=None, muestreo=1):
+        """
+        Args:
+            proceso: nombre del proceso (se incluye en cada span)
+            archivo: archivo JSON lines donde se escriben los spans (None = sin trazas)
+            muestreo: en los puntos de entrada, trazar 1 de cada N solicitudes
+        """
+        self.proceso = proceso
+        self.archivo = archivo
+        self.muestreo = max(muestreo, 1)
+        self._contador = itertools.count()
+        self._cola = None
+
+        if archivo:
+            directorio = os.path.dirname(archivo)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            self._cola = queue.SimpleQueue()
+            self._hilo = threading.Thread(target=self._escritor, daemon=True)
+            self._hilo.start()
+            atexit.register(self.detener)
+
+    @property
+    def activo(self):
+        return self._cola is not None
+
+    def span(self, nombre, mensaje=None, raiz=False, **atributos):
+        """
+        Abre el span de una solicitud recibida
+
+        Args:
+            nombre: operacion que atiende este proceso
+            mensaje: solicitud recibida (dict); si trae contexto de traza el span es su hijo
+            raiz: este proceso es punto de entrada: si la solicitud no trae traza se
+                  empieza una (segun el muestreo)
+            atributos: campos extra del span (codigo, usuario, ...)
+
+        Returns:
+            un Span, o SPAN_INACTIVO si la solicitud no se traza
+        """
+        if not self.activo:
+            return SPAN_INACTIVO
+
+        contexto = mensaje.get(CAMPO_TRAZA) if isinstance(mensaje, dict) else None
+        if contexto:
+            return Span(self, nombre, contexto["id"], contexto.get("span"), atributos)
+        if raiz and next(self._contador) % self.muestreo == 0:
+            return Span(self, nombre, _nuevo_id(64), None, atributos)
+        return SPAN_INACTIVO
+
+    def registrar(self, nombre, contexto, inicio, duracion, resultado=None, **atributos):
+        """
+        Escribe un span ya medido, hijo de contexto (por ejemplo, la transaccion
+        de la replica que aplico operaciones de varias trazas)
+
+        Args:
+            contexto: {"id": traza, "span": padre} que trajo la operacion
+            inicio: time.time() del comienzo
+            duracion: segundos
+        """
+        if self.activo and contexto:
+            self._escribir({
+                "traza": contexto["id"],
+                "span": _nuevo_id(32),
+                "padre": contexto.get("span"),
+                "proceso": self.proceso,
+                "nombre": nombre,
+                "inicio": round(inicio, 6),
+                "duracion_ms": round(duracion * 1000, 3),
+                "resultado": resultado,
+                **atributos
+            })
+
+    def _escribir(self, registro):
+        if self._cola is not None:
+            self._cola.put(registro)
+
+    def _escritor(self):
+        # Un solo hilo escribe; junta lo encolado y escribe en bloque
+        with open(self.archivo, "a", encoding="utf-8") as f:
+            while True:
+                registro = self._cola.get()
+                if registro is None:
+                    break
+                lineas = [registro]
+                try:
+                    while len(lineas) < 1000:
+                        lineas.append(self._cola.get_nowait())
+                except queue.Empty:
+                    pass
+                fin = None in lineas
+                f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in lineas if r is not None))
+                f.flush()
+                if fin:
+                    break
+
+    def detener(self):
+        """Escribe los spans pendientes y termina el hilo escritor"""
+        if self._cola is not None:
+            self._cola.put(None)
+            self._hilo.join(timeout=5)
+            self._cola = None
+
+
+INACTIVO = Trazador("inactivo")
+
+
+def agregar_argumentos(parser):
+    """Opciones de trazas comunes para el argparse de cada proceso"""
+    parser.add_argument("--trazas-archivo", default=None,
+                        help="archivo JSON lines donde escribir los spans de las solicitudes trazadas")
+    parser.add_argument("--trazas-muestreo", type=int, default=1,
+                        help="en los puntos de entrada (PS, GC), trazar 1 de cada N solicitudes")
+
+
+def desde_args(proceso, args):
+    return Trazador(proceso, args.trazas_archivo, args.trazas_muestreo)